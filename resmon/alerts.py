@@ -0,0 +1,498 @@
+"""Threshold alerts evaluated on every sample.
+
+Rules are read from a JSON file::
+
+    {
+        "rules": [
+            {
+                "name": "cpu_busy",
+                "metric": "cpu_usage",
+                "aggregate": "min",
+                "window": 300,
+                "above": 90,
+                "clear": 80,
+                "actions": [
+                    {"type": "log"},
+                    {"type": "exec", "command": "notify-send \\"$RESMON_ALERT $RESMON_STATE\\""},
+                    {"type": "socket", "path": "/run/resmon-alerts.sock"}
+                ]
+            }
+        ]
+    }
+
+A rule fires when the aggregate of its metric over the last ``window``
+seconds goes ``above`` (or ``below``) its threshold, and resolves only once
+the aggregate is back past ``clear``, so a value hovering at the threshold
+does not page over and over. Rules are only checked once the window is full.
+
+Aggregates are kept incrementally as samples enter and leave the window:
+the mean from a running sum, min and max from monotonic deques, and
+percentiles (e.g. "p95") from a fixed-bin histogram over the rule's
+``range``, so every sample costs the same however long the window is.
+
+Actions receive the rule, its new state ("firing" or "resolved") and the
+aggregate value; more can be added with register_action().
+"""
+import collections
+import json
+import math
+import numbers
+import os
+import socket
+import subprocess
+
+# bins of the histograms behind percentile aggregates
+PERCENTILE_BINS = 200
+
+
+class WindowMean:
+    """Mean of the values in a sliding time window.
+
+    Like every aggregate here, add() and remove() are called with the values
+    in the order they enter and leave the window.
+    """
+
+    def __init__(self):
+        """Initialize an empty WindowMean."""
+        self.total = 0.0
+        self.count = 0
+
+    def add(self, value):
+        """Add a value entering the window.
+
+        Args:
+            value (float): The new value.
+        """
+        self.total += value
+        self.count += 1
+
+    def remove(self, value):
+        """Remove a value leaving the window.
+
+        Args:
+            value (float): The oldest value in the window.
+        """
+        self.total -= value
+        self.count -= 1
+
+    def value(self):
+        """Return the mean of the window, or NaN if it is empty."""
+        return self.total / self.count if self.count else math.nan
+
+
+class WindowExtreme:
+    """Max (or min) of the values in a sliding time window.
+
+    A deque holds the candidates in decreasing (or increasing) order; a new
+    value drops every candidate it beats, so each value is pushed and popped
+    at most once.
+    """
+
+    def __init__(self, maximum=True):
+        """Initialize an empty WindowExtreme.
+
+        Args:
+            maximum (bool, optional): Track the max, else the min. Defaults to True.
+        """
+        self.sign = 1 if maximum else -1
+        # (number of the value, value)
+        self.candidates = collections.deque()
+        self.added = 0
+        self.removed = 0
+
+    def add(self, value):
+        """Add a value entering the window, dropping the candidates it beats.
+
+        Args:
+            value (float): The new value.
+        """
+        key = self.sign * value
+        while self.candidates and self.sign * self.candidates[-1][1] <= key:
+            self.candidates.pop()
+        self.candidates.append((self.added, value))
+        self.added += 1
+
+    def remove(self, value):
+        """Remove a value leaving the window.
+
+        Args:
+            value (float): The oldest value in the window. Only the count of
+                removed values is needed, since candidates are numbered.
+        """
+        # values leave in the order they were added
+        self.removed += 1
+        while self.candidates and self.candidates[0][0] < self.removed:
+            self.candidates.popleft()
+
+    def value(self):
+        """Return the max (or min) of the window, or NaN if it is empty."""
+        return self.candidates[0][1] if self.candidates else math.nan
+
+
+class WindowPercentile:
+    """Approximate percentile of the values in a sliding time window.
+
+    Values are counted in PERCENTILE_BINS equal bins over [low, high], so
+    the result is the upper edge of the bin holding the percentile, accurate
+    to one bin width; values outside the range are counted in the first or
+    last bin.
+    """
+
+    def __init__(self, percentile, low=0.0, high=100.0):
+        """Initialize an empty WindowPercentile.
+
+        Args:
+            percentile (float): Percentile returned, from 0 to 100.
+            low (float, optional): Lower edge of the first bin. Defaults to 0.
+            high (float, optional): Upper edge of the last bin. Defaults to 100.
+        """
+        self.percentile = percentile
+        self.low = low
+        self.width = (high - low) / PERCENTILE_BINS
+        self.bins = [0] * PERCENTILE_BINS
+        self.count = 0
+
+    def _bin(self, value):
+        """Return the number of the bin a value is counted in."""
+        return min(PERCENTILE_BINS - 1, max(0, int((value - self.low) / self.width)))
+
+    def add(self, value):
+        """Count a value entering the window in its bin.
+
+        Args:
+            value (float): The new value.
+        """
+        self.bins[self._bin(value)] += 1
+        self.count += 1
+
+    def remove(self, value):
+        """Uncount a value leaving the window.
+
+        Args:
+            value (float): The oldest value in the window.
+        """
+        self.bins[self._bin(value)] -= 1
+        self.count -= 1
+
+    def value(self):
+        """Return the estimated percentile of the window, or NaN if it is empty."""
+        if not self.count:
+            return math.nan
+        rank = self.percentile / 100 * self.count
+        seen = 0
+        for index, count in enumerate(self.bins):
+            seen += count
+            if seen >= rank and count:
+                # upper edge of the bin, so the estimate errs on the high side
+                return self.low + (index + 1) * self.width
+        return self.low + PERCENTILE_BINS * self.width
+
+
+def make_aggregate(name, value_range=(0.0, 100.0)):
+    """Create the sliding window aggregate named in a rule.
+
+    Args:
+        name (str): "mean", "max", "min" or "p<percentile>", e.g. "p95".
+        value_range (tuple, optional): (low, high) covered by percentile histograms.
+
+    Returns:
+        The aggregate, with add(), remove() and value() methods.
+    """
+    if name == "mean":
+        return WindowMean()
+    if name in ("max", "min"):
+        return WindowExtreme(maximum=name == "max")
+    if name.startswith("p"):
+        try:
+            percentile = float(name[1:])
+        except ValueError:
+            percentile = -1
+        if 0 <= percentile <= 100:
+            return WindowPercentile(percentile, *value_range)
+    raise ValueError(f"unknown aggregate: {name}")
+
+
+class Rule:
+    """A threshold on the sliding window aggregate of one metric.
+
+    Attributes:
+        name (str): Name used in messages and passed to actions.
+        metric (str): Sample key checked.
+        aggregate_name (str): Aggregate of the window, e.g. "mean" or "p95".
+        window (float): Seconds of samples aggregated.
+        above (bool): Fire when the aggregate is above the threshold, else below it.
+        threshold (float): Value the aggregate has to pass to fire.
+        clear (float): Value the aggregate has to pass back to resolve.
+        actions (list): Actions run when the rule fires or resolves.
+        first_seen (float): POSIX time of the first sample, or None.
+        full (bool): The samples have covered a whole window.
+        firing (bool): The rule is currently firing.
+        last_value (float): Aggregate after the last sample.
+    """
+
+    def __init__(self, config):
+        """Initialize the Rule.
+
+        Args:
+            config (dict): The rule's entry in the rules file.
+        """
+        self.name = config["name"]
+        self.metric = config["metric"]
+        self.aggregate_name = config.get("aggregate", "mean")
+        self.window = float(config.get("window", 60))
+        if ("above" in config) == ("below" in config):
+            raise ValueError(f"rule {self.name} needs exactly one of above and below")
+        self.above = "above" in config
+        self.threshold = float(config["above" if self.above else "below"])
+        self.clear = float(config.get("clear", self.threshold))
+        self.aggregate = make_aggregate(self.aggregate_name, tuple(config.get("range", (0, 100))))
+        self.actions = [make_action(action) for action in config.get("actions", [{"type": "log"}])]
+        self.samples = collections.deque()
+        self.first_seen = None
+        self.full = False
+        self.firing = False
+        self.last_value = math.nan
+
+    def _passes(self, value, limit):
+        """Return True if value is past limit in the rule's direction."""
+        return value > limit if self.above else value < limit
+
+    def update(self, timestamp, value):
+        """Add a sample and check the threshold.
+
+        Args:
+            timestamp (float): POSIX time of the sample.
+            value (float): Value of the metric.
+
+        Returns:
+            str: "firing" or "resolved" if the state changed, else None.
+        """
+        if value != value:
+            return None
+        if self.first_seen is None:
+            self.first_seen = timestamp
+        self.samples.append((timestamp, value))
+        self.aggregate.add(value)
+        while self.samples[0][0] <= timestamp - self.window:
+            self.aggregate.remove(self.samples.popleft()[1])
+        self.last_value = self.aggregate.value()
+        # wait until samples have been seen for the whole window; the oldest
+        # sample kept is up to one interval younger than the window
+        if not self.full:
+            self.full = timestamp - self.first_seen >= self.window
+            if not self.full:
+                return None
+        if not self.firing and self._passes(self.last_value, self.threshold):
+            self.firing = True
+            return "firing"
+        if self.firing and not self._passes(self.last_value, self.clear):
+            self.firing = False
+            return "resolved"
+        return None
+
+
+class LogAction:
+    """Print the alert to the console."""
+
+    def __init__(self, config):
+        """Initialize the LogAction.
+
+        Args:
+            config (dict): The action's entry in the rules file; it has no options.
+        """
+
+    def run(self, rule, state):
+        """Print the alert.
+
+        Args:
+            rule (Rule): Rule that changed state.
+            state (str): "firing" or "resolved".
+        """
+        print(
+            f"ALERT {rule.name} {state}: {rule.aggregate_name} of {rule.metric} over "
+            f"{rule.window:g}s is {rule.last_value:.2f} "
+            f"({'above' if rule.above else 'below'} {rule.threshold:g})"
+        )
+
+
+class ExecAction:
+    """Run a shell command with the alert in RESMON_* environment variables.
+
+    The command is started without waiting for it, so a slow command can
+    not hold up sampling.
+    """
+
+    def __init__(self, config):
+        """Initialize the ExecAction.
+
+        Args:
+            config (dict): The action's entry in the rules file, with the shell "command".
+        """
+        self.command = config["command"]
+        self.running = []
+
+    def run(self, rule, state):
+        """Start the command for an alert.
+
+        Args:
+            rule (Rule): Rule that changed state.
+            state (str): "firing" or "resolved".
+        """
+        # reap commands started by earlier alerts
+        self.running = [process for process in self.running if process.poll() is None]
+        environment = dict(os.environ)
+        environment.update(
+            RESMON_ALERT=rule.name,
+            RESMON_STATE=state,
+            RESMON_METRIC=rule.metric,
+            RESMON_VALUE=f"{rule.last_value:g}",
+        )
+        try:
+            self.running.append(subprocess.Popen(self.command, shell=True, env=environment))
+        except OSError as error:
+            print(f"Could not run alert command for {rule.name}: {error}")
+
+
+class SocketAction:
+    """Send the alert as a JSON datagram to a local Unix socket."""
+
+    def __init__(self, config):
+        """Initialize the SocketAction.
+
+        Args:
+            config (dict): The action's entry in the rules file, with the socket "path".
+        """
+        self.path = config["path"]
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.socket.setblocking(False)
+
+    def run(self, rule, state):
+        """Send the alert without blocking; a send that fails is reported, not retried.
+
+        Args:
+            rule (Rule): Rule that changed state.
+            state (str): "firing" or "resolved".
+        """
+        message = {
+            "alert": rule.name,
+            "state": state,
+            "metric": rule.metric,
+            "aggregate": rule.aggregate_name,
+            "value": rule.last_value,
+            "threshold": rule.threshold,
+        }
+        try:
+            self.socket.sendto(json.dumps(message).encode(), self.path)
+        except OSError as error:
+            print(f"Could not send alert {rule.name} to {self.path}: {error}")
+
+
+ACTIONS = {"log": LogAction, "exec": ExecAction, "socket": SocketAction}
+
+
+def register_action(name, action_class):
+    """Make a new action type available to rules files.
+
+    Args:
+        name (str): Value of "type" in the rules file.
+        action_class (type): Class taking the action's config dict, with a run(rule, state) method.
+    """
+    ACTIONS[name] = action_class
+
+
+def make_action(config):
+    """Create the action described by a rules file entry.
+
+    Args:
+        config (dict): The action's entry, with its "type".
+
+    Returns:
+        The action.
+    """
+    try:
+        action_class = ACTIONS[config["type"]]
+    except KeyError:
+        raise ValueError(f"unknown alert action: {config.get('type')}")
+    return action_class(config)
+
+
+class AlertEngine:
+    """Evaluates every rule on every sample.
+
+    Attributes:
+        rules (list): The Rules checked.
+    """
+
+    def __init__(self, rules):
+        """Initialize the AlertEngine.
+
+        Args:
+            rules (list): Rules to check.
+        """
+        self.rules = rules
+
+    @classmethod
+    def from_file(cls, filename):
+        """Load the rules of a JSON rules file.
+
+        Args:
+            filename (str): Path of the rules file.
+
+        Returns:
+            AlertEngine: Engine checking the rules.
+        """
+        with open(filename) as f:
+            config = json.load(f)
+        return cls([Rule(rule) for rule in config["rules"]])
+
+    def evaluate(self, sample):
+        """Feed a sample to every rule and run the actions of those that changed state.
+
+        Args:
+            sample (dict): Sample values, with "time" as a datetime.
+        """
+        timestamp = sample["time"].timestamp()
+        for rule in self.rules:
+            value = sample.get(rule.metric)
+            # series like top_processes are not numbers and can not be aggregated
+            if not isinstance(value, numbers.Real) or isinstance(value, bool):
+                continue
+            state = rule.update(timestamp, float(value))
+            if state is None:
+                continue
+            for action in rule.actions:
+                try:
+                    action.run(rule, state)
+                except Exception as error:
+                    print(f"Alert action for {rule.name} failed: {error}")
+
+
+def add_alert_arguments(parser):
+    """Add the alert rules option to a command-line parser.
+
+    Args:
+        parser (argparse.ArgumentParser): Parser to extend.
+    """
+    parser.add_argument(
+        "--alert-rules",
+        help="JSON file of threshold alert rules checked on every sample",
+    )
+
+
+def open_alerts(args):
+    """Load the alert rules if a rules file was given.
+
+    Args:
+        args (argparse.Namespace): Options added by add_alert_arguments.
+
+    Returns:
+        AlertEngine: The engine, or None.
+    """
+    if not args.alert_rules:
+        return None
+    try:
+        engine = AlertEngine.from_file(args.alert_rules)
+    except (OSError, ValueError, KeyError, TypeError) as error:
+        raise SystemExit(f"Could not load alert rules from {args.alert_rules}: {error}")
+    print(f"Loaded {len(engine.rules)} alert rule(s) from {args.alert_rules}")
+    return engine
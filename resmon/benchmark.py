@@ -0,0 +1,463 @@
+"""Benchmarks of resmon's own costs.
+
+Generates a synthetic sample log of a given size and metric count, then
+measures:
+
+- collection: update_data() latency per tick, with psutil replaced by a
+  fake that replays the generated samples, so the numbers do not depend on
+  the machine's load;
+- write: samples per second and MB/s written to JSON and binary logs;
+- queries: history read latency for several windows, cold and cached;
+- render: full draw and blitted frame times of a live graph's figure,
+  drawn offscreen with the Agg backend;
+- startup: time a fresh interpreter takes to import the GUI, i.e. until its
+  window can be shown, and then to load matplotlib for the first figure.
+
+Results are saved as JSON and can be compared with an earlier run::
+
+    python benchmark.py --size-mb 100 --metrics 20 --output after.json --compare before.json
+    python benchmark.py generate big.txt --size-mb 1024
+"""
+import argparse
+import collections
+import datetime
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+import psutil
+
+import collector
+import logstore
+import metrics
+import rollup
+
+# metrics of generated logs, padded with metric_<n> up to the metric count
+STANDARD_METRICS = [key for source in collector.collectors.values() for key in source.keys]
+STANDARD_METRICS.append("collect_ms")
+# history windows queried, in seconds; None is the whole log
+QUERY_WINDOWS = (("5m", 300), ("1h", 3600), ("1d", 86400), ("all", None))
+
+
+def percentile(values, q):
+    """Return the q-th percentile of values (nearest rank)."""
+    ordered = sorted(values)
+    if not ordered:
+        return float("nan")
+    return ordered[min(len(ordered) - 1, max(0, round(q / 100 * len(ordered)) - 1))]
+
+
+def metric_names(metrics):
+    """Return the names of the metrics of a generated log."""
+    names = STANDARD_METRICS[:metrics]
+    names += [f"metric_{number}" for number in range(len(names), metrics)]
+    return names
+
+
+def synthetic_records(names, start, count, interval=1.0, seed=0):
+    """Yield synthetic samples that drift randomly within 0..100.
+
+    Args:
+        names (list): Metric names.
+        start (datetime): Time of the first sample.
+        count (int): Number of samples.
+        interval (float, optional): Seconds between samples.
+        seed (int, optional): Random seed, so runs are comparable.
+
+    Yields:
+        dict: Sample values, with "time" as a datetime.
+    """
+    generator = random.Random(seed)
+    values = [generator.uniform(0, 100) for name in names]
+    step = datetime.timedelta(seconds=interval)
+    now = start
+    for index in range(count):
+        record = {"time": now}
+        for position, name in enumerate(names):
+            value = min(100.0, max(0.0, values[position] + generator.uniform(-5, 5)))
+            values[position] = value
+            record[name] = round(value, 2)
+        yield record
+        now += step
+
+
+def generate_log(filename, size_mb, metrics, log_format="json", interval=1.0):
+    """Write a synthetic log of about size_mb ending now, with its rollup tiers.
+
+    Args:
+        filename (str): Path of the log to create; an existing log is replaced.
+        size_mb (float): Approximate size of the log in MB.
+        metrics (int): Number of metrics per sample.
+        log_format (str, optional): One of logstore.LOG_FORMATS.
+        interval (float, optional): Seconds between samples.
+
+    Returns:
+        int: Number of samples written.
+    """
+    for path in [filename] + [f"{filename}.{suffix}" for suffix, period in rollup.ROLLUP_TIERS]:
+        for stale in (path, logstore.index_filename(path)):
+            if os.path.exists(stale):
+                os.remove(stale)
+        logstore.forget_index(path)
+    names = metric_names(metrics)
+    sample = next(synthetic_records(names, datetime.datetime.now(), 1))
+    if log_format == "binary":
+        record_size = logstore.binary_record(names).size
+    else:
+        sample["time"] = logstore.format_time(sample["time"])
+        record_size = len(json.dumps(sample)) + 1
+    count = max(1, int(size_mb * 1024**2 / record_size))
+    start = datetime.datetime.now() - datetime.timedelta(seconds=count * interval)
+    log = rollup.RollupLog(logstore.open_log(filename, log_format))
+    batch = []
+    for record in synthetic_records(names, start, count, interval):
+        batch.append(record)
+        if len(batch) == 10000:
+            log.write(batch)
+            batch = []
+    log.write(batch)
+    log.close()
+    return count
+
+
+class FakePsutil:
+    """Stands in for psutil in the metric collectors, replaying logged samples.
+
+    Cumulative network and disk counters are rebuilt from the logged rates,
+    so the collector does the same work as with real readings.
+    """
+
+    Error = psutil.Error
+
+    def __init__(self, records, interval=1.0):
+        """Initialize the FakePsutil.
+
+        Args:
+            records (iterable): Sample dicts to replay, cycled when exhausted.
+            interval (float, optional): Seconds between the samples.
+        """
+        self.records = list(records)
+        self.interval = interval
+        self.position = 0
+        self.current = self.records[0]
+        self.counters = collections.Counter()
+
+    def next_sample(self):
+        """Move to the next sample and advance the counters."""
+        self.current = self.records[self.position % len(self.records)]
+        self.position += 1
+        for key, field, scale in (
+            ("network_in", "bytes_recv", 1024 / 8),
+            ("network_out", "bytes_sent", 1024 / 8),
+            ("IO_in", "write_bytes", 1024**2),
+            ("IO_out", "read_bytes", 1024**2),
+        ):
+            self.counters[field] += int(self.current.get(key, 0) * scale * self.interval)
+
+    def cpu_percent(self, interval=None, percpu=False):
+        self.next_sample()
+        return self.current.get("cpu_usage", 0.0)
+
+    def cpu_freq(self):
+        return collections.namedtuple("scpufreq", "current min max")(
+            self.current.get("cpu_freq", 0.0), 0.0, 0.0
+        )
+
+    def virtual_memory(self):
+        return collections.namedtuple("svmem", "percent")(self.current.get("mem_usage", 0.0))
+
+    def net_io_counters(self, pernic=False, nowrap=True):
+        return collections.namedtuple("snetio", "bytes_sent bytes_recv")(
+            self.counters["bytes_sent"], self.counters["bytes_recv"]
+        )
+
+    def disk_io_counters(self, perdisk=False, nowrap=True):
+        return collections.namedtuple("sdiskio", "read_bytes write_bytes")(
+            self.counters["read_bytes"], self.counters["write_bytes"]
+        )
+
+    def disk_usage(self, path):
+        return collections.namedtuple("sdiskusage", "percent")(self.current.get("disk_usage", 0.0))
+
+
+def bench_collection(records, ticks):
+    """Time update_data() and current_sample() replaying records through a FakePsutil.
+
+    Args:
+        records (list): Samples to replay.
+        ticks (int): Number of ticks timed.
+
+    Returns:
+        dict: Latencies in milliseconds.
+    """
+    real_psutil = metrics.psutil
+    metrics.psutil = FakePsutil(records)
+    try:
+        collector.set_window(ticks, 1.0)
+        # fresh collectors, so no rates carry over from real readings
+        collector.enable_collectors()
+        collect = []
+        sample = []
+        for tick in range(ticks):
+            start = time.perf_counter()
+            collector.update_data()
+            middle = time.perf_counter()
+            collector.current_sample()
+            sample.append((time.perf_counter() - middle) * 1000)
+            collect.append((middle - start) * 1000)
+    finally:
+        metrics.psutil = real_psutil
+        collector.enable_collectors()
+    return {
+        "collect_p50_ms": percentile(collect, 50),
+        "collect_p99_ms": percentile(collect, 99),
+        "current_sample_p50_ms": percentile(sample, 50),
+    }
+
+
+def bench_write(records, directory, batch_size=60):
+    """Time writing records to every log format in batches, like the LogWriter.
+
+    Args:
+        records (list): Samples to write.
+        directory (str): Directory for the scratch logs.
+        batch_size (int, optional): Samples per write and flush.
+
+    Returns:
+        dict: Samples per second and MB per second of every format.
+    """
+    results = {}
+    for log_format in logstore.LOG_FORMATS:
+        filename = os.path.join(directory, f"write.{log_format}")
+        log = logstore.open_log(filename, log_format)
+        start = time.perf_counter()
+        for first in range(0, len(records), batch_size):
+            log.write(records[first:first + batch_size])
+            log.flush()
+        log.close()
+        elapsed = time.perf_counter() - start
+        results[f"write_{log_format}_samples_per_s"] = len(records) / elapsed
+        results[f"write_{log_format}_mb_per_s"] = os.path.getsize(filename) / 1024**2 / elapsed
+    return results
+
+
+def bench_queries(filename, keys, repeats=3):
+    """Time history reads of several windows, without and with the query cache.
+
+    Args:
+        filename (str): Log to query.
+        keys (list): Keys read, like the legend of one graph.
+        repeats (int, optional): Cold reads per window; the fastest is kept.
+
+    Returns:
+        dict: Latencies in milliseconds and points returned for every window.
+    """
+    log = rollup.RollupLog(logstore.open_log(filename))
+    results = {}
+    first = next(iter(log.iter_records()), None)
+    for name, seconds in QUERY_WINDOWS:
+        if seconds is None:
+            start = first["time"] if first else datetime.datetime.now()
+        else:
+            start = datetime.datetime.now() - datetime.timedelta(seconds=seconds)
+        cold = []
+        for repeat in range(repeats):
+            log.cache.clear()
+            begin = time.perf_counter()
+            temp_data = log.read(start, keys)
+            cold.append((time.perf_counter() - begin) * 1000)
+        begin = time.perf_counter()
+        log.read(start, keys)
+        results[f"query_{name}_cold_ms"] = min(cold)
+        results[f"query_{name}_cached_ms"] = (time.perf_counter() - begin) * 1000
+        results[f"query_{name}_points"] = len(temp_data["time"])
+    return results
+
+
+def bench_render(points, lines, frames):
+    """Time drawing a live graph's figure offscreen with Agg.
+
+    The figure is drawn the way GraphFrame.animate draws it: one full draw
+    caching the background, then frames that restore the background and
+    redraw only the lines.
+
+    Args:
+        points (int): Samples per line.
+        lines (int): Lines in the graph.
+        frames (int): Frames timed.
+
+    Returns:
+        dict: Full draw and frame times in milliseconds.
+    """
+    import numpy as np
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    def walk(count):
+        # resource usage drifts rather than jumping across the whole axis,
+        # and uniform noise would time overdraw instead of a real frame
+        return np.clip(50 + np.cumsum(np.random.uniform(-2, 2, count)), 0, 100)
+
+    figure = Figure(figsize=(10, 6))
+    canvas = FigureCanvasAgg(figure)
+    ax = figure.add_subplot()
+    x_values = np.arange(points, dtype=float)
+    plots = [
+        ax.plot(x_values, walk(points), linewidth=3, animated=True)[0]
+        for line in range(lines)
+    ]
+    ax.set_xlim(0, points * 1.5)
+    ax.set_ylim(0, 100)
+    start = time.perf_counter()
+    canvas.draw()
+    full_draw = (time.perf_counter() - start) * 1000
+    background = canvas.copy_from_bbox(figure.bbox)
+    frame_times = []
+    for frame in range(frames):
+        start = time.perf_counter()
+        for plot in plots:
+            plot.set_ydata(walk(points))
+        canvas.restore_region(background)
+        for plot in plots:
+            ax.draw_artist(plot)
+        frame_times.append((time.perf_counter() - start) * 1000)
+    return {
+        "render_full_draw_ms": full_draw,
+        "render_frame_p50_ms": percentile(frame_times, 50),
+        "render_frame_p99_ms": percentile(frame_times, 99),
+    }
+
+
+def bench_startup(runs=3):
+    """Time the GUI's cold start in fresh interpreters.
+
+    Args:
+        runs (int, optional): Interpreters started; the fastest run counts.
+
+    Returns:
+        dict: Import and matplotlib load times in milliseconds.
+    """
+    code = (
+        "import json, time\n"
+        "start = time.perf_counter()\n"
+        "import main\n"
+        "imported = time.perf_counter()\n"
+        "main.load_matplotlib()\n"
+        "loaded = time.perf_counter()\n"
+        "print(json.dumps([(imported - start) * 1000, (loaded - imported) * 1000]))\n"
+    )
+    times = []
+    for run in range(runs):
+        output = subprocess.run(
+            [sys.executable, "-c", code],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout
+        times.append(json.loads(output.splitlines()[-1]))
+    return {
+        "startup_import_ms": min(imported for imported, loaded in times),
+        "startup_matplotlib_ms": min(loaded for imported, loaded in times),
+    }
+
+
+def _version():
+    """Return the git revision of the code being measured, if there is one."""
+    try:
+        return subprocess.run(
+            ["git", "describe", "--always", "--dirty"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def run(args):
+    """Run every benchmark and return the results.
+
+    Args:
+        args (argparse.Namespace): Parsed command-line options.
+
+    Returns:
+        dict: "meta" describing the run and "results" by benchmark name.
+    """
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        filename = args.log_file or os.path.join(directory, "bench.log")
+        if not args.log_file or not os.path.exists(args.log_file):
+            start = time.perf_counter()
+            count = generate_log(filename, args.size_mb, args.metrics, args.log_format)
+            results["generate_s"] = time.perf_counter() - start
+            results["log_samples"] = count
+        results["log_mb"] = os.path.getsize(filename) / 1024**2
+        names = metric_names(args.metrics)
+        records = list(synthetic_records(names, datetime.datetime.now(), args.ticks))
+        results.update(bench_collection(records, args.ticks))
+        results.update(bench_write(records, directory))
+        results.update(bench_queries(filename, names[:3]))
+        results.update(bench_render(args.points, 3, args.frames))
+        results.update(bench_startup())
+    return {
+        "meta": {
+            "version": _version(),
+            "date": datetime.datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "machine": platform.platform(),
+            "size_mb": args.size_mb,
+            "metrics": args.metrics,
+            "log_format": args.log_format,
+        },
+        "results": results,
+    }
+
+
+def report(report_data, baseline=None):
+    """Print the results, next to a baseline run's when given."""
+    print(f"resmon {report_data['meta']['version']} on {report_data['meta']['machine']}")
+    old = baseline["results"] if baseline else {}
+    for name, value in report_data["results"].items():
+        line = f"{name:32} {value:14.3f}"
+        if name in old:
+            change = (value - old[name]) / old[name] * 100 if old[name] else 0.0
+            line += f"  was {old[name]:14.3f} ({change:+.1f}%)"
+        print(line)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="resmon benchmarks")
+    parser.add_argument("command", nargs="?", choices=("run", "generate"), default="run")
+    parser.add_argument("log_file", nargs="?", help="log to generate, or to query instead of a generated one")
+    parser.add_argument("--size-mb", type=float, default=20, help="size of the generated log (default: 20)")
+    parser.add_argument("--metrics", type=int, default=10, help="metrics per sample (default: 10)")
+    parser.add_argument("--log-format", choices=logstore.LOG_FORMATS, default="json")
+    parser.add_argument("--ticks", type=int, default=5000, help="collection ticks timed (default: 5000)")
+    parser.add_argument(
+        "--points", type=int, default=60, help="samples per rendered line, the live window (default: 60)"
+    )
+    parser.add_argument("--frames", type=int, default=200, help="frames rendered (default: 200)")
+    parser.add_argument("--output", help="save the results to this JSON file")
+    parser.add_argument("--compare", help="JSON results of an earlier run to compare with")
+    args = parser.parse_args()
+    if args.command == "generate":
+        if not args.log_file:
+            parser.error("generate needs a log file")
+        print(f"wrote {generate_log(args.log_file, args.size_mb, args.metrics, args.log_format)} samples")
+    else:
+        results = run(args)
+        baseline = None
+        if args.compare:
+            with open(args.compare) as f:
+                baseline = json.load(f)
+        report(results, baseline)
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump(results, f, indent=4)
@@ -0,0 +1,189 @@
+"""Per-core, per-interface, per-disk and per-mountpoint series.
+
+Each breakdown is a RingMatrix holding one column per device. Counter
+deltas of all interfaces or disks are computed in one numpy operation per
+tick instead of one Python loop iteration per device and counter, which
+keeps sampling cheap on machines with many cores and devices.
+
+Devices are discovered when tracking starts; devices that disappear later
+get NaN values and new ones are ignored until the monitor is restarted.
+"""
+import time
+
+import numpy as np
+import psutil
+
+from rates import CounterRates
+
+# mountpoint usage is read every this many ticks, since statvfs on a slow
+# network mount can stall the sampling loop
+MOUNT_EVERY = 10
+
+
+class RingMatrix:
+    """Fixed-capacity ring of rows, one value per device.
+
+    Like RingColumn, every row is stored twice in a preallocated array of
+    2 * capacity rows, so the newest rows are always one contiguous block
+    and are returned as a zero-copy numpy view.
+
+    Attributes:
+        capacity (int): Number of rows kept.
+        width (int): Values per row.
+    """
+
+    def __init__(self, capacity, width):
+        """Initialize the RingMatrix.
+
+        Args:
+            capacity (int): Number of rows kept.
+            width (int): Values per row.
+        """
+        if capacity < 1:
+            raise ValueError("capacity must be at least 1")
+        self.capacity = capacity
+        self.width = width
+        self._values = np.zeros((2 * capacity, width))
+        self._next = 0
+        self._count = 0
+
+    def append(self, row):
+        """Add a row, dropping the oldest one once the matrix is full.
+
+        Args:
+            row (sequence): width values.
+        """
+        self._values[self._next] = row
+        self._values[self._next + self.capacity] = row
+        self._next = (self._next + 1) % self.capacity
+        if self._count < self.capacity:
+            self._count += 1
+
+    def __len__(self):
+        return self._count
+
+    def view(self, count=None):
+        """Return the newest rows as a zero-copy view.
+
+        Args:
+            count (int, optional): Number of newest rows. Defaults to all.
+
+        Returns:
+            numpy.ndarray: Array of shape (count, width), oldest row first.
+        """
+        if count is None or count > self._count:
+            count = self._count
+        end = self._next + self.capacity
+        return self._values[end - count:end]
+
+
+class DeviceRates:
+    """Per-second rates of the cumulative counters of a set of devices.
+
+    Attributes:
+        names (list): Device names, one row of the counter array each.
+        fields (tuple): Counter attributes read from every device.
+        rates (CounterRates): Rates of every device's counters, row by row.
+    """
+
+    def __init__(self, names, fields, scale=1.0):
+        """Initialize the DeviceRates.
+
+        Args:
+            names (list): Device names.
+            fields (tuple): Counter attributes read from every device.
+            scale (float, optional): Factor applied to the rates.
+        """
+        self.names = names
+        self.fields = fields
+        self.rates = CounterRates(len(names) * len(fields), scale)
+
+    def update(self, counters, now=None):
+        """Compute the rates since the previous call.
+
+        Args:
+            counters (dict): psutil counters by device name.
+            now (float, optional): time.monotonic() of the reading.
+
+        Returns:
+            numpy.ndarray: Rates of shape (devices, fields); zero on the first
+            call and NaN for missing devices.
+        """
+        missing = [np.nan] * len(self.fields)
+        current = [
+            [getattr(counters[name], field) for field in self.fields]
+            if name in counters
+            else missing
+            for name in self.names
+        ]
+        return self.rates.update(current, now).reshape(len(self.names), len(self.fields))
+
+
+class Breakdowns:
+    """Samples the per-device series on every tick.
+
+    Attributes:
+        series (dict): RingMatrix of every breakdown.
+        labels (dict): Device names of the columns of every breakdown.
+        units (dict): Unit of the values of every breakdown.
+    """
+
+    def __init__(self, capacity):
+        """Initialize the Breakdowns.
+
+        Args:
+            capacity (int): Rows kept per breakdown.
+        """
+        cores = len(psutil.cpu_percent(percpu=True))
+        nics = sorted(psutil.net_io_counters(pernic=True))
+        disks = sorted(psutil.disk_io_counters(perdisk=True) or {})
+        self.mountpoints = [partition.mountpoint for partition in psutil.disk_partitions()]
+        self.labels = {
+            "cpu_per_core": [f"cpu{core}" for core in range(cores)],
+            "net_in_per_nic": nics,
+            "net_out_per_nic": nics,
+            "disk_read_per_disk": disks,
+            "disk_write_per_disk": disks,
+            "disk_usage_per_mount": self.mountpoints,
+        }
+        self.units = {
+            "cpu_per_core": "%",
+            "net_in_per_nic": "Kb/s",
+            "net_out_per_nic": "Kb/s",
+            "disk_read_per_disk": "MB/s",
+            "disk_write_per_disk": "MB/s",
+            "disk_usage_per_mount": "%",
+        }
+        self.series = {}
+        for key, names in self.labels.items():
+            self.series[key] = RingMatrix(capacity, len(names))
+        self._nic_rates = DeviceRates(nics, ("bytes_recv", "bytes_sent"), 8 / 1024)
+        self._disk_rates = DeviceRates(disks, ("read_bytes", "write_bytes"), 1 / 1024**2)
+        self._mount_usage = np.full(len(self.mountpoints), np.nan)
+        self._ticks = 0
+
+    def _read_mount_usage(self):
+        """Read the usage of every mountpoint."""
+        for column, mountpoint in enumerate(self.mountpoints):
+            try:
+                self._mount_usage[column] = psutil.disk_usage(mountpoint).percent
+            except OSError:
+                self._mount_usage[column] = np.nan
+
+    def update(self):
+        """Read every device once and append a row to every breakdown."""
+        now = time.monotonic()
+        cores = psutil.cpu_percent(percpu=True)
+        row = np.full(self.series["cpu_per_core"].width, np.nan)
+        row[: len(cores)] = cores[: len(row)]
+        self.series["cpu_per_core"].append(row)
+        nic_rates = self._nic_rates.update(psutil.net_io_counters(pernic=True), now)
+        self.series["net_in_per_nic"].append(nic_rates[:, 0])
+        self.series["net_out_per_nic"].append(nic_rates[:, 1])
+        disk_rates = self._disk_rates.update(psutil.disk_io_counters(perdisk=True) or {}, now)
+        self.series["disk_read_per_disk"].append(disk_rates[:, 0])
+        self.series["disk_write_per_disk"].append(disk_rates[:, 1])
+        if self._ticks % MOUNT_EVERY == 0:
+            self._read_mount_usage()
+        self.series["disk_usage_per_mount"].append(self._mount_usage)
+        self._ticks += 1
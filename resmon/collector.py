@@ -0,0 +1,378 @@
+"""Sampling and logging of system resource data.
+
+This module only depends on psutil and the log modules, so it can be used
+without tkinter or matplotlib by the headless collector.
+"""
+import datetime
+import math
+import time
+
+import breakdown
+import logstore
+import metrics
+import processes
+import rollup
+import segments
+from logwriter import FSYNC_POLICIES, LogWriter
+from ringbuffer import RingColumn
+
+# samples kept in memory per series, one hour at the default 1 s interval
+MAX_LENGTH = 3600
+# series hold RingColumns; "time" holds POSIX timestamps. The collectors'
+# series are added by enable_collectors().
+data = {"time": RingColumn(MAX_LENGTH), "collect_ms": RingColumn(MAX_LENGTH)}
+# Collector instances sampled on every tick, by name
+collectors = {}
+
+process_tracker = None
+breakdowns = None
+
+
+def set_window(window, interval):
+    """Size the in-memory series to hold a time window.
+
+    Must be called before the first sample is taken.
+
+    Args:
+        window (float): Seconds of samples to keep in memory.
+        interval (float): Seconds between samples.
+    """
+    global MAX_LENGTH
+    MAX_LENGTH = max(2, round(window / interval))
+    for key in data:
+        if isinstance(data[key], RingColumn):
+            data[key] = RingColumn(MAX_LENGTH)
+
+
+def track_processes(top_n=processes.TOP_N):
+    """Start tracking the busiest processes on every tick.
+
+    Adds "proc_cpu_1" ... "proc_cpu_<top_n>" series holding the CPU usage of
+    the busiest processes by rank, and "top_processes" with their details.
+
+    Args:
+        top_n (int, optional): Number of processes to track.
+    """
+    global process_tracker
+    process_tracker = processes.ProcessTracker(top_n)
+    for rank in range(1, top_n + 1):
+        data[f"proc_cpu_{rank}"] = RingColumn(MAX_LENGTH)
+    data["top_processes"] = []
+
+
+def track_breakdowns():
+    """Start sampling per-core, per-interface, per-disk and per-mountpoint series.
+
+    The series are kept in memory only, in breakdowns.series.
+    """
+    global breakdowns
+    breakdowns = breakdown.Breakdowns(MAX_LENGTH)
+
+
+def enable_collectors(names=(), skip=(), intervals=None):
+    """Choose the collectors sampled on every tick.
+
+    Replaces the collectors enabled before; the default ones are enabled
+    when the module is imported. Meant to be called before the first sample
+    is taken, like set_window.
+
+    Args:
+        names (iterable, optional): Collectors to enable besides the default ones.
+        skip (iterable, optional): Default collectors not to enable.
+        intervals (dict, optional): Seconds between readings by collector
+            name, instead of the collectors' own.
+    """
+    for source in collectors.values():
+        for key in source.keys:
+            data.pop(key, None)
+    collectors.clear()
+    intervals = intervals or {}
+    for name, collector_class in metrics.COLLECTORS.items():
+        if (collector_class.default and name not in skip) or name in names:
+            add_collector(name, intervals.get(name))
+
+
+def add_collector(name, interval=None):
+    """Start sampling a registered collector, if it is not sampled yet.
+
+    Args:
+        name (str): Name of the collector in metrics.COLLECTORS.
+        interval (float, optional): Seconds between readings, instead of the collector's own.
+
+    Returns:
+        metrics.Collector: The sampled collector.
+    """
+    if name in collectors:
+        return collectors[name]
+    source = metrics.COLLECTORS[name]()
+    if interval is not None:
+        source.interval = interval
+    collectors[name] = source
+    for key in source.keys:
+        data[key] = RingColumn(MAX_LENGTH)
+        # keep the series aligned with "time" if samples were taken already
+        for count in range(len(data["time"])):
+            data[key].append(math.nan)
+    return source
+
+
+def require_metrics(keys):
+    """Start sampling the collectors that provide the given series.
+
+    Used for consumers naming series directly, such as alert rules, so
+    collectors that are off by default are read once something needs them.
+
+    Args:
+        keys (iterable): Series names.
+    """
+    keys = list(keys)
+    for name, collector_class in metrics.COLLECTORS.items():
+        if any(collector_class.provides(key) for key in keys):
+            add_collector(name)
+
+
+# sample the default collectors unless enable_collectors() is called again
+enable_collectors()
+
+
+def update_data():
+    """Get and update system data in real-time.
+
+    Every enabled collector that is due is read; the others repeat their
+    last values. The time spent collecting is stored under "collect_ms".
+    """
+    start = time.perf_counter()
+    now = time.monotonic()
+    data["time"].append(datetime.datetime.now().timestamp())
+
+    for source in collectors.values():
+        for key, value in zip(source.keys, source.sample(now)):
+            data[key].append(value)
+
+    if process_tracker is not None:
+        data["top_processes"] = process_tracker.update()
+        for rank in range(1, process_tracker.top_n + 1):
+            top = data["top_processes"]
+            data[f"proc_cpu_{rank}"].append(top[rank - 1]["cpu"] if rank <= len(top) else 0)
+
+    if breakdowns is not None:
+        breakdowns.update()
+
+    data["collect_ms"].append((time.perf_counter() - start) * 1000)
+
+
+def current_sample():
+    """Return the newest value of every series.
+
+    Returns:
+        dict: Sample values, with "time" as a datetime.
+    """
+    current_data = dict()
+    for key in data:
+        try:
+            if key == "time":
+                current_data[key] = datetime.datetime.fromtimestamp(data[key][-1])
+            elif not isinstance(data[key], RingColumn):
+                current_data[key] = data[key]
+            else:
+                current_data[key] = data[key][-1]
+        except IndexError:
+            current_data[key] = 0
+    return current_data
+
+
+def log_data(log):
+    """Append current system resource data to a log.
+
+    Args:
+        log (LogWriter or logstore.JsonLog or logstore.BinaryLog): The log to append data to.
+    """
+    log.append(current_sample())
+
+
+def add_log_arguments(parser):
+    """Add the log file, format, and writer options to a command-line parser.
+
+    Args:
+        parser (argparse.ArgumentParser): Parser to extend.
+    """
+    parser.add_argument(
+        "--log-format",
+        choices=logstore.LOG_FORMATS,
+        default="json",
+        help="format of the sample log (default: json)",
+    )
+    parser.add_argument(
+        "--log-file",
+        help="path of the sample log (default: log_file.txt, or log_file.bin for binary)",
+    )
+    parser.add_argument(
+        "--flush-interval",
+        type=float,
+        default=5.0,
+        help="longest time in seconds samples stay buffered before a write (default: 5)",
+    )
+    parser.add_argument(
+        "--flush-size",
+        type=int,
+        default=60,
+        help="number of buffered samples that triggers a write (default: 60)",
+    )
+    parser.add_argument(
+        "--fsync",
+        choices=FSYNC_POLICIES,
+        default="never",
+        help="when to fsync the log: never, after every flush, or on close (default: never)",
+    )
+    parser.add_argument(
+        "--rotate-size",
+        type=float,
+        default=64,
+        help="size in MB at which the log is rotated into a segment, 0 for no limit (default: 64)",
+    )
+    parser.add_argument(
+        "--rotate-age",
+        type=float,
+        default=24,
+        help="hours after which the log is rotated into a segment, 0 for no limit (default: 24)",
+    )
+    parser.add_argument(
+        "--compress",
+        choices=segments.COMPRESSIONS,
+        default="gzip",
+        help="compression of rotated segments (default: gzip)",
+    )
+    parser.add_argument(
+        "--retention",
+        type=float,
+        default=30,
+        help="days rotated segments are kept, 0 to keep them forever (default: 30)",
+    )
+
+
+def add_sampling_arguments(parser):
+    """Add the sampling interval option to a command-line parser.
+
+    Args:
+        parser (argparse.ArgumentParser): Parser to extend.
+    """
+    parser.add_argument(
+        "--interval",
+        type=float,
+        default=1.0,
+        help="seconds between samples, down to e.g. 0.1 (default: 1)",
+    )
+    parser.add_argument(
+        "--window",
+        type=float,
+        default=3600,
+        help="seconds of samples kept in memory for live graphs and recent history (default: 3600)",
+    )
+
+
+def add_collector_arguments(parser):
+    """Add the options choosing the sampled collectors to a command-line parser.
+
+    Args:
+        parser (argparse.ArgumentParser): Parser to extend.
+    """
+    optional = [name for name, collector_class in metrics.COLLECTORS.items() if not collector_class.default]
+    parser.add_argument(
+        "--collect",
+        nargs="+",
+        default=[],
+        choices=list(metrics.COLLECTORS),
+        metavar="NAME",
+        help=f"also sample these collectors, e.g. {', '.join(optional)}",
+    )
+    parser.add_argument(
+        "--skip",
+        nargs="+",
+        default=[],
+        choices=list(metrics.COLLECTORS),
+        metavar="NAME",
+        help="do not sample these collectors, from: " + ", ".join(metrics.COLLECTORS),
+    )
+    parser.add_argument(
+        "--collect-interval",
+        action="append",
+        default=[],
+        metavar="NAME=SECONDS",
+        help="seconds between readings of a collector, e.g. disk_usage=30; can be repeated",
+    )
+
+
+def open_collectors(args):
+    """Enable the collectors chosen on the command line.
+
+    Args:
+        args (argparse.Namespace): Options added by add_collector_arguments.
+    """
+    intervals = {}
+    for option in args.collect_interval:
+        name, separator, seconds = option.partition("=")
+        try:
+            intervals[name] = float(seconds)
+        except ValueError:
+            raise SystemExit(f"Bad --collect-interval {option}, expected NAME=SECONDS")
+        if name not in metrics.COLLECTORS:
+            raise SystemExit(f"Unknown collector in --collect-interval: {name}")
+    enable_collectors(args.collect, args.skip, intervals)
+
+
+def add_process_arguments(parser):
+    """Add the per-process tracking option to a command-line parser.
+
+    Args:
+        parser (argparse.ArgumentParser): Parser to extend.
+    """
+    parser.add_argument(
+        "--top-processes",
+        type=int,
+        default=processes.TOP_N,
+        help=f"number of busiest processes to track, 0 to disable (default: {processes.TOP_N})",
+    )
+
+
+def open_sample_log(args):
+    """Open the sample log and its rollup tiers.
+
+    Args:
+        args (argparse.Namespace): Options added by add_log_arguments.
+
+    Returns:
+        rollup.RollupLog: The opened log.
+    """
+    log_file = args.log_file
+    if log_file is None:
+        log_file = "log_file.bin" if args.log_format == "binary" else "log_file.txt"
+    log = logstore.open_log(log_file, args.log_format)
+    if not args.rotate_size and not args.rotate_age:
+        return rollup.RollupLog(log)
+    policy = segments.RotationPolicy(
+        round(args.rotate_size * 1024**2),
+        args.rotate_age * 3600,
+        args.compress,
+        args.retention * 86400,
+    )
+    return rollup.RollupLog(
+        segments.SegmentedLog(log, policy),
+        lambda tier_log: segments.SegmentedLog(tier_log, policy),
+    )
+
+
+def open_log_writer(args):
+    """Open the sample log behind a background writer.
+
+    Args:
+        args (argparse.Namespace): Options added by add_log_arguments.
+
+    Returns:
+        LogWriter: The writer, not yet started.
+    """
+    return LogWriter(
+        open_sample_log(args),
+        args.flush_interval,
+        args.flush_size,
+        args.fsync,
+    )
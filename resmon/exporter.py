@@ -0,0 +1,195 @@
+"""Prometheus/OpenMetrics scrape endpoint for the latest sample.
+
+The sampling loop calls publish() after every tick, which renders the
+exposition text once and swaps it in; scrapes only send the prepared bytes
+from a server thread, so they cost almost nothing and never wait on or hold
+up collection.
+"""
+import http.server
+import math
+import threading
+
+# (series, metric name, help text) of every exported gauge
+METRICS = (
+    ("cpu_usage", "resmon_cpu_usage_percent", "CPU usage over the last sampling interval."),
+    ("cpu_freq", "resmon_cpu_frequency_mhz", "Current CPU frequency."),
+    ("mem_usage", "resmon_memory_usage_percent", "Share of physical memory in use."),
+    ("disk_usage", "resmon_disk_usage_percent", "Share of the root file system in use."),
+    ("network_data", "resmon_network_kilobits_per_second", "Network traffic sent and received."),
+    ("network_in", "resmon_network_in_kilobits_per_second", "Network traffic received."),
+    ("network_out", "resmon_network_out_kilobits_per_second", "Network traffic sent."),
+    ("IO_in", "resmon_io_in_megabytes_per_second", "Data written to disk."),
+    ("IO_out", "resmon_io_out_megabytes_per_second", "Data read from disk."),
+    ("collect_ms", "resmon_collect_milliseconds", "Time taken to collect the sample."),
+)
+PROMETHEUS_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+OPENMETRICS_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+
+
+def _format_value(value):
+    """Format a sample value the way the exposition formats expect."""
+    if value != value:
+        return "NaN"
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+def collector_metrics(collectors):
+    """Return METRICS plus a gauge for every other series of the given collectors.
+
+    Args:
+        collectors (iterable): metrics.Collector instances being sampled.
+
+    Returns:
+        tuple: (series, metric name, help text) of every exported gauge.
+    """
+    exported = list(METRICS)
+    known = {key for key, name, help_text in METRICS}
+    for source in collectors:
+        for key in source.keys:
+            if key not in known:
+                exported.append((key, f"resmon_{key}", f"{source.description} ({source.units})."))
+    return tuple(exported)
+
+
+def render(sample, openmetrics=False, metrics=METRICS):
+    """Render a sample in the Prometheus or OpenMetrics text format.
+
+    Args:
+        sample (dict): Sample values, with "time" as a datetime.
+        openmetrics (bool, optional): Render OpenMetrics instead of Prometheus text.
+        metrics (tuple, optional): Exported gauges, like METRICS.
+
+    Returns:
+        bytes: The exposition text.
+    """
+    lines = []
+    for key, name, help_text in metrics:
+        value = sample.get(key)
+        if value is None:
+            continue
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} gauge")
+        lines.append(f"{name} {_format_value(value)}")
+    name = "resmon_sample_timestamp_seconds"
+    lines.append(f"# HELP {name} Time the sample was taken.")
+    lines.append(f"# TYPE {name} gauge")
+    lines.append(f"{name} {_format_value(sample['time'].timestamp())}")
+    if openmetrics:
+        lines.append("# EOF")
+    return ("\n".join(lines) + "\n").encode()
+
+
+class _ScrapeHandler(http.server.BaseHTTPRequestHandler):
+    """Serves the prepared payload of the exporter on /metrics."""
+
+    def do_GET(self):
+        if self.path.split("?", 1)[0] != "/metrics":
+            self.send_error(404)
+            return
+        payloads = self.server.exporter.payloads
+        if payloads is None:
+            self.send_error(503, "no sample collected yet")
+            return
+        if "application/openmetrics-text" in self.headers.get("Accept", ""):
+            content_type = OPENMETRICS_TYPE
+        else:
+            content_type = PROMETHEUS_TYPE
+        body = payloads[content_type]
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # scrapes can come many times a second, keep the console quiet
+        pass
+
+
+class MetricsExporter:
+    """HTTP server exposing the latest sample for scraping.
+
+    Attributes:
+        address (tuple): (host, port) listened on.
+        metrics (tuple): Exported gauges, like METRICS.
+        payloads (dict): Prepared response body by content type, or None before the first sample.
+    """
+
+    def __init__(self, host="127.0.0.1", port=9465, metrics=METRICS):
+        """Initialize the MetricsExporter.
+
+        Args:
+            host (str, optional): Address to listen on. Defaults to localhost.
+            port (int, optional): Port to listen on. Defaults to 9465.
+            metrics (tuple, optional): Exported gauges. Defaults to METRICS.
+        """
+        self.metrics = metrics
+        self.payloads = None
+        self.server = http.server.ThreadingHTTPServer((host, port), _ScrapeHandler)
+        self.server.daemon_threads = True
+        self.server.exporter = self
+        self.address = self.server.server_address[:2]
+
+    def publish(self, sample):
+        """Prepare the responses for a new sample.
+
+        Args:
+            sample (dict): Sample values, with "time" as a datetime.
+        """
+        # replaced in one assignment, so a scrape sees the old or the new payloads
+        self.payloads = {
+            PROMETHEUS_TYPE: render(sample, metrics=self.metrics),
+            OPENMETRICS_TYPE: render(sample, openmetrics=True, metrics=self.metrics),
+        }
+
+    def start(self):
+        """Serve scrapes in a daemon thread."""
+        thread = threading.Thread(
+            target=self.server.serve_forever, name="resmon-exporter", daemon=True
+        )
+        thread.start()
+        print(f"Serving metrics on http://{self.address[0]}:{self.address[1]}/metrics")
+
+    def close(self):
+        """Stop serving scrapes."""
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def add_exporter_arguments(parser):
+    """Add the scrape endpoint options to a command-line parser.
+
+    Args:
+        parser (argparse.ArgumentParser): Parser to extend.
+    """
+    parser.add_argument(
+        "--metrics-port",
+        type=int,
+        default=0,
+        help="serve the latest sample for Prometheus on this port, 0 to disable (default: 0)",
+    )
+    parser.add_argument(
+        "--metrics-host",
+        default="127.0.0.1",
+        help="address the metrics endpoint listens on (default: 127.0.0.1)",
+    )
+
+
+def open_exporter(args, collectors=()):
+    """Start the scrape endpoint if it was asked for.
+
+    Args:
+        args (argparse.Namespace): Options added by add_exporter_arguments.
+        collectors (iterable, optional): Sampled metrics.Collector instances,
+            whose series are exported besides METRICS.
+
+    Returns:
+        MetricsExporter: The started exporter, or None.
+    """
+    if not args.metrics_port:
+        return None
+    exporter = MetricsExporter(args.metrics_host, args.metrics_port, collector_metrics(collectors))
+    exporter.start()
+    return exporter
@@ -0,0 +1,106 @@
+"""Headless resmon collector.
+
+Samples system resource data and writes it to the log on a fixed interval
+without importing tkinter or matplotlib, so it can run on servers without a
+display. Start the GUI with ``main.py --view-only --log-file LOG`` to look at
+the collected history.
+"""
+import argparse
+import contextlib
+import signal
+import time
+
+import alerts
+import collector
+import exporter
+import instrument
+from scheduler import Scheduler
+
+
+def run(writer, interval=1.0, exporter=None, alerts=None, instrumentation=None):
+    """Sample and log data on a fixed schedule until interrupted.
+
+    Args:
+        writer (LogWriter): Writer the samples are appended to.
+        interval (float, optional): Seconds between samples. Defaults to 1.
+        exporter (MetricsExporter, optional): Scrape endpoint the samples are published to.
+        alerts (AlertEngine, optional): Alert rules checked on every sample.
+        instrumentation (Instrumentation, optional): Timer of the sample and log stages.
+    """
+    scheduler = Scheduler(interval)
+    if instrumentation is not None:
+        stage = instrumentation.stage
+    else:
+        stage = _untimed
+    writer.start()
+    try:
+        while True:
+            scheduler.begin_tick()
+            with stage("sample"):
+                collector.update_data()
+            if instrumentation is not None:
+                instrumentation.record()
+            with stage("log"):
+                collector.log_data(writer)
+                if exporter is not None or alerts is not None:
+                    sample = collector.current_sample()
+                    if exporter is not None:
+                        exporter.publish(sample)
+                    if alerts is not None:
+                        alerts.evaluate(sample)
+            time.sleep(scheduler.next_delay())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        writer.close()
+        if exporter is not None:
+            exporter.close()
+        print(scheduler.summary())
+        if instrumentation is not None:
+            print(instrumentation.summary())
+
+
+def _untimed(name):
+    """Stand in for Instrumentation.stage when not instrumenting."""
+    return contextlib.nullcontext()
+
+
+def _stop(signum, frame):
+    """Turn a termination signal into a clean shutdown."""
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    raise KeyboardInterrupt
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="ResMon headless collector")
+    collector.add_log_arguments(parser)
+    collector.add_sampling_arguments(parser)
+    collector.add_collector_arguments(parser)
+    collector.add_process_arguments(parser)
+    exporter.add_exporter_arguments(parser)
+    alerts.add_alert_arguments(parser)
+    instrument.add_instrument_arguments(parser)
+    args = parser.parse_args()
+    collector.set_window(args.window, args.interval)
+    collector.open_collectors(args)
+    rules = alerts.open_alerts(args)
+    if rules is not None:
+        collector.require_metrics(rule.metric for rule in rules.rules)
+    if args.top_processes > 0:
+        collector.track_processes(args.top_processes)
+    signal.signal(signal.SIGTERM, _stop)
+    instrumentation = None
+    if args.instrument:
+        instrumentation = instrument.Instrumentation(["sample", "log"], collector.data, args.profile_dir)
+        if hasattr(signal, "SIGUSR1"):
+            signal.signal(signal.SIGUSR1, instrumentation.toggle_profile)
+            signal.signal(signal.SIGUSR2, instrumentation.toggle_tracemalloc)
+    collector.update_data()
+    run(
+        collector.open_log_writer(args),
+        args.interval,
+        exporter.open_exporter(args, collector.collectors.values()),
+        rules,
+        instrumentation,
+    )
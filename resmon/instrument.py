@@ -0,0 +1,192 @@
+"""Self-instrumentation: what the monitor itself costs.
+
+Every stage of a tick (sampling, drawing, logging) is timed on the
+monotonic clock and its rolling p50/p99 over the last STAGE_WINDOW ticks is
+added to the sampled series, together with the monitor's own CPU usage and
+resident memory, so it is graphed and logged like any other metric under
+``self_*`` keys.
+
+cProfile and tracemalloc can be switched on and off while running; when a
+capture stops, a summary is printed and the profile is saved for
+``python -m pstats``.
+"""
+import cProfile
+import contextlib
+import datetime
+import io
+import os
+import pstats
+import time
+import tracemalloc
+
+import psutil
+
+from ringbuffer import RingColumn
+
+# ticks the rolling percentiles are computed over
+STAGE_WINDOW = 300
+
+
+class StageTimer:
+    """Durations of the last STAGE_WINDOW runs of one stage.
+
+    Attributes:
+        durations (RingColumn): Durations in milliseconds.
+    """
+
+    def __init__(self, window=STAGE_WINDOW):
+        """Initialize the StageTimer.
+
+        Args:
+            window (int, optional): Runs kept for the percentiles.
+        """
+        self.durations = RingColumn(window)
+
+    def add(self, milliseconds):
+        """Record one run."""
+        self.durations.append(milliseconds)
+
+    def percentiles(self):
+        """Return the (p50, p99) of the kept durations in milliseconds."""
+        if not len(self.durations):
+            return 0.0, 0.0
+        ordered = sorted(self.durations.view())
+        last = len(ordered) - 1
+        return ordered[round(0.5 * last)], ordered[round(0.99 * last)]
+
+
+class Instrumentation:
+    """Times the stages of every tick and measures the monitor's own usage.
+
+    Attributes:
+        stages (dict): StageTimer of every stage, by name.
+        data (dict): Series the measurements are appended to, usually collector.data.
+        profile_dir (str): Directory cProfile captures are saved in.
+        profiler (cProfile.Profile): Running profiler, or None.
+    """
+
+    def __init__(self, stages, data, profile_dir="."):
+        """Initialize the Instrumentation and add its series to data.
+
+        Args:
+            stages (list): Names of the timed stages, e.g. ["sample", "log"].
+            data (dict): Series the measurements are appended to.
+            profile_dir (str, optional): Directory cProfile captures are saved in.
+        """
+        self.stages = {name: StageTimer() for name in stages}
+        self.data = data
+        self.profile_dir = profile_dir
+        self.profiler = None
+        self.process = psutil.Process()
+        # first call only starts the measurement
+        self.process.cpu_percent(None)
+        capacity = data["time"].capacity
+        for key in self.keys():
+            data[key] = RingColumn(capacity)
+
+    def keys(self):
+        """Return the names of the series added to data."""
+        keys = ["self_cpu", "self_rss_mb"]
+        for name in self.stages:
+            keys += [f"self_{name}_p50_ms", f"self_{name}_p99_ms"]
+        return keys
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """Time the body of a with statement as one run of a stage.
+
+        Args:
+            name (str): Name of the stage.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name].add((time.perf_counter() - start) * 1000)
+
+    def record(self):
+        """Append the current percentiles and own usage to the series.
+
+        Call once per tick, right after the sample was taken, so the series
+        stay aligned with "time". Stages that run later in the tick are
+        counted from the next tick on.
+        """
+        with self.process.oneshot():
+            values = {
+                "self_cpu": self.process.cpu_percent(None),
+                "self_rss_mb": self.process.memory_info().rss / 1024**2,
+            }
+        for name, timer in self.stages.items():
+            values[f"self_{name}_p50_ms"], values[f"self_{name}_p99_ms"] = timer.percentiles()
+        for key, value in values.items():
+            # samples taken before instrumenting started get the first values
+            for count in range(max(1, len(self.data["time"]) - len(self.data[key]))):
+                self.data[key].append(value)
+
+    def summary(self):
+        """Return a one-line report of the stage timings and own usage."""
+        parts = []
+        for name, timer in self.stages.items():
+            p50, p99 = timer.percentiles()
+            parts.append(f"{name} p50 {p50:.2f}ms p99 {p99:.2f}ms")
+        rss = self.process.memory_info().rss / 1024**2
+        return ", ".join(parts) + f", {rss:.1f} MB resident"
+
+    def toggle_profile(self, *ignored):
+        """Start a cProfile capture, or stop it and save and summarize it.
+
+        Extra arguments are ignored, so it can be used as a signal handler or
+        a Tk event callback.
+        """
+        if self.profiler is None:
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+            print("Profiling started")
+            return
+        self.profiler.disable()
+        stamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+        filename = os.path.join(self.profile_dir, f"resmon-{stamp}.prof")
+        try:
+            self.profiler.dump_stats(filename)
+            print("Profile saved to", filename)
+        except OSError:
+            print("Could not open/write file:", filename)
+        text = io.StringIO()
+        pstats.Stats(self.profiler, stream=text).sort_stats("cumulative").print_stats(15)
+        print(text.getvalue())
+        self.profiler = None
+
+    def toggle_tracemalloc(self, *ignored):
+        """Start tracing allocations, or stop and print the biggest allocation sites.
+
+        Extra arguments are ignored, so it can be used as a signal handler or
+        a Tk event callback.
+        """
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            print("Allocation tracing started")
+            return
+        snapshot = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+        print("Top allocation sites:")
+        for statistic in snapshot.statistics("lineno")[:10]:
+            print(" ", statistic)
+
+
+def add_instrument_arguments(parser):
+    """Add the self-instrumentation options to a command-line parser.
+
+    Args:
+        parser (argparse.ArgumentParser): Parser to extend.
+    """
+    parser.add_argument(
+        "--instrument",
+        action="store_true",
+        help="time every stage of a tick and record the monitor's own CPU and memory as self_* "
+        "series; SIGUSR1/SIGUSR2 (F9/F10 in the GUI) then toggle cProfile/tracemalloc captures",
+    )
+    parser.add_argument(
+        "--profile-dir",
+        default=".",
+        help="directory cProfile captures are saved in (default: current directory)",
+    )
@@ -0,0 +1,747 @@
+"""Storage backends for the resmon sample log.
+
+Two formats are supported:
+
+- ``json``: one JSON object per line. Next to every log file a sidecar index
+  (``<log>.idx``) stores one fixed-width (timestamp, byte offset) record for
+  the first sample of each INDEX_BLOCK_SECONDS block. History queries
+  binary-search that index and seek straight to the block holding the
+  requested start time, so their cost does not depend on how much older data
+  the log contains.
+- ``binary``: a small header naming the columns followed by fixed-width
+  records (epoch float64 plus one float32/float64 per metric). Records are
+  located by binary search on their timestamps and decoded with
+  ``struct.iter_unpack``.
+
+Both formats are read through a memory map and can be streamed with
+``iter_range``, so history reads use memory for the returned records only.
+
+Run ``python logstore.py convert SRC DST --to binary|json`` to convert a log
+between the two formats.
+"""
+import argparse
+import datetime
+import json
+import math
+import mmap
+import numbers
+import os
+import struct
+
+INDEX_BLOCK_SECONDS = 60
+INDEX_RECORD = struct.Struct("<dQ")
+_TIME_PREFIX = b'{"time": "'
+
+BINARY_MAGIC = b"RESMONB1"
+BINARY_HEADER_LENGTH = struct.Struct("<I")
+# cumulative counters logged by older versions need float64 to stay exact,
+# every other metric fits float32
+DOUBLE_COLUMNS = ("old_network_value", "old_tx", "old_rx")
+LOG_FORMATS = ("json", "binary")
+
+# last indexed block number for every log file written by this process
+_last_indexed_block = {}
+
+
+def index_filename(filename):
+    """Return the path of the sidecar index for a log file."""
+    return filename + ".idx"
+
+
+def forget_index(filename):
+    """Drop what this process remembers about a log's index.
+
+    Call it after the log file was moved, replaced or deleted, so the index
+    of the next file under that name is loaded from disk.
+
+    Args:
+        filename (str): Path of the log file.
+    """
+    _last_indexed_block.pop(filename, None)
+
+
+def format_time(value):
+    """Format a datetime for the JSON log, keeping sub-second sample times."""
+    return value.isoformat(sep=" ", timespec="milliseconds")
+
+
+def parse_time(value):
+    """Parse a logged timestamp string, with or without fractional seconds, into a datetime."""
+    return datetime.datetime.fromisoformat(value)
+
+
+def line_time(line):
+    """Extract the timestamp of a raw log line without decoding all of it.
+
+    Args:
+        line (bytes): One line of the log file.
+
+    Returns:
+        datetime: Timestamp of the entry, or None if it can not be found.
+    """
+    if line.startswith(_TIME_PREFIX):
+        end = line.find(b'"', len(_TIME_PREFIX))
+        if end != -1:
+            try:
+                return parse_time(line[len(_TIME_PREFIX):end].decode())
+            except ValueError:
+                return None
+    try:
+        return parse_time(json.loads(line)["time"])
+    except (json.JSONDecodeError, KeyError, TypeError, ValueError):
+        return None
+
+
+def rebuild_index(filename):
+    """Scan a whole log file once and write a fresh index for it.
+
+    Args:
+        filename (str): Log file to index.
+
+    Returns:
+        int: Last indexed block number, or -1 if nothing was indexed.
+    """
+    last_block = -1
+    try:
+        with open(filename, "rb") as log, open(index_filename(filename), "wb") as idx:
+            offset = 0
+            for line in log:
+                entry_date = line_time(line)
+                if entry_date is not None:
+                    timestamp = entry_date.timestamp()
+                    block = int(timestamp // INDEX_BLOCK_SECONDS)
+                    if block > last_block:
+                        idx.write(INDEX_RECORD.pack(timestamp, offset))
+                        last_block = block
+                offset += len(line)
+    except FileNotFoundError:
+        pass
+    except OSError:
+        print("Could not rebuild index for:", filename)
+    _last_indexed_block[filename] = last_block
+    return last_block
+
+
+def _load_last_block(filename):
+    """Return the last indexed block of a log, rebuilding a missing or stale index."""
+    try:
+        log_size = os.path.getsize(filename)
+    except OSError:
+        log_size = 0
+    try:
+        with open(index_filename(filename), "rb") as idx:
+            idx.seek(0, os.SEEK_END)
+            size = idx.tell()
+            if size >= INDEX_RECORD.size:
+                idx.seek(size - size % INDEX_RECORD.size - INDEX_RECORD.size)
+                timestamp, offset = INDEX_RECORD.unpack(idx.read(INDEX_RECORD.size))
+                if offset < log_size:
+                    return int(timestamp // INDEX_BLOCK_SECONDS)
+            elif log_size == 0:
+                return -1
+    except FileNotFoundError:
+        if log_size == 0:
+            return -1
+    return rebuild_index(filename)
+
+
+def index_append(filename, timestamp, offset):
+    """Record the offset of a new log entry if it starts a new time block.
+
+    Args:
+        filename (str): Log file the entry was written to.
+        timestamp (float): POSIX timestamp of the entry.
+        offset (int): Byte offset of the entry in the log file.
+    """
+    last_block = _last_indexed_block.get(filename)
+    if last_block is None:
+        last_block = _load_last_block(filename)
+    block = int(timestamp // INDEX_BLOCK_SECONDS)
+    if block <= last_block:
+        _last_indexed_block[filename] = last_block
+        return
+    try:
+        with open(index_filename(filename), "ab") as idx:
+            idx.write(INDEX_RECORD.pack(timestamp, offset))
+        _last_indexed_block[filename] = block
+    except OSError:
+        print("Could not write index for:", filename)
+
+
+def index_lookup(filename, timestamp):
+    """Find where to start reading a log to get every entry from a given time on.
+
+    Args:
+        filename (str): Log file to look up.
+        timestamp (float): POSIX timestamp of the first wanted entry.
+
+    Returns:
+        int: Byte offset of the latest indexed block starting at or before timestamp.
+    """
+    if filename not in _last_indexed_block:
+        _last_indexed_block[filename] = _load_last_block(filename)
+    try:
+        with open(index_filename(filename), "rb") as idx:
+            idx.seek(0, os.SEEK_END)
+            low, high = 0, idx.tell() // INDEX_RECORD.size
+            offset = 0
+            while low < high:
+                middle = (low + high) // 2
+                idx.seek(middle * INDEX_RECORD.size)
+                block_time, block_offset = INDEX_RECORD.unpack(
+                    idx.read(INDEX_RECORD.size)
+                )
+                if block_time <= timestamp:
+                    offset = block_offset
+                    low = middle + 1
+                else:
+                    high = middle
+            return offset
+    except OSError:
+        return 0
+
+
+def map_file(filename):
+    """Memory-map a file for reading.
+
+    Args:
+        filename (str): File to map.
+
+    Returns:
+        mmap.mmap: Read-only map of the file, or None if it is missing or empty.
+    """
+    try:
+        with open(filename, "rb") as f:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except FileNotFoundError:
+        print("Log file not found.")
+    except ValueError:
+        # empty files can not be mapped
+        pass
+    return None
+
+
+def iter_json_data(filename, start, y_data, end=None):
+    """Stream the logged entries at or after a start time.
+
+    The log is memory-mapped and read from the index block holding the start
+    time, one line at a time, so memory use does not depend on the log size.
+    A trailing line still being written is skipped, and reading stops at the
+    first entry past end.
+
+    Args:
+       filename (str): Log file to read.
+       start (datetime): Oldest entry time to return.
+       y_data (list): Data keys to retrieve.
+       end (datetime, optional): Newest entry time to return. Defaults to all.
+
+    Yields:
+       tuple: (datetime, list of values for the keys in y_data).
+    """
+    offset = index_lookup(filename, start.timestamp())
+    mapped = map_file(filename)
+    if mapped is None:
+        return
+    try:
+        size = len(mapped)
+        position = offset
+        while position < size:
+            line_end = mapped.find(b"\n", position)
+            if line_end == -1:
+                break
+            line = mapped[position:line_end]
+            position = line_end + 1
+            entry_date = line_time(line)
+            if entry_date is None or entry_date < start:
+                continue
+            if end is not None and entry_date > end:
+                break
+            try:
+                entry = json.loads(line)
+                values = [entry[key] for key in y_data]
+            except (json.JSONDecodeError, KeyError):
+                print("Skipping invalid or incomplete entry.")
+                continue
+            yield entry_date, values
+    finally:
+        mapped.close()
+
+
+def read_json_data(filename, start, y_data, end=None):
+    """Read every logged entry at or after a start time.
+
+    Only the block holding the start time and the ones after it are read.
+
+    Args:
+       filename (str): Log file to read.
+       start (datetime): Oldest entry time to return.
+       y_data (list): Data keys to retrieve.
+       end (datetime, optional): Newest entry time to return. Defaults to all.
+
+    Returns:
+       dict: Lists of values for every key in y_data plus "time".
+    """
+    return collect_data(iter_json_data(filename, start, y_data, end), y_data)
+
+
+def collect_data(entries, y_data):
+    """Gather streamed entries into one list per key.
+
+    Args:
+       entries (iterable): (datetime, list of values) pairs.
+       y_data (list): Data keys of the values.
+
+    Returns:
+       dict: Lists of values for every key in y_data plus "time".
+    """
+    temp_data = {}
+    for key in y_data:
+        temp_data[key] = []
+    temp_data["time"] = []
+    columns = [temp_data[key] for key in y_data]
+    for entry_date, values in entries:
+        temp_data["time"].append(entry_date)
+        for column, value in zip(columns, values):
+            column.append(value)
+    return temp_data
+
+
+class JsonLog:
+    """JSON-lines log with a sparse time index.
+
+    Attributes:
+        filename (str): Path of the log file.
+    """
+
+    log_format = "json"
+
+    def __init__(self, filename):
+        """Initialize the JsonLog.
+
+        Args:
+            filename (str): Path of the log file.
+        """
+        self.filename = filename
+        self._file = None
+
+    def write(self, records):
+        """Write samples through the open file handle, indexing new time blocks.
+
+        Args:
+            records (list): Sample dicts, with "time" as a datetime.
+        """
+        try:
+            if self._file is None:
+                self._file = open(self.filename, "ab")
+            for record in records:
+                write_data = dict(record)
+                write_data["time"] = format_time(record["time"])
+                offset = self._file.tell()
+                self._file.write(json.dumps(write_data).encode() + b"\n")
+                index_append(self.filename, record["time"].timestamp(), offset)
+        except OSError:
+            print("Could not open/write file:", self.filename)
+
+    def flush(self, fsync=False):
+        """Flush buffered samples to the OS, and to disk if fsync is set."""
+        if self._file is None:
+            return
+        try:
+            self._file.flush()
+            if fsync:
+                os.fsync(self._file.fileno())
+        except OSError:
+            print("Could not flush file:", self.filename)
+
+    def close(self):
+        """Flush and close the file handle."""
+        if self._file is not None:
+            self.flush()
+            self._file.close()
+            self._file = None
+
+    def append(self, record):
+        """Append one sample and flush it.
+
+        Args:
+            record (dict): Sample values, with "time" as a datetime.
+        """
+        self.write([record])
+        self.flush()
+
+    def iter_range(self, start, y_data, end=None):
+        """Stream the given keys of every sample from start up to end."""
+        return iter_json_data(self.filename, start, y_data, end)
+
+    def read(self, start, y_data, end=None):
+        """Read the given keys of every sample from start up to end."""
+        return read_json_data(self.filename, start, y_data, end)
+
+    def iter_records(self):
+        """Yield every sample in the log as a dict with "time" as a datetime."""
+        try:
+            with open(self.filename, "rb") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                        entry["time"] = parse_time(entry["time"])
+                    except (json.JSONDecodeError, KeyError, TypeError, ValueError):
+                        print("Skipping invalid or incomplete entry.")
+                        continue
+                    yield entry
+        except FileNotFoundError:
+            print("Log file not found.")
+
+
+def binary_record(columns):
+    """Return the record layout of a binary log with the given columns.
+
+    Args:
+        columns (list): Metric names stored after the timestamp.
+
+    Returns:
+        struct.Struct: Layout of one record.
+    """
+    return struct.Struct(
+        "<d" + "".join("d" if column in DOUBLE_COLUMNS else "f" for column in columns)
+    )
+
+
+def read_binary_header(f):
+    """Read the header of a binary log from the start of a file object.
+
+    Args:
+        f (file): Binary file object positioned at the start of the log.
+
+    Returns:
+        tuple: (columns, byte offset of the first record), or None for an empty file.
+    """
+    magic = f.read(len(BINARY_MAGIC))
+    if not magic:
+        return None
+    if magic != BINARY_MAGIC:
+        raise ValueError("not a binary resmon log")
+    (length,) = BINARY_HEADER_LENGTH.unpack(f.read(BINARY_HEADER_LENGTH.size))
+    header = json.loads(f.read(length))
+    return header["columns"], len(BINARY_MAGIC) + BINARY_HEADER_LENGTH.size + length
+
+
+class BinaryLog:
+    """Fixed-width binary log: a header naming the columns, then packed records.
+
+    Attributes:
+        filename (str): Path of the log file.
+        columns (list): Metric names stored after the timestamp of every record.
+        record (struct.Struct): Layout of one record.
+        data_offset (int): Byte offset of the first record.
+    """
+
+    log_format = "binary"
+
+    def __init__(self, filename, columns=None):
+        """Initialize the BinaryLog.
+
+        The column layout is read from the file header when the file already
+        exists, otherwise it is taken from columns or from the first appended
+        record.
+
+        Args:
+            filename (str): Path of the log file.
+            columns (list, optional): Metric names for a new file.
+        """
+        self.filename = filename
+        self.columns = None
+        self.record = None
+        self.data_offset = 0
+        self._file = None
+        if not self._read_header() and columns is not None:
+            self._set_columns(list(columns))
+
+    def _set_columns(self, columns):
+        """Set the column names and derive the record layout from them."""
+        self.columns = columns
+        self.record = binary_record(columns)
+
+    def _read_header(self):
+        """Load the column layout from an existing file.
+
+        Returns:
+            bool: True if a valid header was found.
+        """
+        try:
+            with open(self.filename, "rb") as f:
+                header = read_binary_header(f)
+        except FileNotFoundError:
+            return False
+        if header is None:
+            return False
+        columns, self.data_offset = header
+        self._set_columns(columns)
+        return True
+
+    def _header_bytes(self):
+        """Return the encoded header for the current columns."""
+        header = json.dumps({"columns": self.columns}).encode()
+        return BINARY_MAGIC + BINARY_HEADER_LENGTH.pack(len(header)) + header
+
+    def _pack(self, record):
+        """Pack one sample dict into a record, storing NaN for missing values."""
+        values = [record["time"].timestamp()]
+        for column in self.columns:
+            try:
+                values.append(float(record[column]))
+            except (KeyError, TypeError, ValueError):
+                values.append(math.nan)
+        return self.record.pack(*values)
+
+    def _drop_partial_record(self, f):
+        """Truncate a record left half-written by an interrupted append."""
+        f.seek(0, os.SEEK_END)
+        extra = (f.tell() - self.data_offset) % self.record.size
+        if extra:
+            f.truncate(f.tell() - extra)
+
+    def write(self, records):
+        """Write samples through the open file handle.
+
+        Args:
+            records (list): Sample dicts, with "time" as a datetime.
+        """
+        if not records:
+            return
+        if self.columns is None:
+            self._set_columns(
+                [
+                    key
+                    for key, value in records[0].items()
+                    if key != "time" and isinstance(value, numbers.Real)
+                ]
+            )
+        try:
+            if self._file is None:
+                self._file = open(self.filename, "ab")
+                if self._file.tell() == 0:
+                    header = self._header_bytes()
+                    self._file.write(header)
+                    self.data_offset = len(header)
+                else:
+                    self._drop_partial_record(self._file)
+            self._file.write(b"".join(self._pack(record) for record in records))
+        except OSError:
+            print("Could not open/write file:", self.filename)
+
+    def flush(self, fsync=False):
+        """Flush buffered samples to the OS, and to disk if fsync is set."""
+        if self._file is None:
+            return
+        try:
+            self._file.flush()
+            if fsync:
+                os.fsync(self._file.fileno())
+        except OSError:
+            print("Could not flush file:", self.filename)
+
+    def close(self):
+        """Flush and close the file handle."""
+        if self._file is not None:
+            self.flush()
+            self._file.close()
+            self._file = None
+
+    def append(self, record):
+        """Append one sample and flush it.
+
+        Args:
+            record (dict): Sample values, with "time" as a datetime.
+        """
+        self.write([record])
+        self.flush()
+
+    def _find(self, mapped, count, timestamp):
+        """Binary-search a mapped log for the first record at or after timestamp."""
+        low, high = 0, count
+        while low < high:
+            middle = (low + high) // 2
+            (record_time,) = struct.unpack_from(
+                "<d", mapped, self.data_offset + middle * self.record.size
+            )
+            if record_time < timestamp:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def iter_range(self, start, y_data, end=None, chunk_records=4096):
+        """Stream the given keys of every sample at or after start.
+
+        The log is memory-mapped, the first and last records are found by
+        binary search on the timestamps, and records are decoded straight
+        from the map a chunk at a time, so memory use does not depend on the
+        log size.
+
+        Args:
+           start (datetime): Oldest entry time to return.
+           y_data (list): Data keys to retrieve.
+           end (datetime, optional): Newest entry time to return. Defaults to all.
+           chunk_records (int, optional): Records decoded per chunk.
+
+        Yields:
+           tuple: (datetime, list of values for the keys in y_data).
+        """
+        if self.columns is None:
+            print("Log file not found.")
+            return
+        positions = []
+        for key in y_data:
+            try:
+                positions.append(self.columns.index(key) + 1)
+            except ValueError:
+                print("Key not stored in binary log:", key)
+                positions.append(None)
+        mapped = map_file(self.filename)
+        if mapped is None:
+            return
+        fromtimestamp = datetime.datetime.fromtimestamp
+        size = self.record.size
+        try:
+            count = max(0, (len(mapped) - self.data_offset) // size)
+            first = self._find(mapped, count, start.timestamp())
+            if end is not None:
+                # first record past end
+                count = self._find(mapped, count, math.nextafter(end.timestamp(), math.inf))
+            with memoryview(mapped) as view:
+                for chunk_start in range(first, count, chunk_records):
+                    chunk_end = min(count, chunk_start + chunk_records)
+                    with view[
+                        self.data_offset + chunk_start * size:self.data_offset + chunk_end * size
+                    ] as chunk:
+                        rows = list(self.record.iter_unpack(chunk))
+                    for values in rows:
+                        yield fromtimestamp(values[0]), [
+                            values[position] if position else math.nan
+                            for position in positions
+                        ]
+        finally:
+            mapped.close()
+
+    def read(self, start, y_data, end=None):
+        """Read the given keys of every sample at or after start.
+
+        Args:
+           start (datetime): Oldest entry time to return.
+           y_data (list): Data keys to retrieve.
+           end (datetime, optional): Newest entry time to return. Defaults to all.
+
+        Returns:
+           dict: Lists of values for every key in y_data plus "time".
+        """
+        return collect_data(self.iter_range(start, y_data, end), y_data)
+
+    def iter_records(self):
+        """Yield every sample in the log as a dict with "time" as a datetime."""
+        if self.columns is None:
+            print("Log file not found.")
+            return
+        with open(self.filename, "rb") as f:
+            f.seek(self.data_offset)
+            while True:
+                chunk = f.read(self.record.size * 4096)
+                chunk = chunk[: len(chunk) - len(chunk) % self.record.size]
+                if not chunk:
+                    break
+                for values in self.record.iter_unpack(chunk):
+                    entry = {"time": datetime.datetime.fromtimestamp(values[0])}
+                    entry.update(zip(self.columns, values[1:]))
+                    yield entry
+
+
+def stored_keys(log):
+    """Return the metric names logged in a log.
+
+    Binary logs name their columns in the header; JSON logs and rotated
+    logs are assumed to log the keys of their first entry throughout.
+
+    Args:
+        log: Log to inspect, e.g. a JsonLog, BinaryLog or SegmentedLog.
+
+    Returns:
+        list: Names of the logged metrics, without "time".
+    """
+    columns = getattr(log, "columns", None)
+    if columns is not None:
+        return list(columns)
+    for record in log.iter_records():
+        return [key for key in record if key != "time"]
+    return []
+
+
+def detect_format(filename):
+    """Guess the format of a log file from its header or extension.
+
+    Args:
+        filename (str): Path of the log file.
+
+    Returns:
+        str: One of LOG_FORMATS.
+    """
+    try:
+        with open(filename, "rb") as f:
+            if f.read(len(BINARY_MAGIC)) == BINARY_MAGIC:
+                return "binary"
+            return "json"
+    except FileNotFoundError:
+        pass
+    return "binary" if filename.endswith(".bin") else "json"
+
+
+def open_log(filename, log_format=None):
+    """Open a log file with the backend for its format.
+
+    Args:
+        filename (str): Path of the log file.
+        log_format (str, optional): One of LOG_FORMATS. Detected when omitted.
+
+    Returns:
+        JsonLog or BinaryLog: The log backend.
+    """
+    if log_format is None:
+        log_format = detect_format(filename)
+    if log_format == "binary":
+        return BinaryLog(filename)
+    return JsonLog(filename)
+
+
+def convert_log(source, destination, log_format):
+    """Copy every sample of a log into a new log of another format.
+
+    Args:
+        source (str): Log file to read, in any supported format.
+        destination (str): Log file to append to.
+        log_format (str): Format of the destination, one of LOG_FORMATS.
+
+    Returns:
+        int: Number of converted samples.
+    """
+    target = open_log(destination, log_format)
+    count = 0
+    batch = []
+    for record in open_log(source).iter_records():
+        batch.append(record)
+        if len(batch) == 4096:
+            target.write(batch)
+            count += len(batch)
+            batch = []
+    target.write(batch)
+    target.close()
+    return count + len(batch)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="resmon log tools")
+    commands = parser.add_subparsers(dest="command", required=True)
+    convert = commands.add_parser("convert", help="convert a log to another format")
+    convert.add_argument("source")
+    convert.add_argument("destination")
+    convert.add_argument("--to", choices=LOG_FORMATS, required=True)
+    args = parser.parse_args()
+    print(f"converted {convert_log(args.source, args.destination, args.to)} samples")
@@ -0,0 +1,96 @@
+"""Background log writer that keeps disk I/O off the sampling loop."""
+import queue
+import threading
+import time
+
+# never: leave syncing to the OS, flush: fsync after every flush,
+# close: fsync once when the writer shuts down
+FSYNC_POLICIES = ("never", "flush", "close")
+_STOP = object()
+
+
+class LogWriter(threading.Thread):
+    """Thread that batches samples and writes them to a log.
+
+    Samples are queued by append() without blocking; the thread writes them
+    through the log's open file handle and flushes once flush_size samples
+    are pending or flush_interval seconds have passed since the last flush.
+
+    Attributes:
+        log (logstore.JsonLog or logstore.BinaryLog): Log to write to.
+        flush_interval (float): Longest time in seconds samples stay buffered.
+        flush_size (int): Number of pending samples that triggers a flush.
+        fsync (str): One of FSYNC_POLICIES.
+    """
+
+    def __init__(self, log, flush_interval=5.0, flush_size=60, fsync="never"):
+        """Initialize the LogWriter.
+
+        Args:
+            log (logstore.JsonLog or logstore.BinaryLog): Log to write to.
+            flush_interval (float, optional): Seconds between flushes. Defaults to 5.
+            flush_size (int, optional): Samples per flush. Defaults to 60.
+            fsync (str, optional): One of FSYNC_POLICIES. Defaults to "never".
+        """
+        threading.Thread.__init__(self, name="resmon-log-writer", daemon=True)
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"unknown fsync policy: {fsync}")
+        self.log = log
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self.fsync = fsync
+        self._queue = queue.SimpleQueue()
+
+    def append(self, record):
+        """Queue one sample for writing.
+
+        Args:
+            record (dict): Sample values, with "time" as a datetime.
+        """
+        self._queue.put(record)
+
+    def _write(self, batch):
+        """Write and flush a batch of samples."""
+        self.log.write(batch)
+        self.log.flush(fsync=self.fsync == "flush")
+
+    def run(self):
+        """Collect queued samples into batches until close() is called."""
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        while True:
+            try:
+                record = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                record = None
+            if record is _STOP:
+                break
+            if record is not None:
+                batch.append(record)
+            if len(batch) >= self.flush_size or time.monotonic() >= deadline:
+                if batch:
+                    self._write(batch)
+                    batch = []
+                deadline = time.monotonic() + self.flush_interval
+        # drain whatever was queued before the stop marker
+        while True:
+            try:
+                record = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if record is not _STOP:
+                batch.append(record)
+        if batch:
+            self._write(batch)
+        self.log.flush(fsync=self.fsync != "never")
+        self.log.close()
+
+    def close(self, timeout=None):
+        """Write every queued sample, close the log, and stop the thread.
+
+        Args:
+            timeout (float, optional): Longest time to wait for the drain.
+        """
+        self._queue.put(_STOP)
+        if self.is_alive():
+            self.join(timeout)
@@ -1,191 +1,210 @@
-import psutil
-import matplotlib.pyplot as plt
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg, NavigationToolbar2Tk
-import matplotlib.dates as mdates
-import collections
+import argparse
+import bisect
+import contextlib
 import datetime
+import queue
+import threading
+import time
 import tkinter as tk
-import json
 
+import numpy as np
+import psutil
 
+import alerts
+import collector
+import exporter
+import instrument
+import metrics
+import remote
+import rollup
+from collector import data, log_data, update_data
+from ringbuffer import RingColumn
+from scheduler import Scheduler
+
+# matplotlib and its Tk backend take most of the startup time, so they are
+# imported by load_matplotlib() when the first figure is built
+Figure = None
+FigureCanvasTkAgg = None
+NavigationToolbar2Tk = None
+ticker = None
 
-# plt.style.use('seaborn-v0_8-whitegrid')
-plt.style.use("dark_background")
 LARGE_FONT = ("Verdana", 12)
-MAX_LENGTH = 5
-data = {}
-for name in (
-    "time",
-    "cpu_usage",
-    "cpu_freq",
-    "mem_usage",
-    "disk_usage",
-    "network_data",
-    "network_in",
-    "network_out",
-    "IO_out",
-    "IO_in",
-):
-    data[name] = collections.deque(maxlen=MAX_LENGTH)
+HISTORY_POLL_MS = 100
+# size in pixels of a graph that is not built yet
+PLACEHOLDER_SIZE = (1000, 640)
+# seconds from process start to the first drawn frame we aim for
+STARTUP_TARGET = 1.0
+# heatmaps with more devices than this number their rows instead of naming them
+MAX_DEVICE_LABELS = 16
 
-data["old_network_value"] = 0
-data["old_tx"] = 0
-data["old_rx"] = 0
-JPEG_CNT = 0
-PDF_CNT = 0
 
+def load_matplotlib():
+    """Import matplotlib and its Tk backend, once, and apply the graph style."""
+    global Figure, FigureCanvasTkAgg, NavigationToolbar2Tk, ticker
+    if Figure is not None:
+        return
+    import matplotlib.style
+    import matplotlib.ticker as ticker
+    from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg, NavigationToolbar2Tk
+    from matplotlib.figure import Figure
 
-def get_network_usage():
-    """Calculate and return current network usage.
+    # matplotlib.style.use('seaborn-v0_8-whitegrid')
+    matplotlib.style.use("dark_background")
 
-    Returns:
-        tuple: A tuple containing:
-         - net_usage (float): Network usage in kilobits per second.
-         - new_value (int): Total bytes sent and received.
-         - tx (int): Current bytes sent.
-         - rx (int): Current bytes received.
-    """
-    tx = psutil.net_io_counters(nowrap=True).bytes_sent
-    rx = psutil.net_io_counters(nowrap=True).bytes_recv
-    new_value = rx + tx
-    net_usage = (new_value - data["old_network_value"]) / 1024 * 8
-    return net_usage, new_value, tx, rx
-
-
-def get_io_usage():
-    """Calculate and update disk I/O usage."""
-    bytes_sent = round(psutil.disk_io_counters().read_bytes / 1024**2, 2)
-    bytes_recv = round(psutil.disk_io_counters().write_bytes / 1024**2, 2)
-    if len(data["IO_in"]) == 0:
-        data["IO_in"].append(bytes_recv)
-        data["IO_out"].append(bytes_sent)
-    else:
-        data["IO_in"].append(bytes_recv - data["IO_in"][-1])
-        data["IO_out"].append(bytes_sent - data["IO_out"][-1])
 
+def read_recent(log, start, y_data, width=rollup.DEFAULT_WIDTH):
+    """Serve a window from the in-memory series.
 
-def update_data():
-    """Get and update system data in real-time."""
+    The values are copied, since the history window outlives the tick and
+    the ring columns are overwritten by later samples.
 
-    data["time"].append(datetime.datetime.now())
+    Args:
+       log (rollup.RollupLog): Log the window would otherwise be read from.
+       start (datetime): Oldest entry time to return.
+       y_data (list): Data keys to retrieve.
+       width (int, optional): Number of points wanted on the x axis.
 
-    data["cpu_usage"].append(psutil.cpu_percent())
+    Returns:
+       dict: Data with "time" as POSIX timestamps, or None if the window does
+       not fit in the in-memory series or needs a rollup tier.
+    """
+    times = data["time"]
+    if not (
+        len(times)
+        and start.timestamp() >= times[0]
+        and log.pick_tier(start, width) is None
+        and all(isinstance(data.get(key), RingColumn) for key in y_data)
+    ):
+        return None
+    count = len(times) - bisect.bisect_left(times, start.timestamp())
+    temp_data = {"time": np.array(times.view(count))}
+    for key in y_data:
+        temp_data[key] = np.array(data[key].view(count))
+    return temp_data
 
-    data["cpu_freq"].append(psutil.cpu_freq().current)
 
-    data["mem_usage"].append(psutil.virtual_memory().percent)
+def read_log(log, start, y_data, width=rollup.DEFAULT_WIDTH):
+    """Read a window from the log.
 
-    (current_net_usage, new_network_usage, tx, rx) = get_network_usage()
-    data["network_data"].append(current_net_usage)
-    data["network_in"].append((rx - data["old_rx"]) / 1024 * 8)
-    data["network_out"].append((tx - data["old_tx"]) / 1024 * 8)
+    The log is searched by time to seek to the requested window, so only
+    the entries that are returned get decoded. Long windows are read from
+    the coarsest rollup tier that still gives width points. This does not
+    touch tkinter, so it can run in a worker thread.
 
-    data["old_network_value"] = new_network_usage
-    data["old_tx"] = tx
-    data["old_rx"] = rx
+    Args:
+       log (rollup.RollupLog): Log to read.
+       start (datetime): Oldest entry time to return.
+       y_data (list): Data keys to retrieve.
+       width (int, optional): Number of points wanted on the x axis.
 
-    get_io_usage()
+    Returns:
+       dict: Data with "time" as POSIX timestamps.
+    """
+    temp_data = log.read(start, y_data, width)
+    temp_data["time"] = [entry_date.timestamp() for entry_date in temp_data["time"]]
+    return temp_data
 
-    data["disk_usage"].append(psutil.disk_usage("/").percent)
 
+def plot_history(offset, graph, resize_y_axis=True):
+    """Plot past data in a new window.
 
-def write_json_data(filename, write_data):
-    """Write logged data to a JSON file.
+    Windows held in memory are plotted right away when this process writes
+    the log. Others are read from the log in a worker thread while the
+    window shows the loading progress, so sampling and the live graphs keep
+    running; the result is handed back to the Tk thread by polling with
+    after().
 
     Args:
-      filename (str): The log file to write to.
-      write_data (dict): Log data to be written.
+       offset (timedelta): Time offset for plotting.
+       graph (GraphFrame): Graph object whose set attributes will help build the new plot.
+       resize_y_axis (bool, optional): Resize the y-axis to make plots more easily readable. Defaults to True.
     """
-    try:
-        with open(filename, "a") as f:
-            json.dump(write_data, f)
-            f.write("\n")
-            f.flush()
-    except OSError:
-        print("Could not open/write file:", filename)
+    if graph.fig is None:
+        width = rollup.DEFAULT_WIDTH
+    else:
+        width = int(graph.fig.get_size_inches()[0] * graph.fig.dpi)
+    start = datetime.datetime.now() - datetime.timedelta(seconds=1) - offset
+    window = open_history_window(graph.legend)
+    status = tk.Label(window, text="Loading history...", font=LARGE_FONT)
+    status.pack(expand=True)
+    temp_data = None
+    if manager.writer is not None:
+        # with --view-only the in-memory samples are not those of the viewed log
+        temp_data = read_recent(manager.log, start, graph.legend, width)
+    if temp_data is not None:
+        status.destroy()
+        show_history(window, graph, temp_data, resize_y_axis)
+        return
+    results = queue.SimpleQueue()
+    worker = threading.Thread(
+        target=load_history,
+        args=(results, manager.log, start, graph.legend, width),
+        daemon=True,
+    )
+    worker.start()
+    poll_history(window, status, graph, results, resize_y_axis, time.monotonic())
 
 
-def log_data(filename):
-    """Append current system resource data to a log file.
+def load_history(results, log, start, y_data, width):
+    """Read a window from the log and queue the result or the error.
 
-    Args:
-        filename (str): The file to append data to.
+    Runs in a worker thread started by plot_history.
     """
-    current_data = dict()
-    for key in data:
-        try:
-            if key == "time":
-                current_data[key] = data[key][-1].strftime("%Y-%m-%d %H:%M:%S")
-            elif key in ("old_network_value", "old_tx", "old_rx"):
-                current_data[key] = data[key]
-            else:
-                current_data[key] = data[key][-1]
-        except IndexError:
-            current_data[key] = 0
-    write_json_data(filename, current_data)
+    try:
+        results.put(read_log(log, start, y_data, width))
+    except Exception as error:
+        results.put(error)
 
 
-def read_data(filename, time_offset, y_data):
-    """Read and filter logged data based on a time offset.
+def poll_history(window, status, graph, results, resize_y_axis, started):
+    """Plot the history once the worker is done, updating the progress until then.
 
     Args:
-       filename (str): Log file to read.
-       time_offset (timedelta): Time offset to filter data.
-       y_data (list): Data keys to retrieve.
-
-    Returns:
-       dict: Filtered data.
+       window (tk.Toplevel): History window.
+       status (tk.Label): Label showing the loading progress.
+       graph (GraphFrame): Graph the history is plotted for.
+       results (queue.SimpleQueue): Queue the worker puts its result in.
+       resize_y_axis (bool): Resize the y-axis to the data.
+       started (float): Monotonic time the loading started.
     """
-    temp_data = {}
-    for key in y_data:
-        temp_data[key] = []
-    temp_data["time"] = []
+    if not window.winfo_exists():
+        # the window was closed while loading, drop the result
+        return
     try:
-        with open(filename, "r") as f:
-            # offset = datetime.timedelta(seconds=time_offset)
-            content = f.readlines()
-            for line in content:
-                try:
-                    entry = json.loads(line)
-                    entry_date = datetime.datetime.strptime(
-                        entry["time"], "%Y-%m-%d %H:%M:%S"
-                    )
-                    if (
-                        entry_date + time_offset
-                        > datetime.datetime.now() - datetime.timedelta(seconds=1)
-                    ):
-                        print(json.dumps(entry, indent=4))
-                        temp_data["time"].append(entry_date)
-                        for key in y_data:
-                            temp_data[key].append(entry[key])
-                        # print(json.dumps(temp_data, indent=4))
-                except (json.JSONDecodeError, KeyError):
-                    print("Skipping invalid or incomplete entry.")
-    except FileNotFoundError:
-        print("Log file not found.")
-
-    return temp_data
-
-
-def plot_history(offset, graph, resize_y_axis=True):
-    """Plot past data.
+        temp_data = results.get_nowait()
+    except queue.Empty:
+        status.config(text=f"Loading history... {time.monotonic() - started:.0f}s")
+        root.after(HISTORY_POLL_MS, poll_history, window, status, graph, results, resize_y_axis, started)
+        return
+    if isinstance(temp_data, Exception):
+        print("Could not load history:", temp_data)
+        status.config(text=f"Could not load history: {temp_data}")
+        return
+    status.destroy()
+    show_history(window, graph, temp_data, resize_y_axis)
+
+
+def show_history(window, graph, temp_data, resize_y_axis=True):
+    """Plot loaded history data in its window.
 
     Args:
-       offset (timedelta): Time offset for plotting.
+       window (tk.Toplevel): History window.
        graph (GraphFrame): Graph object whose set attributes will help build the new plot.
+       temp_data (dict): Data returned by read_recent or read_log.
        resize_y_axis (bool, optional): Resize the y-axis to make plots more easily readable. Defaults to True.
     """
-    temp_data = read_data("log_file.txt", offset, graph.legend)
     x_data = temp_data["time"]
     y_data = []
-    for key in temp_data:
-        if key != "time":
-            y_data.append(temp_data[key])
+    y_ranges = []
+    for key in graph.legend:
+        y_data.append(temp_data[key])
+        if f"{key}_max" in temp_data:
+            y_ranges.append((temp_data[f"{key}_min"], temp_data[f"{key}_max"]))
     new_y_lim = 0
-    for y in y_data:
-        new_y_lim = max(new_y_lim, max(y))
+    for y in y_data + [y_max for y_min, y_max in y_ranges]:
+        new_y_lim = max(new_y_lim, max(y, default=0))
     if resize_y_axis and graph.y_data_lim != 100:
-        visualize_log(
+        history = visualize_log(
             graph.plot_color,
             new_y_lim,
             graph.y_data_label,
@@ -193,9 +212,10 @@ def plot_history(offset, graph, resize_y_axis=True):
             y_data,
             graph.legend,
             graph.line_styles,
+            window,
         )
     else:
-        visualize_log(
+        history = visualize_log(
             graph.plot_color,
             graph.y_data_lim,
             graph.y_data_label,
@@ -203,11 +223,34 @@ def plot_history(offset, graph, resize_y_axis=True):
             y_data,
             graph.legend,
             graph.line_styles,
+            window,
+        )
+    # rolled up history also shows the min/max range of every bucket
+    for y_min, y_max in y_ranges:
+        history.ax.fill_between(
+            x_data, y_min, y_max, color=graph.plot_color, alpha=0.25, linewidth=0
         )
+    if y_ranges:
+        history.canvas.draw_idle()
+
+
+def open_history_window(legend):
+    """Create the window a history plot is shown in.
+
+    Args:
+       legend (list): Legend labels of the plotted graph.
+
+    Returns:
+       tk.Toplevel: The new window.
+    """
+    window = tk.Toplevel(master=root)
+    window.title(f"Log History of {legend[0]} plot")
+    window.geometry("900x600")
+    return window
 
 
 def visualize_log(
-    plot_color, y_data_lim, y_data_label, x_data, y_data, legend, line_styles
+    plot_color, y_data_lim, y_data_label, x_data, y_data, legend, line_styles, window=None
 ):
     """Create and display a new window with plotted past data.
 
@@ -215,14 +258,17 @@ def visualize_log(
        plot_color (str): Color of the plot line.
        y_data_lim (int): Upper limit for the y-axis.
        y_data_label (str): Label for the y-axis.
-       x_data (list): List of datetime objects for the x-axis.
+       x_data (list): List of POSIX timestamps for the x-axis.
        y_data (list): List of lists of data for the y-axis.
        legend (list): List of legend labels. Also names y_data keys
        line_styles (list): List of line styles for each plot line.
+       window (tk.Toplevel, optional): Window to plot in. Defaults to a new one.
+
+    Returns:
+       GraphFrame: The graph shown in the window.
     """
-    window = tk.Toplevel(master=root)
-    window.title(f"Log History of {legend[0]} plot")
-    window.geometry("900x600")
+    if window is None:
+        window = open_history_window(legend)
 
     history = GraphFrame(
         window,
@@ -235,6 +281,7 @@ def visualize_log(
         line_styles,
     )
     history.pack()
+    return history
 
 
 class GraphFrame(tk.Frame):
@@ -244,10 +291,13 @@ class GraphFrame(tk.Frame):
         plot_color (str): Color of the plot line.
         y_data_lim (int): Upper limit for the y-axis.
         y_data_label (str): Label for the y-axis.
-        x_data (list): X-axis data (datetime).
+        x_data (list): X-axis data (POSIX timestamps).
         y_data (list): Y-axis data (resource values).
         legend (list): Plot legend labels. Also names y_data keys
         line_styles (list): Line styles for each plot.
+        background: Cached render of everything but the lines, restored on every frame.
+        frame_seconds (float): Time taken by the last animate() call.
+        fig (matplotlib.figure.Figure): The figure, or None until build() is called.
     """
 
     def __init__(
@@ -260,6 +310,8 @@ class GraphFrame(tk.Frame):
         y_data,
         legend,
         line_styles,
+        live_points=None,
+        deferred=False,
     ):
         """Initialize the GraphFrame.
 
@@ -268,10 +320,13 @@ class GraphFrame(tk.Frame):
           plot_color (str): Color of the plot.
           y_data_lim (int): Y-axis limit.
           y_data_label (str): Label for the y-axis.
-          x_data (deque): X-axis data (time).
+          x_data (RingColumn or list): X-axis data (POSIX timestamps).
           y_data (list): Y-axis data.
           legend (list): Plot legend. Also names y_data keys
           line_styles (list): Line styles for each plot line.
+          live_points (int, optional): Newest samples shown by animate(). Defaults to all.
+          deferred (bool, optional): Only reserve the graph's space and leave
+            building the figure to build(), e.g. until it is first on screen.
         """
         self.plot_color = plot_color
 
@@ -282,8 +337,15 @@ class GraphFrame(tk.Frame):
 
         self.line_styles = line_styles
         self.legend = legend
+        self.live_points = live_points
         # plot list for every y_data sets
         self.plots = []
+        self.background = None
+        self.needs_full_draw = True
+        self.frame_seconds = 0.0
+        self.saving = False
+        # set when frames were skipped while the graph was out of view
+        self.stale = False
 
         tk.Frame.__init__(self, parent_frame, bg="#676767")
         self.title_label = tk.Label(
@@ -294,24 +356,38 @@ class GraphFrame(tk.Frame):
         )
         self.title_label.pack(pady=10, padx=10, side="top")
 
-        self.fig = plt.figure()
-        self.fig.set_size_inches(10, 6, forward=True)
+        self.fig = None
+        self.placeholder = None
+        if deferred:
+            width, height = PLACEHOLDER_SIZE
+            self.placeholder = tk.Frame(self, width=width, height=height, bg="#676767")
+            self.placeholder.pack(side="top", fill=tk.BOTH, expand=True)
+        else:
+            self.build()
+
+    def build(self):
+        """Create the figure, its lines, canvas and toolbar."""
+        load_matplotlib()
+        self.fig = Figure(figsize=(10, 6))
         self.ax = self.fig.add_subplot()
 
-        ax_format = mdates.DateFormatter("%H:%M:%S")
-        self.ax.xaxis.set_major_formatter(ax_format)
+        self.ax.xaxis.set_major_locator(ticker.MaxNLocator(steps=[1, 2, 3, 5, 6, 10]))
+        self.ax.xaxis.set_major_formatter(ticker.FuncFormatter(self.format_time))
+        x_values, y_values = self.visible_data()
         # plot every y_data set and add it to the plot list
-        for t in zip(self.y_data, self.line_styles):
+        for t in zip(y_values, self.line_styles):
             self.plots.append(
                 self.ax.plot(
-                    self.x_data,
+                    x_values,
                     t[0],
                     color=self.plot_color,
                     linestyle=t[1],
                     linewidth=3,
+                    # lines are drawn on top of the cached background by animate()
+                    animated=True,
                 )[0]
             )
-        self.ax.set_ylim(0, y_data_lim)
+        self.ax.set_ylim(0, self.y_data_lim)
 
         self.ax.set_xlabel("Time")
         self.ax.set_ylabel(self.y_data_label)
@@ -322,31 +398,307 @@ class GraphFrame(tk.Frame):
         toolbar = NavigationToolbar2Tk(self.canvas, self)
         toolbar.update()
 
+        if self.placeholder is not None:
+            self.placeholder.destroy()
+            self.placeholder = None
         # place the canvas on the tkinter window
         self.canvas.get_tk_widget().pack(side="top", fill=tk.BOTH, expand=True)
+        # every full draw (ours, a resize, or toolbar zoom/pan) refreshes the background
+        self.canvas.mpl_connect("draw_event", self.on_draw)
 
-    def animate(self):
-        """Get latest data and redraw the graphs"""
-        # update_data(self.data_type)
-        for t in zip(self.plots, self.y_data):
-            t[0].set_xdata(self.x_data)
-            t[0].set_ydata(t[1])
+    def on_draw(self, event):
+        """Cache the freshly drawn background and draw the lines over it.
+
+        Args:
+            event (matplotlib.backend_bases.DrawEvent): Draw event of the canvas.
+        """
+        if event.canvas is not self.canvas or self.saving:
+            # savefig draws on a canvas of its own, and with the lines in it
+            return
+        self.background = self.canvas.copy_from_bbox(self.fig.bbox)
+        for artist in self.animated_artists():
+            self.ax.draw_artist(artist)
+
+    def format_time(self, x, pos):
+        """Format a POSIX timestamp tick of the x-axis as local time.
 
-        self.ax.set_xlim(self.x_data[0], self.x_data[-1])
+        Args:
+            x (float): Tick value.
+            pos (int): Tick position.
+
+        Returns:
+            str: The label, including the date when the axis spans more than a day.
+        """
+        left, right = self.ax.get_xlim()
+        fmt = "%m-%d %H:%M" if right - left > 86400 else "%H:%M:%S"
+        return datetime.datetime.fromtimestamp(x).strftime(fmt)
+
+    def visible_data(self):
+        """Return the x and y values to plot, limited to live_points.
+
+        Returns:
+            tuple: (x values, list of y values), as zero-copy arrays for RingColumns.
+        """
+        if isinstance(self.x_data, RingColumn):
+            x_values = np.asarray(self.x_data.view(self.live_points))
+            y_values = [np.asarray(y.view(len(x_values))) for y in self.y_data]
+            return x_values, y_values
+        return self.x_data, self.y_data
+
+    def animated_artists(self):
+        """Return the artists drawn over the cached background every frame."""
+        return self.plots
+
+    def invalidate(self):
+        """Make the next animate() redraw axes, ticks, labels and legend."""
+        self.needs_full_draw = True
+
+    def is_visible(self, viewport=None):
+        """Check whether any part of the graph is on screen.
+
+        Args:
+            viewport (tk.Widget, optional): Widget clipping the graph, such as the
+                canvas of a ScrollableFrame.
+
+        Returns:
+            bool: False if the window is minimized or the graph is scrolled out of view.
+        """
+        if not self.winfo_viewable():
+            return False
+        if viewport is None:
+            return True
+        top = self.winfo_rooty()
+        view_top = viewport.winfo_rooty()
+        return (
+            top < view_top + viewport.winfo_height()
+            and top + self.winfo_height() > view_top
+        )
+
+    def _update_limits(self):
+        """Move the axis limits only when the data no longer fits them.
+
+        The x-axis is extended half a window ahead of the newest sample, so it
+        only moves every half window instead of every frame.
+
+        Returns:
+            bool: True if the limits changed.
+        """
+        changed = False
+        x_values, y_values = self.visible_data()
+        if not len(x_values):
+            # e.g. a remote host that said hello but sent no samples yet
+            return changed
+        x_first = x_values[0]
+        x_last = x_values[-1]
+        left, right = self.ax.get_xlim()
+        if self.needs_full_draw or x_last > right or x_first < left:
+            span = max(x_last - x_first, 1)
+            self.ax.set_xlim(x_first, x_last + span / 2)
+            changed = True
         if self.y_data_lim != 100:
             max_y_val = self.y_data_lim
-            for y in self.y_data:
-                max_y_val = max(max_y_val, max(y))
-            self.ax.set_ylim(0, max_y_val + 0.2 * max_y_val)
-            # self.y_data_lim = max_y_val
+            for y in y_values:
+                max_y_val = max(max_y_val, float(np.max(y)))
+            top = self.ax.get_ylim()[1]
+            # grow as soon as a value is off the chart, shrink once it uses less than half
+            if max_y_val > top or max_y_val * 1.2 < top / 2:
+                self.ax.set_ylim(0, max_y_val + 0.2 * max_y_val)
+                changed = True
+        return changed
+
+    def update_artists(self):
+        """Give the lines the latest data."""
+        x_values, y_values = self.visible_data()
+        for t in zip(self.plots, y_values):
+            t[0].set_data(x_values, t[1])
+
+    def animate(self):
+        """Get latest data and redraw the graphs.
 
-        self.fig.canvas.draw()
-        self.fig.canvas.flush_events()
+        Only the lines are redrawn over the cached background (blitting);
+        the whole figure is redrawn when the axis limits change.
+        """
+        start = time.perf_counter()
+        self.update_artists()
+
+        if self._update_limits() or self.needs_full_draw or self.background is None:
+            self.needs_full_draw = False
+            self.canvas.draw()
+        else:
+            self.canvas.restore_region(self.background)
+            for artist in self.animated_artists():
+                self.ax.draw_artist(artist)
+            self.canvas.blit(self.fig.bbox)
+        self.canvas.flush_events()
+        self.frame_seconds = time.perf_counter() - start
+
+    def save(self, filename, file_format):
+        """Save the figure, lines included, to a file.
+
+        Args:
+            filename (str): Path of the file to write.
+            file_format (str): Format passed to savefig, e.g. "pdf" or "jpeg".
+        """
+        if self.fig is None:
+            self.build()
+        # savefig skips animated artists, so draw the lines normally for it
+        for artist in self.animated_artists():
+            artist.set_animated(False)
+        self.saving = True
+        try:
+            self.fig.savefig(filename, format=file_format)
+        finally:
+            self.saving = False
+            for artist in self.animated_artists():
+                artist.set_animated(True)
+            self.invalidate()
 
-        self.canvas.draw_idle()  # redraw plot
-        # time.sleep(0.5)
-        # sau cu animate
-        # self.after(1000, self.animate)
+
+class ProcessGraphFrame(GraphFrame):
+    """GraphFrame of the busiest processes' CPU usage by rank.
+
+    The legend is relabelled every frame with the names of the processes
+    currently holding each rank. The ranking changes on most ticks, so the
+    legend is animated and blitted with the lines instead of being part of
+    the cached background.
+    """
+
+    def build(self):
+        """Create the figure like GraphFrame, with an animated legend."""
+        GraphFrame.build(self)
+        self.ax.get_legend().set_animated(True)
+
+    def animated_artists(self):
+        """Return the lines and the legend."""
+        return self.plots + [self.ax.get_legend()]
+
+    def animate(self):
+        """Relabel the legend with the current top processes and redraw."""
+        texts = self.ax.get_legend().get_texts()
+        top = data["top_processes"]
+        for rank, text in enumerate(texts):
+            if rank < len(top):
+                label = f'{top[rank]["name"]} ({top[rank]["pid"]})'
+            else:
+                label = "-"
+            if text.get_text() != label:
+                text.set_text(label)
+        GraphFrame.animate(self)
+
+
+class HeatmapFrame(GraphFrame):
+    """GraphFrame showing one row of colour per device over time.
+
+    All devices are drawn as a single image updated in place, so a frame
+    costs the same with hundreds of cores as with one.
+
+    Attributes:
+        matrix (breakdown.RingMatrix): Values, one column per device.
+        names (list): Device names of the columns.
+        value_lim (float): Value of the brightest colour, or None to follow the data.
+        cmap (str): Matplotlib colormap name.
+        image (matplotlib.image.AxesImage): The heatmap, once built.
+    """
+
+    def __init__(
+        self,
+        parent_frame,
+        cmap,
+        value_lim,
+        label,
+        x_data,
+        matrix,
+        names,
+        live_points=None,
+        deferred=False,
+    ):
+        """Initialize the HeatmapFrame.
+
+        Args:
+          parent_frame (tk.Frame): Parent tkinter frame.
+          cmap (str): Matplotlib colormap name.
+          value_lim (float): Value of the brightest colour, or None to follow the data.
+          label (str): Title of the graph.
+          x_data (RingColumn): POSIX timestamps of the rows.
+          matrix (breakdown.RingMatrix): Values, one column per device.
+          names (list): Device names of the columns.
+          live_points (int, optional): Newest samples shown. Defaults to all.
+          deferred (bool, optional): Leave building the figure to build().
+        """
+        self.matrix = matrix
+        self.names = names
+        self.value_lim = value_lim
+        self.cmap = cmap
+        GraphFrame.__init__(
+            self, parent_frame, "white", 100, label, x_data, [], [], [], live_points, deferred
+        )
+
+    def build(self):
+        """Create the figure with the heatmap image and its colorbar."""
+        GraphFrame.build(self)
+        self.ax.get_legend().remove()
+        x_values, values = self.visible_data()
+        self.image = self.ax.imshow(
+            values.T,
+            aspect="auto",
+            origin="lower",
+            interpolation="nearest",
+            cmap=self.cmap,
+            vmin=0,
+            vmax=self.value_lim or 1,
+            extent=self._extent(x_values),
+            animated=True,
+        )
+        self.plots.append(self.image)
+        self.fig.colorbar(self.image, ax=self.ax)
+        self.ax.set_ylim(-0.5, len(self.names) - 0.5)
+        if len(self.names) <= MAX_DEVICE_LABELS:
+            self.ax.set_yticks(range(len(self.names)), self.names)
+        self.ax.set_ylabel("")
+
+    def _extent(self, x_values):
+        """Return the image extent covering the given timestamps and every device."""
+        if len(x_values) == 0:
+            return (0, 1, -0.5, len(self.names) - 0.5)
+        return (x_values[0], max(x_values[-1], x_values[0] + 1), -0.5, len(self.names) - 0.5)
+
+    def visible_data(self):
+        """Return the timestamps and the matching rows of the matrix.
+
+        Returns:
+            tuple: (x values, values of shape (samples, devices)), as zero-copy arrays.
+        """
+        x_values = np.asarray(self.x_data.view(self.live_points))
+        count = min(len(x_values), len(self.matrix))
+        return x_values[len(x_values) - count:], self.matrix.view(count)
+
+    def update_artists(self):
+        """Give the image the latest data."""
+        x_values, values = self.visible_data()
+        self.image.set_data(values.T)
+        self.image.set_extent(self._extent(x_values))
+
+    def _update_limits(self):
+        """Move the time axis and, when following the data, the colour scale.
+
+        Returns:
+            bool: True if the limits changed.
+        """
+        changed = False
+        x_values, values = self.visible_data()
+        left, right = self.ax.get_xlim()
+        if len(x_values) and (self.needs_full_draw or x_values[-1] > right or x_values[0] < left):
+            span = max(x_values[-1] - x_values[0], 1)
+            self.ax.set_xlim(x_values[0], x_values[-1] + span / 2)
+            changed = True
+        if self.value_lim is None and values.size:
+            peak = 0.0 if np.isnan(values).all() else float(np.nanmax(values))
+            top = self.image.get_clim()[1]
+            # same rule as the line graphs' y axis
+            if peak > top or peak * 1.2 < top / 2:
+                self.image.set_clim(0, max(peak * 1.2, 1))
+                changed = True
+        return changed
 
 
 class GraphManager:
@@ -354,27 +706,163 @@ class GraphManager:
 
     Attributes:
       graphs (list): List of GraphFrame objects to manage.
-      log_file (str): Path to the log file for saving resource data.
+      log (rollup.RollupLog): Log history plots are read from.
+      writer (LogWriter): Background writer saving resource data, or None when only viewing.
+      scheduler (Scheduler): Fixed-rate schedule of the updates.
+      viewport (tk.Widget): Widget the graphs are scrolled in, or None.
+      aggregator (remote.Aggregator): Receiver of remote hosts' samples, or None.
+      exporter (exporter.MetricsExporter): Scrape endpoint the samples are published to, or None.
+      alerts (alerts.AlertEngine): Alert rules checked on every sample, or None.
+      instrumentation (instrument.Instrumentation): Timer of the stages of every update, or None.
+      startup_seconds (float): Time from process start to the first drawn frame, once drawn.
     """
 
-    def __init__(self, graphs, log_file):
+    def __init__(
+        self,
+        graphs,
+        log,
+        writer=None,
+        interval=1.0,
+        viewport=None,
+        aggregator=None,
+        exporter=None,
+        alerts=None,
+        instrumentation=None,
+    ):
         """Initialize the GraphManager.
 
         Args:
           graphs (list): List of GraphFrame objects to manage.
-          log_file (str): Log file path for data recording.
+          log (rollup.RollupLog): Log history plots are read from.
+          writer (LogWriter, optional): Background writer for data recording.
+          interval (float, optional): Seconds between updates. Defaults to 1.
+          viewport (tk.Widget, optional): Widget the graphs are scrolled in.
+          aggregator (remote.Aggregator, optional): Receiver of remote hosts' samples.
+          exporter (exporter.MetricsExporter, optional): Scrape endpoint for the samples.
+          alerts (alerts.AlertEngine, optional): Alert rules checked on every sample.
+          instrumentation (instrument.Instrumentation, optional): Timer of the
+            sample, animate and log stages.
         """
         self.graphs = graphs
-        self.log_file = log_file
-        self.update_all_data()
+        self.log = log
+        self.writer = writer
+        self.scheduler = Scheduler(interval)
+        self.viewport = viewport
+        self.aggregator = aggregator
+        self.exporter = exporter
+        self.alerts = alerts
+        self.instrumentation = instrumentation
+        if instrumentation is not None:
+            self.stage = instrumentation.stage
+        else:
+            self.stage = lambda name: contextlib.nullcontext()
+        self.startup_seconds = None
+        if self.writer is not None:
+            self.writer.start()
+        # let the main loop show the window before the first figure is built
+        root.after(0, self.update_all_data)
+
+    def animate_visible(self, stale_only=False):
+        """Redraw the graphs that are on screen and mark the others stale.
 
-    def update_all_data(self):
-        """Update data for all graphs and start logging process."""
-        update_data()  # Update all data at once
+        Args:
+          stale_only (bool, optional): Only redraw graphs that missed frames
+            while hidden, e.g. right after scrolling or restoring the window.
+        """
         for graph in self.graphs:
-            graph.animate()
-        log_data(self.log_file)
-        root.after(1000, self.update_all_data)
+            if not graph.is_visible(self.viewport):
+                graph.stale = True
+            elif graph.fig is None:
+                # figures are only built once they are first on screen
+                graph.build()
+                graph.stale = False
+                graph.animate()
+                if self.startup_seconds is None:
+                    self.startup_seconds = time.time() - psutil.Process().create_time()
+                    print(
+                        f"First frame drawn {self.startup_seconds:.2f}s after start "
+                        f"(target {STARTUP_TARGET:g}s)"
+                    )
+            elif graph.stale:
+                graph.stale = False
+                graph.invalidate()
+                graph.animate()
+            elif not stale_only:
+                graph.animate()
+
+    def refresh_visible(self, event=None):
+        """Bring graphs that just came into view up to date.
+
+        Args:
+          event (tk.Event, optional): Event that changed what is visible.
+        """
+        self.animate_visible(stale_only=True)
+
+    def update_all_data(self):
+        """Update data for all graphs and start logging process.
+
+        Data is always collected and logged; graphs that are scrolled out of
+        view or in a minimized window are not redrawn.
+        """
+        self.scheduler.begin_tick()
+        with self.stage("sample"):
+            update_data()  # Update all data at once
+        if self.instrumentation is not None:
+            self.instrumentation.record()
+        if self.aggregator is not None:
+            for host in self.aggregator.drain():
+                self.graphs.append(add_host_graph(host))
+        with self.stage("animate"):
+            self.animate_visible()
+        with self.stage("log"):
+            if self.exporter is not None or self.alerts is not None:
+                sample = collector.current_sample()
+                if self.exporter is not None:
+                    self.exporter.publish(sample)
+                if self.alerts is not None:
+                    self.alerts.evaluate(sample)
+            if self.writer is not None:
+                log_data(self.writer)
+        root.after(round(self.scheduler.next_delay() * 1000), self.update_all_data)
+
+    def close(self):
+        """Write out the buffered samples and close the main window."""
+        if self.writer is not None:
+            self.writer.close()
+        if self.exporter is not None:
+            self.exporter.close()
+        print(self.scheduler.summary())
+        if self.aggregator is not None:
+            print(self.aggregator.summary())
+        if self.instrumentation is not None:
+            print(self.instrumentation.summary())
+        root.destroy()
+
+
+def add_host_graph(host):
+    """Add a graph of a remote host's CPU and memory usage below the others.
+
+    Args:
+        host (remote.HostSeries): Series of the host.
+
+    Returns:
+        GraphFrame: The new graph.
+    """
+    keys = [key for key in ("cpu_usage", "mem_usage") if key in host.data]
+    graph = GraphFrame(
+        scrollable_frame.scrollable_frame,
+        "green",
+        100,
+        f"{host.host} CPU / MEMORY (%)",
+        host.data["time"],
+        [host.data[key] for key in keys],
+        keys,
+        ["solid", "dotted"][: len(keys)],
+        max(2, round(args.live_window / host.interval)),
+        deferred=True,
+    )
+    graph.pack(side="top", fill="both", expand=True)
+    return graph
 
 
 class ScrollableFrame(tk.Frame):
@@ -384,6 +872,7 @@ class ScrollableFrame(tk.Frame):
         canvas(tk.Canvas): Canvas object for drawing graphs.
         scrollbar(tk.Scrollbar): Scrollbar object to be displayed on the side of the screen.
         scrollable_frame(tk.Frame): ScrollableFrame object to hold the canvas.
+        view_callbacks(list): Functions called after the visible part of the frame changes.
     """
 
     def __init__(self, parent):
@@ -412,11 +901,23 @@ class ScrollableFrame(tk.Frame):
         self.canvas.bind(
             "<Configure>", lambda e: self.canvas.itemconfig(window_id, width=e.width)
         )
-        self.canvas.configure(yscrollcommand=self.scrollbar.set)
+        self.view_callbacks = []
+        self.canvas.configure(yscrollcommand=self.on_view_change)
 
         self.canvas.pack(side="left", fill="both", expand=True)
         self.scrollbar.pack(side="right", fill="y")
 
+    def on_view_change(self, first, last):
+        """Update the scrollbar and notify listeners that the view moved.
+
+        Args:
+           first (str): Top of the visible part, as a fraction of the content.
+           last (str): Bottom of the visible part, as a fraction of the content.
+        """
+        self.scrollbar.set(first, last)
+        for callback in self.view_callbacks:
+            callback()
+
 
 class ButtonFrame:
     """Frame for buttons to save and plot historical data.
@@ -532,113 +1033,200 @@ class ButtonFrame:
     def save_current_plot_as_pdf(self):
         """Save the current graph as a PDF file.
 
-        The filename is dynamically generated based on the graph's label.
+        The filename is generated from the graph's label and the current time.
         """
-        global PDF_CNT
-        new_file_name = self.graph.y_data_label.replace("/s", "").replace("(%)", "").replace("/", "_")
-        self.graph.fig.savefig(f"{new_file_name}{PDF_CNT}.pdf", format="pdf")
-        print(f"saved figure {PDF_CNT} as pdf")
-        plt.close(self.graph.fig)
-        PDF_CNT += 1
+        self.save_current_plot("pdf")
 
     def save_current_plot_as_jpeg(self):
         """Save the current graph as a JPEG file.
 
-        The filename is dynamically generated based on the graph's label.
+        The filename is generated from the graph's label and the current time.
+        """
+        self.save_current_plot("jpeg")
+
+    def save_current_plot(self, file_format):
+        """Save the current graph, which keeps updating afterwards.
+
+        Args:
+            file_format (str): Format passed to savefig, e.g. "pdf" or "jpeg".
         """
-        global JPEG_CNT
         new_file_name = self.graph.y_data_label.replace("/s", "").replace("(%)", "").replace("/", "_")
-        self.graph.fig.savefig(f"{new_file_name}{JPEG_CNT}.jpeg", format="jpeg")
-        print(f"saved figure {JPEG_CNT} as jpeg")
-        plt.close(self.graph.fig)
-        JPEG_CNT += 1
-
-
-root = tk.Tk()
-root.title("ResMon")
-root.geometry("{}x{}".format(1200, 600))
-# root.resizable(False, False)
-
-scrollable_frame = ScrollableFrame(root)
-scrollable_frame.pack(side="top", fill="both", expand=True)
-
-update_data()
-update_data()
-
-cpu_graph = GraphFrame(
-    scrollable_frame.scrollable_frame,
-    "blue",
-    100,
-    "CPU USAGE (%)",
-    data["time"],
-    [data["cpu_usage"]],
-    ["cpu_usage"],
-    ["solid"],
-)
-cpu_graph.pack(side="top", fill="both", expand=True)
-cpu_button_frame = ButtonFrame(scrollable_frame.scrollable_frame, cpu_graph)
-
-mem_graph = GraphFrame(
-    scrollable_frame.scrollable_frame,
-    "orange",
-    100,
-    "MEMORY USAGE (%)",
-    data["time"],
-    [data["mem_usage"]],
-    ["mem_usage"],
-    ["solid"],
-)
-mem_graph.pack(side="top", fill="both", expand=True)
-mem_button_frame = ButtonFrame(scrollable_frame.scrollable_frame, mem_graph)
-
-# cpu_freq_graph = GraphFrame(scrollable_frame.scrollable_frame, "green",  5000,
-#                             "CPU FREQUENCY (Mhz)", ["cpu_freq"], ["solid"])
-# cpu_freq_graph.pack(side="top", fill="both", expand=True)
-# cpu_freq_button = ButtonFrame(scrollable_frame.scrollable_frame, cpu_freq_graph)
-
-network_data_graph = GraphFrame(
-    scrollable_frame.scrollable_frame,
-    "pink",
-    1000,
-    "NETWORK DATA (Kbs/s)",
-    data["time"],
-    [data["network_data"], data["network_in"], data["network_out"]],
-    ["network_data", "network_in", "network_out"],
-    ["solid", "dotted", "dashed"],
-)
-network_data_graph.pack(side="top", fill="both", expand=True)
-network_data_button = ButtonFrame(scrollable_frame.scrollable_frame, network_data_graph)
-
-io_data_graph = GraphFrame(
-    scrollable_frame.scrollable_frame,
-    "red",
-    5000,
-    "I/O DATA (Mbs)",
-    data["time"],
-    [data["IO_out"], data["IO_in"]],
-    ["IO_out", "IO_in"],
-    ["solid", "dotted"],
-)
-io_data_graph.pack(side="top", fill="both", expand=True)
-io_data_button = ButtonFrame(scrollable_frame.scrollable_frame, io_data_graph)
-
-disk_usage_graph = GraphFrame(
-    scrollable_frame.scrollable_frame,
-    "purple",
-    100,
-    "DISK USAGE (%)",
-    data["time"],
-    [data["disk_usage"]],
-    ["disk_usage"],
-    ["solid"],
-)
-disk_usage_graph.pack(side="top", fill="both", expand=True)
-disk_usage_button = ButtonFrame(scrollable_frame.scrollable_frame, disk_usage_graph)
-
-manager = GraphManager(
-    [cpu_graph, mem_graph, network_data_graph, io_data_graph, disk_usage_graph],
-    "log_file.txt",
-)
-
-root.mainloop()
-# read_data("log_file.txt", 6, datetime.datetime.now())
\ No newline at end of file
+        stamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+        filename = f"{new_file_name.strip()}-{stamp}.{file_format}"
+        try:
+            self.graph.save(filename, file_format)
+            print(f"saved figure as {filename}")
+        except OSError:
+            print("Could not open/write file:", filename)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="ResMon resource monitor")
+    collector.add_log_arguments(parser)
+    collector.add_sampling_arguments(parser)
+    collector.add_collector_arguments(parser)
+    collector.add_process_arguments(parser)
+    exporter.add_exporter_arguments(parser)
+    alerts.add_alert_arguments(parser)
+    instrument.add_instrument_arguments(parser)
+    parser.add_argument(
+        "--live-window",
+        type=float,
+        default=60,
+        help="seconds of samples shown by the live graphs (default: 60)",
+    )
+    parser.add_argument(
+        "--view-only",
+        action="store_true",
+        help="plot live data without writing the log, e.g. to view the log of a headless collector",
+    )
+    parser.add_argument(
+        "--breakdowns",
+        action="store_true",
+        help="also graph per-core, per-interface, per-disk and per-mountpoint heatmaps",
+    )
+    parser.add_argument(
+        "--listen",
+        help="receive samples from remote agents on HOST:PORT or unix:PATH and graph every host",
+    )
+    args = parser.parse_args()
+
+    root = tk.Tk()
+    root.title("ResMon")
+    root.geometry("{}x{}".format(1200, 600))
+    # root.resizable(False, False)
+
+    scrollable_frame = ScrollableFrame(root)
+    scrollable_frame.pack(side="top", fill="both", expand=True)
+
+    collector.set_window(max(args.window, args.live_window), args.interval)
+    collector.open_collectors(args)
+    rules = alerts.open_alerts(args)
+    if rules is not None:
+        collector.require_metrics(rule.metric for rule in rules.rules)
+    live_points = max(2, round(args.live_window / args.interval))
+    if args.top_processes > 0:
+        collector.track_processes(args.top_processes)
+    if args.breakdowns:
+        collector.track_breakdowns()
+    instrumentation = None
+    if args.instrument:
+        instrumentation = instrument.Instrumentation(
+            ["sample", "animate", "log"], data, args.profile_dir
+        )
+        root.bind("<F9>", instrumentation.toggle_profile)
+        root.bind("<F10>", instrumentation.toggle_tracemalloc)
+
+    # the first sample only starts the CPU and counter rate measurements
+    update_data()
+    if instrumentation is not None:
+        instrumentation.record()
+
+    graphs = []
+    for source in collector.collectors.values():
+        if source.graph is None or not source.keys:
+            continue
+        graph = GraphFrame(
+            scrollable_frame.scrollable_frame,
+            source.graph.color,
+            source.graph.limit,
+            source.graph.title,
+            data["time"],
+            [data[key] for key in source.keys],
+            source.keys,
+            metrics.line_styles(source.graph, len(source.keys)),
+            live_points,
+            deferred=True,
+        )
+        graph.pack(side="top", fill="both", expand=True)
+        ButtonFrame(scrollable_frame.scrollable_frame, graph)
+        graphs.append(graph)
+
+    if args.top_processes > 0:
+        process_keys = [f"proc_cpu_{rank}" for rank in range(1, args.top_processes + 1)]
+        process_graph = ProcessGraphFrame(
+            scrollable_frame.scrollable_frame,
+            "cyan",
+            50,
+            "TOP PROCESSES CPU (%)",
+            data["time"],
+            [data[key] for key in process_keys],
+            process_keys,
+            [("solid", "dotted", "dashed", "dashdot")[rank % 4] for rank in range(len(process_keys))],
+            live_points,
+            deferred=True,
+        )
+        process_graph.pack(side="top", fill="both", expand=True)
+        process_button = ButtonFrame(scrollable_frame.scrollable_frame, process_graph)
+        graphs.append(process_graph)
+
+    if args.breakdowns:
+        breakdowns = collector.breakdowns
+        for key, cmap, value_lim, title in (
+            ("cpu_per_core", "inferno", 100, "CPU USAGE PER CORE (%)"),
+            ("net_in_per_nic", "viridis", None, "NETWORK IN PER INTERFACE (Kb/s)"),
+            ("net_out_per_nic", "viridis", None, "NETWORK OUT PER INTERFACE (Kb/s)"),
+            ("disk_read_per_disk", "magma", None, "DISK READ PER DISK (MB/s)"),
+            ("disk_write_per_disk", "magma", None, "DISK WRITE PER DISK (MB/s)"),
+            ("disk_usage_per_mount", "cividis", 100, "DISK USAGE PER MOUNTPOINT (%)"),
+        ):
+            if not breakdowns.labels[key]:
+                continue
+            heatmap = HeatmapFrame(
+                scrollable_frame.scrollable_frame,
+                cmap,
+                value_lim,
+                title,
+                data["time"],
+                breakdowns.series[key],
+                breakdowns.labels[key],
+                live_points,
+                deferred=True,
+            )
+            heatmap.pack(side="top", fill="both", expand=True)
+            graphs.append(heatmap)
+
+    if instrumentation is not None:
+        overhead_keys = [f"self_{name}_p99_ms" for name in instrumentation.stages]
+        overhead_graph = GraphFrame(
+            scrollable_frame.scrollable_frame,
+            "gray",
+            50,
+            "MONITOR OVERHEAD, p99 PER STAGE (ms)",
+            data["time"],
+            [data[key] for key in overhead_keys],
+            overhead_keys,
+            ["solid", "dotted", "dashed"],
+            live_points,
+            deferred=True,
+        )
+        overhead_graph.pack(side="top", fill="both", expand=True)
+        overhead_button = ButtonFrame(scrollable_frame.scrollable_frame, overhead_graph)
+        graphs.append(overhead_graph)
+
+    if args.view_only:
+        writer = None
+        log = collector.open_sample_log(args)
+    else:
+        writer = collector.open_log_writer(args)
+        log = writer.log
+    aggregator = None
+    if args.listen:
+        aggregator = remote.Aggregator(args.listen)
+        aggregator.start()
+    manager = GraphManager(
+        graphs,
+        log,
+        writer,
+        args.interval,
+        scrollable_frame.canvas,
+        aggregator,
+        exporter.open_exporter(args, collector.collectors.values()),
+        rules,
+        instrumentation,
+    )
+    scrollable_frame.view_callbacks.append(manager.refresh_visible)
+    root.bind("<Map>", manager.refresh_visible)
+    root.protocol("WM_DELETE_WINDOW", manager.close)
+
+    root.mainloop()
@@ -0,0 +1,290 @@
+"""Registry of metric collectors.
+
+A collector reads one source, e.g. psutil.virtual_memory(), and declares
+the series it fills, their unit, how often it is read and how its series
+are graphed. collector.update_data() samples the enabled collectors; the
+live graphs, offline reports and the scrape endpoint take their graphs,
+titles and units from here instead of from lists of their own.
+
+Collectors can be read less often than every tick, e.g. disk usage every
+30 seconds; between readings their series repeat the last value, so every
+series stays aligned with "time". A collector can not be read more often
+than the sampling interval, so sampling CPU every 250 ms means running with
+``--interval 0.25`` and leaving the slower collectors at their own pace.
+
+Collectors that are not enabled by default (load average, temperatures)
+are never read unless asked for on the command line or used by an alert
+rule. New collectors are added with register_collector().
+"""
+import collections
+import re
+
+import psutil
+
+from rates import CounterRates
+
+# how a collector's series are graphed; a limit other than 100 follows the data
+GraphStyle = collections.namedtuple("GraphStyle", ["title", "color", "limit", "line_styles"])
+
+
+def line_styles(graph, count):
+    """Return a line style for each of count series, repeating the graph's styles."""
+    return [graph.line_styles[index % len(graph.line_styles)] for index in range(count)]
+
+
+class Collector:
+    """Reads one source of metrics on its own schedule.
+
+    Subclasses set the class attributes and implement read().
+
+    Attributes:
+        name (str): Name the collector is enabled by on the command line.
+        keys (list): Series it fills, in the order read() returns them.
+        units (str): Unit of the values.
+        description (str): What the values measure, e.g. for exporter help texts.
+        interval (float): Seconds between readings; 0 reads it on every tick.
+        graph (GraphStyle): How the series are graphed, or None.
+        default (bool): Enabled unless turned off. Other collectors are only
+            read when something asks for them.
+        values (list): Values of the last reading, or None before the first.
+    """
+
+    name = None
+    keys = []
+    units = ""
+    description = ""
+    interval = 0.0
+    graph = None
+    default = True
+
+    def __init__(self):
+        self.values = None
+        self.failed = False
+        self._due = 0.0
+
+    @classmethod
+    def provides(cls, key):
+        """Return True if the collector fills the series key."""
+        return key in cls.keys
+
+    def read(self, now):
+        """Read the source.
+
+        Args:
+            now (float): time.monotonic() of the tick.
+
+        Returns:
+            list: One value per key.
+        """
+        raise NotImplementedError
+
+    def sample(self, now):
+        """Return the values for a tick, reading the source only when due.
+
+        Args:
+            now (float): time.monotonic() of the tick.
+
+        Returns:
+            list: One value per key.
+        """
+        if self.values is not None and now < self._due:
+            return self.values
+        try:
+            self.values = self.read(now)
+        except (OSError, psutil.Error) as error:
+            if not self.failed:
+                print(f"Could not read {self.name}: {error}")
+                self.failed = True
+            self.values = [float("nan")] * len(self.keys)
+        if self.interval:
+            # keep to the schedule, so readings do not drift by a tick each time
+            self._due += self.interval
+            if self._due <= now:
+                # the first reading, or readings were missed
+                self._due = now + self.interval
+        return self.values
+
+
+class CpuCollector(Collector):
+    """Overall CPU usage."""
+
+    name = "cpu"
+    keys = ["cpu_usage"]
+    units = "%"
+    description = "CPU usage since the previous reading"
+    graph = GraphStyle("CPU USAGE (%)", "blue", 100, ["solid"])
+
+    def read(self, now):
+        """Return the CPU usage since the previous reading."""
+        return [psutil.cpu_percent()]
+
+
+class MemoryCollector(Collector):
+    """Physical memory usage."""
+
+    name = "memory"
+    keys = ["mem_usage"]
+    units = "%"
+    description = "Share of physical memory in use"
+    graph = GraphStyle("MEMORY USAGE (%)", "orange", 100, ["solid"])
+
+    def read(self, now):
+        """Return the share of physical memory in use."""
+        return [psutil.virtual_memory().percent]
+
+
+class CpuFrequencyCollector(Collector):
+    """Current CPU frequency."""
+
+    name = "cpu_freq"
+    keys = ["cpu_freq"]
+    units = "MHz"
+    description = "Current CPU frequency"
+    graph = GraphStyle("CPU FREQUENCY (MHz)", "green", 5000, ["solid"])
+
+    def read(self, now):
+        """Return the current CPU frequency, or 0 where psutil can not read it."""
+        frequency = psutil.cpu_freq()
+        return [frequency.current if frequency else 0]
+
+
+class NetworkCollector(Collector):
+    """Network traffic rates of all interfaces together."""
+
+    name = "network"
+    keys = ["network_data", "network_in", "network_out"]
+    units = "Kb/s"
+    description = "Network traffic, received and sent"
+    graph = GraphStyle("NETWORK DATA (Kbs/s)", "pink", 1000, ["solid", "dotted", "dashed"])
+
+    def __init__(self):
+        Collector.__init__(self)
+        # bytes received and sent, in Kb/s
+        self.rates = CounterRates(2, 8 / 1024)
+
+    def read(self, now):
+        """Return the total, received and sent rates since the previous reading."""
+        counters = psutil.net_io_counters(nowrap=True)
+        rx_rate, tx_rate = self.rates.update((counters.bytes_recv, counters.bytes_sent), now)
+        return [rx_rate + tx_rate, rx_rate, tx_rate]
+
+
+class DiskIOCollector(Collector):
+    """Disk read and write rates of all disks together."""
+
+    name = "disk_io"
+    keys = ["IO_out", "IO_in"]
+    units = "MB/s"
+    description = "Data read from and written to disk"
+    graph = GraphStyle("I/O DATA (MB/s)", "red", 5000, ["solid", "dotted"])
+
+    def __init__(self):
+        Collector.__init__(self)
+        # bytes read and written, in MB/s
+        self.rates = CounterRates(2, 1 / 1024**2)
+
+    def read(self, now):
+        """Return the read and write rates since the previous reading."""
+        counters = psutil.disk_io_counters()
+        if counters is None:
+            return [0.0, 0.0]
+        read_rate, write_rate = self.rates.update((counters.read_bytes, counters.write_bytes), now)
+        return [read_rate, write_rate]
+
+
+class DiskUsageCollector(Collector):
+    """Usage of the root file system."""
+
+    name = "disk_usage"
+    keys = ["disk_usage"]
+    units = "%"
+    description = "Share of the root file system in use"
+    # changes slowly, and statvfs can stall on a busy disk
+    interval = 30.0
+    graph = GraphStyle("DISK USAGE (%)", "purple", 100, ["solid"])
+
+    def read(self, now):
+        """Return the share of the root file system in use."""
+        return [psutil.disk_usage("/").percent]
+
+
+class LoadCollector(Collector):
+    """1, 5 and 15 minute load averages."""
+
+    name = "load"
+    keys = ["load_1m", "load_5m", "load_15m"]
+    units = "processes"
+    description = "Load average"
+    interval = 5.0
+    graph = GraphStyle("LOAD AVERAGE", "yellow", 4, ["solid", "dotted", "dashed"])
+    # emulated with a background thread on Windows
+    default = False
+
+    def read(self, now):
+        """Return the 1, 5 and 15 minute load averages."""
+        return list(psutil.getloadavg())
+
+
+class TemperatureCollector(Collector):
+    """Temperature of every sensor psutil finds, as temp_<chip>_<sensor>.
+
+    The sensors are discovered when the collector is enabled.
+    """
+
+    name = "temperatures"
+    units = "C"
+    description = "Sensor temperature"
+    interval = 5.0
+    graph = GraphStyle("TEMPERATURES (C)", "red", 100, ["solid", "dotted", "dashed", "dashdot"])
+    # reads a file per sensor
+    default = False
+
+    def __init__(self):
+        Collector.__init__(self)
+        self.sensors = []
+        self.keys = []
+        readings = psutil.sensors_temperatures() if hasattr(psutil, "sensors_temperatures") else {}
+        for chip, entries in sorted(readings.items()):
+            for index, entry in enumerate(entries):
+                label = entry.label or str(index)
+                self.sensors.append((chip, index))
+                self.keys.append(re.sub(r"[^0-9a-zA-Z_]+", "_", f"temp_{chip}_{label}").lower())
+
+    @classmethod
+    def provides(cls, key):
+        """Return True for every temp_ series, as the sensors differ by host."""
+        return key.startswith("temp_")
+
+    def read(self, now):
+        """Return the temperature of every discovered sensor, NaN for sensors that went away."""
+        readings = psutil.sensors_temperatures()
+        values = []
+        for chip, index in self.sensors:
+            entries = readings.get(chip, [])
+            values.append(entries[index].current if index < len(entries) else float("nan"))
+        return values
+
+
+COLLECTORS = {}
+
+
+def register_collector(collector_class):
+    """Make a collector available, in graph order after the ones registered before.
+
+    Args:
+        collector_class (type): Subclass of Collector.
+    """
+    COLLECTORS[collector_class.name] = collector_class
+
+
+for collector_class in (
+    CpuCollector,
+    MemoryCollector,
+    CpuFrequencyCollector,
+    NetworkCollector,
+    DiskIOCollector,
+    DiskUsageCollector,
+    LoadCollector,
+    TemperatureCollector,
+):
+    register_collector(collector_class)
@@ -0,0 +1,103 @@
+"""Per-process resource tracking for the busiest processes."""
+import time
+
+import psutil
+
+TOP_N = 5
+
+
+class ProcessTracker:
+    """Tracks CPU, memory and I/O of every process and reports the top N by CPU.
+
+    psutil.Process objects are cached by pid across ticks, so cpu_percent()
+    measures the time since the previous tick and handles are only created
+    for processes that started since then.
+
+    Attributes:
+        top_n (int): Number of processes reported each tick.
+        processes (dict): Cached psutil.Process objects by pid.
+    """
+
+    def __init__(self, top_n=TOP_N):
+        """Initialize the ProcessTracker.
+
+        Args:
+            top_n (int, optional): Number of processes reported each tick.
+        """
+        self.top_n = top_n
+        self.processes = {}
+        self._names = {}
+        self._io = {}
+        self._last_time = None
+
+    def _refresh_pids(self):
+        """Drop exited processes and create handles for new ones."""
+        pids = set(psutil.pids())
+        for pid in list(self.processes):
+            if pid not in pids:
+                del self.processes[pid]
+                self._names.pop(pid, None)
+                self._io.pop(pid, None)
+        for pid in pids:
+            if pid in self.processes:
+                continue
+            try:
+                process = psutil.Process(pid)
+                self._names[pid] = process.name()
+            except (psutil.NoSuchProcess, psutil.AccessDenied, psutil.ZombieProcess):
+                continue
+            self.processes[pid] = process
+            # first call only starts the measurement and always returns 0.0
+            try:
+                process.cpu_percent(None)
+            except (psutil.NoSuchProcess, psutil.AccessDenied):
+                pass
+
+    def update(self):
+        """Measure every process and return the busiest ones.
+
+        Returns:
+            list: Up to top_n dicts with "pid", "name", "cpu" (%), "rss" (MB),
+            "read" and "write" (KB/s), busiest first.
+        """
+        now = time.monotonic()
+        elapsed = now - self._last_time if self._last_time else None
+        self._last_time = now
+        self._refresh_pids()
+        usage = []
+        for pid, process in list(self.processes.items()):
+            try:
+                with process.oneshot():
+                    cpu = process.cpu_percent(None)
+                    rss = process.memory_info().rss
+                    try:
+                        io = process.io_counters()
+                    except (psutil.AccessDenied, AttributeError):
+                        io = None
+            except (psutil.NoSuchProcess, psutil.ZombieProcess):
+                del self.processes[pid]
+                continue
+            except psutil.AccessDenied:
+                continue
+            read = write = 0.0
+            if io is not None:
+                previous = self._io.get(pid)
+                self._io[pid] = (io.read_bytes, io.write_bytes)
+                if previous is not None and elapsed:
+                    read = max(0, io.read_bytes - previous[0]) / 1024 / elapsed
+                    write = max(0, io.write_bytes - previous[1]) / 1024 / elapsed
+            usage.append((cpu, pid, rss, read, write))
+        usage.sort(reverse=True)
+        top = []
+        for cpu, pid, rss, read, write in usage[: self.top_n]:
+            top.append(
+                {
+                    "pid": pid,
+                    "name": self._names.get(pid, "?"),
+                    "cpu": cpu,
+                    "rss": round(rss / 1024**2, 2),
+                    "read": round(read, 2),
+                    "write": round(write, 2),
+                }
+            )
+        return top
@@ -0,0 +1,172 @@
+"""Cache of decoded history columns for repeated history queries.
+
+History plots ask for the same keys over and over, usually with a window
+that only moved forward in time. The cache keeps the decoded columns of the
+most recently used queries, keyed by the log they came from and the set of
+keys, and covering the window of the last query up to the newest record
+read. A query whose start is inside a cached range only reads the records
+written since then and slices the rest from memory; the rows older than its
+start are dropped, so the cache holds no more than the windows asked for.
+A window that moved past the cached records is read like a new one.
+"""
+import bisect
+import collections
+import threading
+
+# number of (log, keys) column sets kept
+CACHE_SIZE = 16
+
+
+class CachedColumns:
+    """Decoded columns of one set of keys from one log.
+
+    Attributes:
+        start (datetime): Oldest start time the columns were read from.
+        times (list): Record times as datetimes, oldest first.
+        columns (dict): List of values for every key.
+    """
+
+    def __init__(self, start, temp_data, keys):
+        """Initialize the CachedColumns.
+
+        Args:
+            start (datetime): Start time the data was read from.
+            temp_data (dict): Data returned by the log's read().
+            keys (tuple): Data keys held.
+        """
+        self.start = start
+        self.times = temp_data["time"]
+        self.columns = {key: temp_data[key] for key in keys}
+
+    def extend(self, temp_data):
+        """Append the records of temp_data newer than the cached ones.
+
+        Args:
+            temp_data (dict): Data read from the time of the newest cached record.
+        """
+        first = 0
+        if self.times:
+            first = bisect.bisect_right(temp_data["time"], self.times[-1])
+        self.times.extend(temp_data["time"][first:])
+        for key, column in self.columns.items():
+            column.extend(temp_data[key][first:])
+
+    def trim(self, start):
+        """Drop the records older than start.
+
+        Args:
+            start (datetime): Oldest entry time kept.
+        """
+        first = bisect.bisect_left(self.times, start)
+        self.start = max(self.start, start)
+        del self.times[:first]
+        for column in self.columns.values():
+            del column[:first]
+
+    def slice(self, start, end=None):
+        """Return copies of the columns from start on.
+
+        Args:
+            start (datetime): Oldest entry time to return.
+            end (datetime, optional): Newest entry time to return. Defaults to all.
+
+        Returns:
+            dict: Lists of values for every key plus "time".
+        """
+        first = bisect.bisect_left(self.times, start)
+        last = len(self.times) if end is None else bisect.bisect_right(self.times, end)
+        temp_data = {"time": self.times[first:last]}
+        for key, column in self.columns.items():
+            temp_data[key] = column[first:last]
+        return temp_data
+
+
+class QueryCache:
+    """LRU cache of decoded history columns in front of log reads.
+
+    Closed rotated segments and samples removed by retention are not
+    tracked; cached columns keep them until they are evicted.
+
+    Attributes:
+        size (int): Number of column sets kept.
+        hits (int): Queries answered with at most a tail read.
+        misses (int): Queries that read the whole window from the log.
+    """
+
+    def __init__(self, size=CACHE_SIZE):
+        """Initialize the QueryCache.
+
+        Args:
+            size (int, optional): Number of column sets kept. Defaults to CACHE_SIZE.
+        """
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+        # history loads run in worker threads; _lock only guards the entry
+        # table, the decoding holds the lock of its own (source, keys), so a
+        # repeated query waits for the first one and hits the cache while
+        # queries of other keys go ahead
+        self._lock = threading.Lock()
+        self._key_locks = {}
+
+    def read(self, log, source, start, y_data, end=None):
+        """Read the given keys of every record at or after start.
+
+        A range with an end is served from the cache when it holds all of
+        it, and otherwise read from the log without being cached, since it
+        does not reach the newest records.
+
+        Args:
+            log: Log to read from on a miss, with a logstore read() method.
+            source: Hashable name of the log within the cache, e.g. the tier period.
+            start (datetime): Oldest entry time to return.
+            y_data (list): Data keys to retrieve.
+            end (datetime, optional): Newest entry time to return. Defaults to all.
+
+        Returns:
+            dict: Lists of values for every key in y_data plus "time".
+        """
+        keys = tuple(y_data)
+        cache_key = (source, keys)
+        with self._lock:
+            key_lock = self._key_locks.setdefault(cache_key, threading.Lock())
+        with key_lock:
+            with self._lock:
+                entry = self._entries.get(cache_key)
+                if entry is not None:
+                    self._entries.move_to_end(cache_key)
+            covered = entry is not None and entry.start <= start and entry.times
+            if end is not None:
+                hit = covered and entry.times[-1] >= end
+                self._count(hit)
+                return entry.slice(start, end) if hit else log.read(start, list(keys), end)
+            # a tail reaching back before start is longer than the window
+            # itself, then reading just the window is cheaper
+            hit = covered and entry.times[-1] >= start
+            self._count(hit)
+            if hit:
+                entry.trim(start)
+                entry.extend(log.read(entry.times[-1], list(keys)))
+                return entry.slice(start)
+            entry = CachedColumns(start, log.read(start, list(keys)), keys)
+            with self._lock:
+                self._entries[cache_key] = entry
+                self._entries.move_to_end(cache_key)
+                while len(self._entries) > self.size:
+                    evicted, dropped = self._entries.popitem(last=False)
+                    self._key_locks.pop(evicted, None)
+            return entry.slice(start)
+
+    def _count(self, hit):
+        """Count a query as a hit or a miss."""
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def clear(self):
+        """Drop every cached column."""
+        with self._lock:
+            self._entries.clear()
@@ -0,0 +1,67 @@
+"""Per-second rates of cumulative counters.
+
+psutil reports network and disk I/O as counters that only grow. A rate is
+the difference between two readings divided by the time between them, which
+is measured on the monotonic clock instead of assumed to be the sampling
+interval, so late or skipped ticks do not show up as spikes or dips.
+"""
+import time
+
+import numpy as np
+
+
+class CounterRates:
+    """Turns readings of a fixed set of counters into per-second rates.
+
+    The raw previous readings are kept, never the computed rates. All
+    counters are handled in one array operation per reading.
+
+    A counter lower than its previous reading was reset (e.g. a driver
+    reload or a device that came back); it is taken to have restarted from
+    zero, so the rate covers what it counted since the reset. Counters that
+    are NaN in either reading give a NaN rate.
+
+    Attributes:
+        size (int): Number of counters.
+        scale (float or numpy.ndarray): Factor applied to the rates, e.g. to convert bytes to MB.
+        resets (int): Counter resets seen so far.
+    """
+
+    def __init__(self, size, scale=1.0):
+        """Initialize the CounterRates.
+
+        Args:
+            size (int): Number of counters.
+            scale (float or sequence, optional): Factor applied to the rates,
+                one for all counters or one per counter.
+        """
+        self.size = size
+        self.scale = np.asarray(scale, dtype=float)
+        self.resets = 0
+        self._previous = None
+        self._last_time = None
+
+    def update(self, counters, now=None):
+        """Compute the rates since the previous reading.
+
+        Args:
+            counters (sequence): Current value of every counter, NaN if unavailable.
+            now (float, optional): time.monotonic() of the reading. Defaults to now.
+
+        Returns:
+            numpy.ndarray: Rate of every counter per second, zero on the first reading.
+        """
+        now = time.monotonic() if now is None else now
+        current = np.asarray(counters, dtype=float).reshape(self.size)
+        if self._previous is None or now <= self._last_time:
+            rates = np.zeros(self.size)
+        else:
+            delta = current - self._previous
+            reset = delta < 0
+            if reset.any():
+                self.resets += int(reset.sum())
+                delta[reset] = current[reset]
+            rates = delta * (self.scale / (now - self._last_time))
+        self._previous = current
+        self._last_time = now
+        return rates
@@ -0,0 +1,446 @@
+"""Remote collection: agents stream samples to an aggregator over a socket.
+
+An agent samples the machine it runs on with the collector and streams the
+samples to an aggregator, which receives from many hosts at once and keeps
+the newest samples of every host in RingColumns like the collector's.
+
+Every message is a frame of a 4-byte little-endian payload length, a
+one-byte frame type, and the payload. An agent first sends a HELLO frame
+holding JSON ``{"host", "columns", "interval"}``, then SAMPLES frames
+holding one or more fixed-width records laid out like the records of a
+binary log (``logstore.binary_record``).
+
+Both sides use asyncio. Agents send whatever samples are pending each tick
+and wait for the socket to drain, so a slow aggregator makes samples queue
+up on the agent, which keeps only the newest ones. The aggregator stops
+reading from a host whose samples are not being consumed.
+
+Addresses are ``HOST:PORT`` for TCP or ``unix:PATH`` for Unix sockets::
+
+    python remote.py aggregate --listen 127.0.0.1:9900
+    python remote.py agent --connect 127.0.0.1:9900 --name web-1
+
+``main.py --listen ADDRESS`` shows a graph for every connected host.
+"""
+import argparse
+import asyncio
+import collections
+import json
+import signal
+import socket
+import struct
+import threading
+import time
+
+import logstore
+from ringbuffer import RingColumn
+from scheduler import Scheduler
+
+FRAME_HEADER = struct.Struct("<IB")
+HELLO = 1
+SAMPLES = 2
+# frames larger than this are treated as a protocol error
+MAX_FRAME = 16 * 1024**2
+# pending connections, so hundreds of agents can connect at once
+LISTEN_BACKLOG = 1024
+# samples kept per host in the aggregator, one hour at 1 s
+HOST_WINDOW = 3600
+# samples an agent keeps while the aggregator is unreachable or slow
+AGENT_BACKLOG = 600
+# longest wait in seconds between reconnection attempts
+MAX_RECONNECT_DELAY = 30
+
+
+def parse_address(address):
+    """Split an address into the arguments of the asyncio socket functions.
+
+    Args:
+        address (str): "HOST:PORT" or "unix:PATH".
+
+    Returns:
+        tuple: ("unix", path) or ("tcp", host, port).
+    """
+    if address.startswith("unix:"):
+        return ("unix", address[len("unix:"):])
+    host, separator, port = address.rpartition(":")
+    if not separator or not port.isdigit():
+        raise ValueError(f"address must be HOST:PORT or unix:PATH, not {address!r}")
+    return ("tcp", host or "127.0.0.1", int(port))
+
+
+def encode_frame(frame_type, payload):
+    """Return a frame holding payload.
+
+    Args:
+        frame_type (int): HELLO or SAMPLES.
+        payload (bytes): Frame contents.
+
+    Returns:
+        bytes: The encoded frame.
+    """
+    return FRAME_HEADER.pack(len(payload), frame_type) + payload
+
+
+async def read_frame(reader):
+    """Read one frame from a stream.
+
+    Args:
+        reader (asyncio.StreamReader): Stream to read from.
+
+    Returns:
+        tuple: (frame type, payload bytes).
+    """
+    length, frame_type = FRAME_HEADER.unpack(await reader.readexactly(FRAME_HEADER.size))
+    if length > MAX_FRAME:
+        raise ValueError(f"frame of {length} bytes is too large")
+    return frame_type, await reader.readexactly(length)
+
+
+class Agent:
+    """Samples this machine with the collector and streams the samples.
+
+    Attributes:
+        address (str): Aggregator address.
+        name (str): Host name reported to the aggregator.
+        interval (float): Seconds between samples.
+        columns (list): Series sent with every sample.
+        pending (collections.deque): Encoded samples not sent yet.
+        dropped (int): Samples dropped because the backlog was full.
+    """
+
+    def __init__(self, address, name=None, interval=1.0, backlog=AGENT_BACKLOG):
+        """Initialize the Agent.
+
+        Args:
+            address (str): Aggregator address.
+            name (str, optional): Host name reported. Defaults to the host name.
+            interval (float, optional): Seconds between samples. Defaults to 1.
+            backlog (int, optional): Samples kept while they can not be sent.
+        """
+        # imported here so that aggregators do not need psutil
+        import collector
+
+        self.collector = collector
+        self.address = address
+        self.name = name or socket.gethostname()
+        self.interval = interval
+        self.columns = [
+            key for key in collector.data if key != "time" and isinstance(collector.data[key], RingColumn)
+        ]
+        self.record = logstore.binary_record(self.columns)
+        self.pending = collections.deque(maxlen=backlog)
+        self.dropped = 0
+        self.scheduler = Scheduler(interval)
+        self._ready = None
+
+    def sample(self):
+        """Take a sample and queue it for sending."""
+        self.collector.update_data()
+        sample = self.collector.current_sample()
+        if len(self.pending) == self.pending.maxlen:
+            self.dropped += 1
+        self.pending.append(
+            self.record.pack(sample["time"].timestamp(), *[sample[key] for key in self.columns])
+        )
+        self._ready.set()
+
+    async def _sample_loop(self):
+        """Sample on a fixed schedule."""
+        while True:
+            self.scheduler.begin_tick()
+            self.sample()
+            await asyncio.sleep(self.scheduler.next_delay())
+
+    async def _connect(self):
+        """Open a connection to the aggregator."""
+        address = parse_address(self.address)
+        if address[0] == "unix":
+            return await asyncio.open_unix_connection(address[1])
+        return await asyncio.open_connection(address[1], address[2])
+
+    async def _send_loop(self):
+        """Send the pending samples, reconnecting whenever the connection drops."""
+        delay = 1
+        hello = json.dumps(
+            {"host": self.name, "columns": self.columns, "interval": self.interval}
+        ).encode()
+        while True:
+            try:
+                reader, writer = await self._connect()
+            except OSError as error:
+                print(f"Could not connect to {self.address}: {error}")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, MAX_RECONNECT_DELAY)
+                continue
+            print(f"Connected to {self.address} as {self.name}")
+            delay = 1
+            try:
+                writer.write(encode_frame(HELLO, hello))
+                while True:
+                    await self._ready.wait()
+                    self._ready.clear()
+                    batch = []
+                    while self.pending and len(batch) * self.record.size < MAX_FRAME - self.record.size:
+                        batch.append(self.pending.popleft())
+                    if batch:
+                        writer.write(encode_frame(SAMPLES, b"".join(batch)))
+                        # waits while the aggregator is not keeping up
+                        await writer.drain()
+                    if self.pending:
+                        self._ready.set()
+            except OSError as error:
+                print("Lost connection to aggregator:", error)
+            finally:
+                writer.close()
+
+    async def run(self):
+        """Sample and send until cancelled."""
+        self._ready = asyncio.Event()
+        sender = asyncio.ensure_future(self._send_loop())
+        try:
+            await self._sample_loop()
+        finally:
+            sender.cancel()
+
+
+class HostSeries:
+    """Newest samples of one remote host.
+
+    Attributes:
+        host (str): Host name sent by the agent.
+        columns (list): Series sent by the agent.
+        interval (float): Seconds between the agent's samples.
+        data (dict): RingColumn of every series, "time" holding POSIX timestamps.
+        pending (collections.deque): Received records not yet moved into data.
+        connected (bool): The agent is connected.
+        received (int): Samples received so far.
+    """
+
+    def __init__(self, host, columns, interval, window=HOST_WINDOW):
+        """Initialize the HostSeries.
+
+        Args:
+            host (str): Host name sent by the agent.
+            columns (list): Series sent by the agent.
+            interval (float): Seconds between the agent's samples.
+            window (int, optional): Samples kept per series.
+        """
+        self.host = host
+        self.columns = columns
+        self.interval = interval
+        self.record = logstore.binary_record(columns)
+        self.data = {"time": RingColumn(window)}
+        for key in columns:
+            self.data[key] = RingColumn(window)
+        self.pending = collections.deque()
+        self.connected = True
+        self.received = 0
+
+    def drain(self):
+        """Move the received records into the series.
+
+        Returns:
+            int: Number of samples added.
+        """
+        count = 0
+        keys = ["time"] + self.columns
+        while self.pending:
+            values = self.pending.popleft()
+            for key, value in zip(keys, values):
+                self.data[key].append(value)
+            count += 1
+        return count
+
+
+class Aggregator:
+    """Receives samples from many agents at once.
+
+    The server runs on an asyncio loop, usually in its own thread, and only
+    queues the decoded records. drain() moves them into every host's series
+    on the thread that reads them, so a GUI never sees a series changing
+    while it draws.
+
+    Attributes:
+        address (str): Address listened on.
+        window (int): Samples kept per host and series.
+        max_pending (int): Received samples per host after which reading pauses.
+        hosts (dict): HostSeries by host name.
+    """
+
+    def __init__(self, address, window=HOST_WINDOW, max_pending=None):
+        """Initialize the Aggregator.
+
+        Args:
+            address (str): "HOST:PORT" or "unix:PATH" to listen on.
+            window (int, optional): Samples kept per host and series.
+            max_pending (int, optional): Defaults to window.
+        """
+        self.address = address
+        self.window = window
+        self.max_pending = window if max_pending is None else max_pending
+        self.hosts = {}
+        self._new_hosts = []
+        self._lock = threading.Lock()
+
+    async def _handle(self, reader, writer):
+        """Receive the frames of one agent connection."""
+        peer = writer.get_extra_info("peername") or "unix socket"
+        host = None
+        try:
+            frame_type, payload = await read_frame(reader)
+            hello = json.loads(payload)
+            if frame_type != HELLO:
+                raise ValueError("first frame is not a hello")
+            host = self._register(hello["host"], hello["columns"], hello["interval"])
+            while True:
+                frame_type, payload = await read_frame(reader)
+                if frame_type != SAMPLES or len(payload) % host.record.size:
+                    raise ValueError("malformed sample frame")
+                while len(host.pending) >= self.max_pending:
+                    # stop reading until the samples are consumed, so the
+                    # socket fills up and the agent holds back
+                    await asyncio.sleep(host.interval)
+                host.pending.extend(host.record.iter_unpack(payload))
+                host.received += len(payload) // host.record.size
+        except asyncio.IncompleteReadError:
+            pass
+        except (OSError, ValueError, KeyError, TypeError) as error:
+            print(f"Dropping agent connection from {peer}: {error}")
+        finally:
+            if host is not None:
+                host.connected = False
+                print(f"Host {host.host} disconnected")
+            writer.close()
+
+    def _register(self, name, columns, interval):
+        """Return the series of a connecting host, creating them on first contact."""
+        with self._lock:
+            host = self.hosts.get(name)
+            if host is None or host.columns != columns:
+                host = HostSeries(name, columns, interval, self.window)
+                self.hosts[name] = host
+                self._new_hosts.append(host)
+            host.connected = True
+        print(f"Host {name} connected")
+        return host
+
+    async def serve(self):
+        """Accept agent connections until cancelled."""
+        address = parse_address(self.address)
+        if address[0] == "unix":
+            server = await asyncio.start_unix_server(
+                self._handle, address[1], backlog=LISTEN_BACKLOG
+            )
+        else:
+            server = await asyncio.start_server(
+                self._handle, address[1], address[2], backlog=LISTEN_BACKLOG
+            )
+        async with server:
+            await server.serve_forever()
+
+    def start(self):
+        """Serve in a daemon thread.
+
+        Returns:
+            threading.Thread: The started thread.
+        """
+        thread = threading.Thread(
+            target=asyncio.run, args=(self.serve(),), name="resmon-aggregator", daemon=True
+        )
+        thread.start()
+        return thread
+
+    def drain(self):
+        """Move every host's received records into its series.
+
+        Returns:
+            list: HostSeries of the hosts that connected since the last call.
+        """
+        with self._lock:
+            new_hosts = self._new_hosts
+            self._new_hosts = []
+            hosts = list(self.hosts.values())
+        for host in hosts:
+            host.drain()
+        return new_hosts
+
+    def summary(self):
+        """Return a one-line report of the connected hosts."""
+        hosts = list(self.hosts.values())
+        connected = sum(host.connected for host in hosts)
+        received = sum(host.received for host in hosts)
+        return f"{connected}/{len(hosts)} hosts connected, {received} samples received"
+
+
+def _stop(signum, frame):
+    """Turn a termination signal into a clean shutdown."""
+    raise KeyboardInterrupt
+
+
+def aggregate(address, report_interval=10.0):
+    """Run an aggregator and print a status line every report_interval seconds.
+
+    Args:
+        address (str): Address to listen on.
+        report_interval (float, optional): Seconds between status lines.
+    """
+    aggregator = Aggregator(address)
+    aggregator.start()
+    try:
+        while True:
+            time.sleep(report_interval)
+            aggregator.drain()
+            print(aggregator.summary())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="ResMon remote collection")
+    commands = parser.add_subparsers(dest="command", required=True)
+    agent_parser = commands.add_parser("agent", help="sample this machine and stream to an aggregator")
+    agent_parser.add_argument("--connect", required=True, help="aggregator address, HOST:PORT or unix:PATH")
+    agent_parser.add_argument("--name", help="host name reported to the aggregator (default: this host's name)")
+    agent_parser.add_argument(
+        "--interval", type=float, default=1.0, help="seconds between samples (default: 1)"
+    )
+    agent_parser.add_argument(
+        "--collect",
+        nargs="+",
+        default=[],
+        metavar="NAME",
+        help="also sample these collectors, e.g. load temperatures",
+    )
+    agent_parser.add_argument(
+        "--top-processes",
+        type=int,
+        default=0,
+        help="number of busiest processes to track, 0 to disable (default: 0)",
+    )
+    aggregate_parser = commands.add_parser("aggregate", help="receive samples from agents")
+    aggregate_parser.add_argument("--listen", required=True, help="address to listen on, HOST:PORT or unix:PATH")
+    aggregate_parser.add_argument(
+        "--report-interval", type=float, default=10.0, help="seconds between status lines (default: 10)"
+    )
+    args = parser.parse_args()
+    signal.signal(signal.SIGTERM, _stop)
+    if args.command == "agent":
+        import collector
+
+        # only the newest sample is needed
+        collector.set_window(2 * args.interval, args.interval)
+        unknown = [name for name in args.collect if name not in collector.metrics.COLLECTORS]
+        if unknown:
+            raise SystemExit(f"Unknown collector: {', '.join(unknown)}")
+        collector.enable_collectors(args.collect)
+        if args.top_processes > 0:
+            collector.track_processes(args.top_processes)
+        collector.update_data()
+        agent = Agent(args.connect, args.name, args.interval)
+        try:
+            asyncio.run(agent.run())
+        except KeyboardInterrupt:
+            pass
+        print(agent.scheduler.summary(), f"{agent.dropped} dropped")
+    else:
+        aggregate(args.listen, args.report_interval)
@@ -0,0 +1,298 @@
+"""Offline reports: every graph of a log time range rendered to files.
+
+Each log is read once for the requested range, from the coarsest rollup
+tier that still gives enough points, and its graphs are then rendered in
+parallel by a process pool with matplotlib's Agg backend. Nothing here
+imports tkinter, so reports can be generated from cron on machines without
+a display::
+
+    python report.py /var/log/resmon/resmon.bin --hours 24 --format png pdf --output-dir reports
+
+Pass the active log file of a rotated log; its rotated and compressed
+segments are found next to it and read along with it. Files are named
+``<log name>-<graph>.<format>``. Graphs whose metrics were not logged (e.g.
+the top process series of a log written without --top-processes) are left
+out.
+"""
+import argparse
+import concurrent.futures
+import datetime
+import os
+
+import matplotlib.style
+import matplotlib.ticker as ticker
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+import logstore
+import metrics
+import rollup
+import segments
+
+# (name, title, color, y limit, keys, line styles) of the graphs of series
+# not sampled by a collector; a limit other than 100 is replaced by the
+# largest value in the range
+EXTRA_GRAPHS = (
+    (
+        "processes",
+        "TOP PROCESSES CPU (%)",
+        "cyan",
+        50,
+        [f"proc_cpu_{rank}" for rank in range(1, 11)],
+        [("solid", "dotted", "dashed", "dashdot")[rank % 4] for rank in range(10)],
+    ),
+    (
+        "overhead",
+        "MONITOR OVERHEAD, p99 PER STAGE (ms)",
+        "gray",
+        50,
+        ["self_sample_p99_ms", "self_animate_p99_ms", "self_log_p99_ms"],
+        ["solid", "dotted", "dashed"],
+    ),
+)
+REPORT_FORMATS = ("png", "pdf", "svg")
+
+
+def report_graphs(stored):
+    """Return the graphs of the series stored in a log.
+
+    Every registered collector with a graph gets one, with the stored
+    series it provides, so the series of collectors that were not enabled
+    on the monitored host are left out.
+
+    Args:
+        stored (list): Series names logged.
+
+    Returns:
+        list: (name, title, color, y limit, keys, line styles) of every graph.
+    """
+    graphs = []
+    for name, collector_class in metrics.COLLECTORS.items():
+        graph = collector_class.graph
+        if graph is None:
+            continue
+        # collectors that find their series at runtime declare no keys
+        candidates = collector_class.keys or stored
+        keys = [key for key in candidates if key in stored and collector_class.provides(key)]
+        if keys:
+            graphs.append(
+                (name, graph.title, graph.color, graph.limit, keys, metrics.line_styles(graph, len(keys)))
+            )
+    for name, title, color, limit, keys, styles in EXTRA_GRAPHS:
+        logged = [index for index, key in enumerate(keys) if key in stored]
+        if logged:
+            graphs.append(
+                (name, title, color, limit, [keys[i] for i in logged], [styles[i] for i in logged])
+            )
+    return graphs
+
+
+def open_report_log(filename):
+    """Open a raw log with its rollup tiers for reading, rotated segments included.
+
+    Segments are found on disk next to the log, so the options it was
+    written with do not need to be repeated. The policy never rotates, and
+    nothing is written anyway.
+
+    Args:
+        filename (str): Path of the raw log file, i.e. the active segment.
+
+    Returns:
+        rollup.RollupLog: The opened log.
+    """
+    policy = segments.RotationPolicy(0, 0, "none", 0)
+    return rollup.RollupLog(
+        segments.SegmentedLog(logstore.open_log(filename), policy),
+        lambda tier_log: segments.SegmentedLog(tier_log, policy),
+    )
+
+
+def read_range(filename, start, end, width=rollup.DEFAULT_WIDTH):
+    """Read every graphed metric of a log time range in one pass.
+
+    Args:
+        filename (str): Path of the raw log file, i.e. the active segment.
+        start (datetime): Oldest entry time to read.
+        end (datetime): Newest entry time to read.
+        width (int, optional): Points wanted on the x axis.
+
+    Returns:
+        tuple: (graphs, data). The graphs are those of report_graphs(); the
+        data holds lists of values for every graphed key plus "time" as POSIX
+        timestamps, and ``<key>_min``/``<key>_max`` when a tier was read.
+    """
+    log = open_report_log(filename)
+    # entries missing a requested key are skipped, so only ask for logged keys
+    graphs = report_graphs(logstore.stored_keys(log.log))
+    keys = []
+    for name, title, color, limit, graph_keys, styles in graphs:
+        keys += graph_keys
+    temp_data = log.read(start, keys, width, end)
+    temp_data["time"] = [entry_date.timestamp() for entry_date in temp_data["time"]]
+    return graphs, temp_data
+
+
+def _logged(values):
+    """Return True if a column holds at least one real value."""
+    return any(value == value for value in values)
+
+
+def _highest(values):
+    """Return the largest real value of a column, or 0."""
+    return max((value for value in values if value == value), default=0)
+
+
+def _format_time(x, pos, span):
+    """Format a POSIX timestamp tick as local time, with the date on long axes."""
+    fmt = "%m-%d %H:%M" if span > 86400 else "%H:%M:%S"
+    return datetime.datetime.fromtimestamp(x).strftime(fmt)
+
+
+def render_graph(graph, temp_data, basename, formats):
+    """Render one graph of a log's data to files. Runs in a pool worker.
+
+    Args:
+        graph (tuple): Graph returned by report_graphs().
+        temp_data (dict): Data of the graph's keys, as returned by read_range.
+        basename (str): Output path without the graph name and extension.
+        formats (list): File formats, from REPORT_FORMATS.
+
+    Returns:
+        list: Paths of the written files.
+    """
+    name, title, color, limit, keys, styles = graph
+    x_data = temp_data["time"]
+    with matplotlib.style.context("dark_background"):
+        fig = Figure(figsize=(10, 6))
+        FigureCanvasAgg(fig)
+        ax = fig.add_subplot()
+        plots = []
+        highest = 0
+        for key, style in zip(keys, styles):
+            plots.append(ax.plot(x_data, temp_data[key], color=color, linestyle=style, linewidth=3)[0])
+            highest = max(highest, _highest(temp_data[key]))
+            if f"{key}_max" in temp_data:
+                # rolled up data also shows the min/max range of every bucket
+                ax.fill_between(
+                    x_data,
+                    temp_data[f"{key}_min"],
+                    temp_data[f"{key}_max"],
+                    color=color,
+                    alpha=0.25,
+                    linewidth=0,
+                )
+                highest = max(highest, _highest(temp_data[f"{key}_max"]))
+        if limit != 100:
+            limit = highest if highest > 0 else limit
+        ax.set_ylim(0, limit)
+        span = x_data[-1] - x_data[0]
+        ax.xaxis.set_major_locator(ticker.MaxNLocator(steps=[1, 2, 3, 5, 6, 10]))
+        ax.xaxis.set_major_formatter(ticker.FuncFormatter(lambda x, pos: _format_time(x, pos, span)))
+        first, last = (
+            datetime.datetime.fromtimestamp(x).strftime("%Y-%m-%d %H:%M") for x in (x_data[0], x_data[-1])
+        )
+        ax.set_title(f"{os.path.basename(basename)}: {title}\n{first} - {last}")
+        ax.set_xlabel("Time")
+        ax.set_ylabel(title)
+        ax.legend(plots, keys, loc="upper left")
+        written = []
+        for file_format in formats:
+            filename = f"{basename}-{name}.{file_format}"
+            try:
+                fig.savefig(filename, format=file_format)
+                written.append(filename)
+            except OSError:
+                print("Could not open/write file:", filename)
+    return written
+
+
+def render_logs(
+    filenames, start, end, output_dir=".", formats=("png",), jobs=None, width=rollup.DEFAULT_WIDTH
+):
+    """Render the graphs of every log's time range in a process pool.
+
+    Logs are read one after the other in this process while the graphs of
+    the logs read so far are already being rendered.
+
+    Args:
+        filenames (list): Raw log files to report on.
+        start (datetime): Oldest entry time graphed.
+        end (datetime): Newest entry time graphed.
+        output_dir (str, optional): Directory the files are written to.
+        formats (sequence, optional): File formats, from REPORT_FORMATS.
+        jobs (int, optional): Worker processes. Defaults to the CPU count.
+        width (int, optional): Points wanted on the x axis.
+
+    Returns:
+        list: Paths of the written files.
+    """
+    written = []
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = []
+        for filename in filenames:
+            graphs, temp_data = read_range(filename, start, end, width)
+            if len(temp_data["time"]) < 2:
+                print(f"No samples in the range in {filename}, skipped")
+                continue
+            basename = os.path.join(output_dir, os.path.basename(filename))
+            for graph in graphs:
+                name, title, color, limit, keys, styles = graph
+                logged = [index for index, key in enumerate(keys) if _logged(temp_data[key])]
+                if not logged:
+                    continue
+                graph = (name, title, color, limit, [keys[i] for i in logged], [styles[i] for i in logged])
+                # only ship the graph's own columns to the worker
+                graph_data = {"time": temp_data["time"]}
+                for key in graph[4]:
+                    for column in (key, f"{key}_min", f"{key}_max"):
+                        if column in temp_data:
+                            graph_data[column] = temp_data[column]
+                futures.append(pool.submit(render_graph, graph, graph_data, basename, list(formats)))
+        for future in futures:
+            written += future.result()
+    return written
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Render resmon graphs of log files to image files")
+    parser.add_argument(
+        "log_files",
+        nargs="+",
+        help="raw sample logs, one report per log; rotated segments are read with their log",
+    )
+    parser.add_argument(
+        "--end",
+        type=datetime.datetime.fromisoformat,
+        help="end of the graphed range, e.g. '2024-05-01 00:00' (default: now)",
+    )
+    parser.add_argument(
+        "--hours",
+        type=float,
+        default=24,
+        help="length of the graphed range in hours (default: 24)",
+    )
+    parser.add_argument(
+        "--format",
+        nargs="+",
+        choices=REPORT_FORMATS,
+        default=["png"],
+        help="file formats to write (default: png)",
+    )
+    parser.add_argument("--output-dir", default=".", help="directory the files are written to")
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        help="worker processes rendering graphs (default: number of CPUs)",
+    )
+    parser.add_argument(
+        "--width",
+        type=int,
+        default=rollup.DEFAULT_WIDTH,
+        help=f"points wanted on the x axis (default: {rollup.DEFAULT_WIDTH})",
+    )
+    args = parser.parse_args()
+    end = args.end or datetime.datetime.now()
+    start = end - datetime.timedelta(hours=args.hours)
+    os.makedirs(args.output_dir, exist_ok=True)
+    written = render_logs(args.log_files, start, end, args.output_dir, args.format, args.jobs, args.width)
+    print(f"wrote {len(written)} file(s) to {args.output_dir}")
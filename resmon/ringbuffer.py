@@ -0,0 +1,83 @@
+"""Preallocated in-memory sample columns."""
+import array
+
+
+class RingColumn:
+    """Fixed-capacity column of floats keeping the newest values.
+
+    Values are stored twice in a preallocated array of 2 * capacity doubles
+    (at i and i + capacity), so the newest n values are always one contiguous
+    run and slices are returned as zero-copy memoryviews. Indexing works like
+    a list holding the values oldest first.
+
+    Attributes:
+        capacity (int): Number of values kept.
+    """
+
+    def __init__(self, capacity):
+        """Initialize the RingColumn.
+
+        Args:
+            capacity (int): Number of values kept.
+        """
+        if capacity < 1:
+            raise ValueError("capacity must be at least 1")
+        self.capacity = capacity
+        self._values = array.array("d", bytes(16 * capacity))
+        self._view = memoryview(self._values)
+        self._next = 0
+        self._count = 0
+
+    def append(self, value):
+        """Add a value, dropping the oldest one once the column is full.
+
+        Args:
+            value (float): Value to add.
+        """
+        value = float(value)
+        self._values[self._next] = value
+        self._values[self._next + self.capacity] = value
+        self._next = (self._next + 1) % self.capacity
+        if self._count < self.capacity:
+            self._count += 1
+
+    def _start(self):
+        """Return the array index of the oldest value."""
+        return self._next + self.capacity - self._count
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, key):
+        """Return one value, or a memoryview over a slice of the values.
+
+        The memoryview shares memory with the column, so it shows later
+        appends once the ring wraps around; copy it to keep the values.
+        """
+        start = self._start()
+        if isinstance(key, slice):
+            first, stop, step = key.indices(self._count)
+            if step == 1:
+                stop = max(stop, first)
+            return self._view[start + first:start + stop:step]
+        if key < 0:
+            key += self._count
+        if not 0 <= key < self._count:
+            raise IndexError("RingColumn index out of range")
+        return self._values[start + key]
+
+    def __iter__(self):
+        return iter(self[:])
+
+    def view(self, count=None):
+        """Return the newest values as a zero-copy memoryview.
+
+        Args:
+            count (int, optional): Number of newest values. Defaults to all.
+
+        Returns:
+            memoryview: The values, oldest first.
+        """
+        if count is None or count >= self._count:
+            return self[:]
+        return self[self._count - count:]
@@ -0,0 +1,414 @@
+"""Downsampled rollup tiers kept next to the raw sample log.
+
+Every tier stores one record per period holding the mean of each metric under
+its own name plus ``<name>_min`` and ``<name>_max``. Tiers are written to
+``<log>.<tier>`` in the same format as the raw log and are updated
+incrementally as samples are written, so long history windows can be read
+from a tier with a few thousand records instead of every raw sample.
+
+Run ``python rollup.py rebuild LOG`` to build the tiers of an existing log.
+"""
+import argparse
+import bisect
+import datetime
+import math
+import numbers
+import os
+import threading
+
+import logstore
+from querycache import QueryCache
+
+# (suffix, period in seconds), finest first
+ROLLUP_TIERS = (("1m", 60), ("1h", 3600))
+# default number of points wanted on the x axis of a history plot
+DEFAULT_WIDTH = 1000
+# seconds a restarted writer looks back for the last bucket a tier wrote
+RESUME_WINDOW = 86400
+
+
+class Rollup:
+    """Running min/max/mean of every metric over the current period.
+
+    Samples are added by the log writer thread while history reads take the
+    open bucket's result from other threads, so both hold a lock.
+
+    Attributes:
+        period (int): Length of one bucket in seconds.
+        bucket (int): Number of the bucket being accumulated, or None.
+        count (int): Samples in the current bucket.
+        sums (dict): Sum of every metric in the current bucket.
+        mins (dict): Minimum of every metric in the current bucket.
+        maxs (dict): Maximum of every metric in the current bucket.
+    """
+
+    def __init__(self, period):
+        """Initialize the Rollup.
+
+        Args:
+            period (int): Length of one bucket in seconds.
+        """
+        self.period = period
+        self.bucket = None
+        self.count = 0
+        self.sums = {}
+        self.mins = {}
+        self.maxs = {}
+        self._lock = threading.Lock()
+
+    def add(self, record):
+        """Add a sample, closing the current bucket if the sample is past it.
+
+        Args:
+            record (dict): Sample values, with "time" as a datetime.
+
+        Returns:
+            dict: The closed bucket's rollup record, or None.
+        """
+        bucket = int(record["time"].timestamp() // self.period)
+        with self._lock:
+            return self._add(bucket, record)
+
+    def _add(self, bucket, record):
+        """Add a sample to bucket; the lock must be held."""
+        closed = None
+        if bucket != self.bucket:
+            closed = self._result()
+            self.bucket = bucket
+            self.count = 0
+            self.sums = {}
+            self.mins = {}
+            self.maxs = {}
+        self.count += 1
+        for key, value in record.items():
+            if (
+                key == "time"
+                or key in logstore.DOUBLE_COLUMNS
+                or not isinstance(value, numbers.Real)
+                or isinstance(value, bool)
+                or value != value
+            ):
+                continue
+            if key in self.sums:
+                self.sums[key] += value
+                self.mins[key] = min(self.mins[key], value)
+                self.maxs[key] = max(self.maxs[key], value)
+            else:
+                self.sums[key] = value
+                self.mins[key] = value
+                self.maxs[key] = value
+        return closed
+
+    def result(self):
+        """Return the rollup record of the current bucket so far, or None if empty."""
+        with self._lock:
+            return self._result()
+
+    def _result(self):
+        """Return the current bucket's rollup record; the lock must be held."""
+        if not self.count:
+            return None
+        record = {
+            "time": datetime.datetime.fromtimestamp(self.bucket * self.period)
+        }
+        for key in self.sums:
+            record[key] = self.sums[key] / self.count
+            record[f"{key}_min"] = self.mins[key]
+            record[f"{key}_max"] = self.maxs[key]
+        return record
+
+
+class RollupLog:
+    """A raw sample log together with its rollup tiers.
+
+    It can be used anywhere a logstore log is expected; writes go to the raw
+    log and every tier, reads pick the coarsest tier that still has enough
+    points for the requested width. Decoded reads are kept in a QueryCache,
+    so repeating a query only reads the records written since.
+
+    A bucket is written to its tier once a sample past it arrives, never
+    while it is open. Before its first write, a RollupLog folds the raw
+    samples logged after every tier's last bucket back in, so a restart
+    continues the open buckets of the previous run instead of writing a
+    second record for the same period.
+
+    Attributes:
+        log (logstore.JsonLog or logstore.BinaryLog): Raw sample log.
+        filename (str): Path of the raw log file.
+        tiers (list): (period, log, Rollup) for every tier, finest first.
+        cache (QueryCache): Decoded columns of recent reads.
+    """
+
+    def __init__(self, log, wrap_tier=None, cache=None):
+        """Initialize the RollupLog.
+
+        Args:
+            log (logstore.JsonLog or logstore.BinaryLog): Raw sample log.
+            wrap_tier (callable, optional): Applied to every tier log after
+                opening it, e.g. to rotate tiers like the raw log.
+            cache (QueryCache, optional): Cache for reads. Defaults to a new one.
+        """
+        self.log = log
+        self.filename = log.filename
+        self.cache = QueryCache() if cache is None else cache
+        self.tiers = []
+        for suffix, period in ROLLUP_TIERS:
+            tier_log = logstore.open_log(f"{log.filename}.{suffix}", log.log_format)
+            if wrap_tier is not None:
+                tier_log = wrap_tier(tier_log)
+            self.tiers.append((period, tier_log, Rollup(period)))
+        self._resumed = False
+
+    def _resume(self, until):
+        """Fold the raw samples logged after every tier's last bucket into the tiers.
+
+        Args:
+            until (datetime): Time of the first new sample; only older raw
+                samples are folded in.
+        """
+        lookback = until - datetime.timedelta(seconds=RESUME_WINDOW)
+        starts = []
+        for period, tier_log, rollup in self.tiers:
+            written = tier_log.read(lookback, [])["time"] if _on_disk(tier_log) else []
+            if written:
+                starts.append(written[-1] + datetime.timedelta(seconds=period))
+            else:
+                # start on a bucket boundary, so no partial bucket is written
+                first_bucket = -(-lookback.timestamp() // period)
+                starts.append(datetime.datetime.fromtimestamp(first_bucket * period))
+        if not _on_disk(self.log):
+            return
+        keys = logstore.stored_keys(self.log)
+        temp_data = self.log.read(min(starts), keys, until)
+        times = temp_data["time"]
+        last = bisect.bisect_left(times, until)
+        for (period, tier_log, rollup), start in zip(self.tiers, starts):
+            closed = []
+            for index in range(bisect.bisect_left(times, start), last):
+                record = {"time": times[index]}
+                for key in keys:
+                    record[key] = temp_data[key][index]
+                result = rollup.add(record)
+                if result is not None:
+                    closed.append(result)
+            if closed:
+                tier_log.write(closed)
+
+    def write(self, records):
+        """Write samples to the raw log and fold them into every tier.
+
+        Args:
+            records (list): Sample dicts, with "time" as a datetime.
+        """
+        if records and not self._resumed:
+            self._resumed = True
+            self._resume(records[0]["time"])
+        self.log.write(records)
+        for period, tier_log, rollup in self.tiers:
+            closed = []
+            for record in records:
+                result = rollup.add(record)
+                if result is not None:
+                    closed.append(result)
+            if closed:
+                tier_log.write(closed)
+
+    def flush(self, fsync=False):
+        """Flush the raw log and every tier."""
+        self.log.flush(fsync)
+        for period, tier_log, rollup in self.tiers:
+            tier_log.flush(fsync)
+
+    def close(self):
+        """Close every file.
+
+        The open buckets are not written; the next writer folds their
+        samples back in from the raw log.
+        """
+        for period, tier_log, rollup in self.tiers:
+            tier_log.close()
+        self.log.close()
+
+    def append(self, record):
+        """Append one sample and flush it.
+
+        Args:
+            record (dict): Sample values, with "time" as a datetime.
+        """
+        self.write([record])
+        self.flush()
+
+    def pick_tier(self, start, width=DEFAULT_WIDTH, end=None):
+        """Pick the coarsest tier that still gives width points since start.
+
+        Args:
+            start (datetime): Oldest entry time wanted.
+            width (int, optional): Points wanted on the x axis.
+            end (datetime, optional): Newest entry time wanted. Defaults to now.
+
+        Returns:
+            tuple: (period, log, Rollup) of the tier, or None for raw samples.
+        """
+        if end is None:
+            end = datetime.datetime.now()
+        span = (end - start).total_seconds()
+        for tier in reversed(self.tiers):
+            if span / tier[0] >= width:
+                return tier
+        return None
+
+    def read(self, start, y_data, width=DEFAULT_WIDTH, end=None):
+        """Read the given keys of every sample or rollup at or after start.
+
+        When a tier is used, the result also holds ``<key>_min`` and
+        ``<key>_max`` lists and ends with the still open bucket. A tier
+        lacking the start of the range, e.g. of a log written before tiers
+        existed, is filled in from the finer tiers and the raw log.
+
+        Args:
+           start (datetime): Oldest entry time to return.
+           y_data (list): Data keys to retrieve.
+           width (int, optional): Points wanted on the x axis.
+           end (datetime, optional): Newest entry time to return. Defaults to all.
+
+        Returns:
+           dict: Lists of values for every requested key plus "time".
+        """
+        tier = self.pick_tier(start, width, end)
+        if tier is None:
+            return self.cache.read(self.log, None, start, y_data, end)
+        return self._read_tier(self.tiers.index(tier), start, y_data, end)
+
+    def _read_tier(self, index, start, y_data, end, fold_period=None):
+        """Read a tier, reading the part before its first bucket from finer data.
+
+        Args:
+           index (int): Position of the tier in self.tiers.
+           start (datetime): Oldest entry time to return.
+           y_data (list): Data keys to retrieve.
+           end (datetime): Newest entry time to return, or None for all.
+           fold_period (int, optional): Bucket length raw samples are rolled
+               up into. Defaults to the tier's period.
+
+        Returns:
+           dict: Lists of values for every key, its min and max, plus "time".
+        """
+        period, tier_log, rollup = self.tiers[index]
+        keys = list(y_data)
+        for key in y_data:
+            keys += [f"{key}_min", f"{key}_max"]
+        if fold_period is None:
+            fold_period = period
+        if _on_disk(tier_log):
+            temp_data = self.cache.read(tier_log, period, start, keys, end)
+        else:
+            temp_data = {key: [] for key in keys + ["time"]}
+        current = rollup.result()
+        if current is not None and (
+            (end is not None and current["time"] > end) or not all(key in current for key in keys)
+        ):
+            current = None
+        if temp_data["time"]:
+            covered = temp_data["time"][0]
+        else:
+            covered = current["time"] if current is not None else None
+        # the first bucket of a complete tier starts at most a period after start
+        if covered is None or covered > start + datetime.timedelta(seconds=period):
+            gap_end = end if covered is None else covered - datetime.timedelta(microseconds=1)
+            if index > 0:
+                gap = self._read_tier(index - 1, start, y_data, gap_end, fold_period)
+            else:
+                gap = self._fold_raw(fold_period, start, y_data, gap_end)
+            for key in temp_data:
+                temp_data[key][:0] = gap[key]
+        if current is not None:
+            temp_data["time"].append(current["time"])
+            for key in keys:
+                temp_data[key].append(current[key])
+        return temp_data
+
+    def _fold_raw(self, period, start, y_data, end):
+        """Read raw samples and roll them up into buckets of period seconds.
+
+        Args:
+           period (int): Length of one bucket in seconds.
+           start (datetime): Oldest entry time to read.
+           y_data (list): Data keys to retrieve.
+           end (datetime): Newest entry time to read, or None for all.
+
+        Returns:
+           dict: Lists of values for every key, its min and max, plus "time".
+        """
+        raw = self.log.read(start, y_data, end)
+        records = []
+        rollup = Rollup(period)
+        for index, entry_date in enumerate(raw["time"]):
+            record = {"time": entry_date}
+            for key in y_data:
+                record[key] = raw[key][index]
+            result = rollup.add(record)
+            if result is not None:
+                records.append(result)
+        result = rollup.result()
+        if result is not None:
+            records.append(result)
+        temp_data = {"time": [record["time"] for record in records]}
+        for key in y_data:
+            for column in (key, f"{key}_min", f"{key}_max"):
+                temp_data[column] = [record.get(column, math.nan) for record in records]
+        return temp_data
+
+    def iter_records(self):
+        """Yield every raw sample in the log."""
+        return self.log.iter_records()
+
+
+def _on_disk(log):
+    """Return True if a log file, or a rotated segment of it, exists."""
+    if os.path.exists(log.filename):
+        return True
+    segments = getattr(log, "segments", None)
+    return segments is not None and bool(segments())
+
+
+def rebuild_rollups(filename):
+    """Recompute every rollup tier of an existing raw log.
+
+    The last bucket of every tier is left open, like a writer leaves it, so
+    a monitor writing on to the log continues it.
+
+    Args:
+        filename (str): Path of the raw log file.
+
+    Returns:
+        int: Number of raw samples read.
+    """
+    log = logstore.open_log(filename)
+    log_format = log.log_format
+    count = 0
+    tiers = []
+    for suffix, period in ROLLUP_TIERS:
+        tier_filename = f"{filename}.{suffix}"
+        for path in (tier_filename, logstore.index_filename(tier_filename)):
+            if os.path.exists(path):
+                os.remove(path)
+        logstore.forget_index(tier_filename)
+        tiers.append((logstore.open_log(tier_filename, log_format), Rollup(period)))
+    for record in log.iter_records():
+        count += 1
+        for tier_log, rollup in tiers:
+            result = rollup.add(record)
+            if result is not None:
+                tier_log.write([result])
+    for tier_log, rollup in tiers:
+        tier_log.close()
+    return count
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="resmon rollup tools")
+    commands = parser.add_subparsers(dest="command", required=True)
+    rebuild = commands.add_parser("rebuild", help="rebuild the rollup tiers of a log")
+    rebuild.add_argument("log_file")
+    args = parser.parse_args()
+    print(f"rolled up {rebuild_rollups(args.log_file)} samples")
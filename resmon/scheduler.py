@@ -0,0 +1,77 @@
+"""Fixed-rate sampling schedule on the monotonic clock."""
+import math
+import time
+
+
+class Scheduler:
+    """Keeps sampling ticks on a fixed grid of the monotonic clock.
+
+    Each tick is scheduled relative to the grid rather than to the end of the
+    previous tick, so the time spent sampling, drawing and logging does not
+    add up into drift. Ticks that start late are counted, and grid points
+    that were skipped entirely because a tick overran are counted as missed.
+
+    Attributes:
+        interval (float): Seconds between ticks.
+        late_threshold (float): Seconds a tick may start after its grid point before it counts as late.
+        ticks (int): Ticks run so far.
+        late (int): Ticks that started more than late_threshold after their grid point.
+        missed (int): Grid points skipped because the previous tick overran.
+        lateness (float): Seconds the last tick started after its grid point.
+    """
+
+    def __init__(self, interval, late_threshold=None):
+        """Initialize the Scheduler.
+
+        Args:
+            interval (float): Seconds between ticks.
+            late_threshold (float, optional): Defaults to a tenth of the interval.
+        """
+        if interval <= 0:
+            raise ValueError("interval must be positive")
+        self.interval = interval
+        self.late_threshold = interval / 10 if late_threshold is None else late_threshold
+        self.ticks = 0
+        self.late = 0
+        self.missed = 0
+        self.lateness = 0.0
+        self._next = None
+
+    def begin_tick(self):
+        """Mark the start of a tick and check how late it is.
+
+        Returns:
+            float: Seconds the tick started after its grid point.
+        """
+        now = time.monotonic()
+        if self._next is None:
+            self._next = now
+        self.ticks += 1
+        self.lateness = max(0.0, now - self._next)
+        if self.lateness > self.late_threshold:
+            self.late += 1
+        return self.lateness
+
+    def next_delay(self):
+        """Advance to the next grid point that is still ahead.
+
+        Returns:
+            float: Seconds to wait before the next tick.
+        """
+        now = time.monotonic()
+        if self._next is None:
+            self._next = now
+        self._next += self.interval
+        if now > self._next:
+            skipped = math.ceil((now - self._next) / self.interval)
+            self.missed += skipped
+            self._next += skipped * self.interval
+            print(f"Sampling fell behind, skipped {skipped} tick(s) ({self.missed} in total)")
+        return self._next - now
+
+    def summary(self):
+        """Return a one-line report of the schedule's timing so far."""
+        return (
+            f"{self.ticks} ticks every {self.interval:g}s, "
+            f"{self.late} late, {self.missed} missed"
+        )
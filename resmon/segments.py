@@ -0,0 +1,401 @@
+"""Log rotation into time-stamped segments, with compression and retention.
+
+The configured log file is always the active segment. When it grows past
+the size limit or its first sample gets older than the age limit it is
+renamed to ``<base>.<YYYYmmdd-HHMMSS>.<ext>`` after its first sample time,
+optionally compressed, and a new active file is started. Segments whose
+samples are all older than the retention period are deleted.
+
+History queries only open the segments whose time range overlaps the
+requested window. Uncompressed segments keep their time index or binary
+search; compressed ones are decompressed as a stream.
+"""
+import datetime
+import gzip
+import json
+import os
+import re
+import shutil
+import time
+
+import logstore
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+COMPRESSIONS = ("none", "gzip", "zstd")
+# errors of a segment that can not be read, e.g. one truncated while being written
+_READ_ERRORS = (OSError, EOFError) + ((zstandard.ZstdError,) if zstandard is not None else ())
+_EXTENSIONS = {"gzip": ".gz", "zstd": ".zst"}
+_STAMP_FORMAT = "%Y%m%d-%H%M%S"
+
+
+class RotationPolicy:
+    """When to rotate, how to compress, and how long to keep log segments.
+
+    Attributes:
+        max_bytes (int): Size of the active segment that triggers rotation, or 0.
+        max_age (float): Seconds after its first sample a segment is rotated, or 0.
+        compression (str): One of COMPRESSIONS, applied to closed segments.
+        retention (float): Seconds closed segments are kept after their last sample, or 0 to keep them all.
+    """
+
+    def __init__(
+        self,
+        max_bytes=64 * 1024**2,
+        max_age=86400,
+        compression="gzip",
+        retention=30 * 86400,
+    ):
+        """Initialize the RotationPolicy.
+
+        Args:
+            max_bytes (int, optional): Defaults to 64 MiB.
+            max_age (float, optional): Defaults to one day.
+            compression (str, optional): Defaults to "gzip".
+            retention (float, optional): Defaults to 30 days.
+        """
+        if compression not in COMPRESSIONS:
+            raise ValueError(f"unknown compression: {compression}")
+        if compression == "zstd" and zstandard is None:
+            raise ValueError("zstd compression needs the zstandard package")
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.compression = compression
+        self.retention = retention
+
+
+def _open_compressed(path):
+    """Open a closed segment for reading, decompressing it if needed."""
+    if path.endswith(".gz"):
+        return gzip.open(path, "rb")
+    if path.endswith(".zst"):
+        if zstandard is None:
+            raise OSError(f"reading {path} needs the zstandard package")
+        return zstandard.ZstdDecompressor().stream_reader(open(path, "rb"), closefd=True)
+    return open(path, "rb")
+
+
+def _compress(path, compression):
+    """Compress a closed segment next to itself and delete the original.
+
+    The compressed file is written under a temporary name and renamed into
+    place when complete, so readers never see a partial one.
+
+    Returns:
+        str: Path of the compressed segment.
+    """
+    target = path + _EXTENSIONS[compression]
+    partial = target + ".tmp"
+    with open(path, "rb") as source:
+        if compression == "gzip":
+            with gzip.open(partial, "wb") as destination:
+                shutil.copyfileobj(source, destination, 1024**2)
+        else:
+            with open(partial, "wb") as destination:
+                zstandard.ZstdCompressor().copy_stream(source, destination)
+    os.replace(partial, target)
+    os.remove(path)
+    return target
+
+
+def _iter_stream(f, log_format, start=None, end=None):
+    """Yield every sample of a log read sequentially from a file object.
+
+    Args:
+        f (file): Log opened for reading in binary mode.
+        log_format (str): Format of the log.
+        start (datetime, optional): Skip the samples before it. JSON lines
+            before it are not decoded beyond their timestamp.
+        end (datetime, optional): Stop at the first sample after it.
+    """
+    if log_format == "json":
+        for line in f:
+            if start is not None or end is not None:
+                entry_date = logstore.line_time(line)
+                if entry_date is not None:
+                    if start is not None and entry_date < start:
+                        continue
+                    if end is not None and entry_date > end:
+                        return
+            try:
+                entry = json.loads(line)
+                entry["time"] = logstore.parse_time(entry["time"])
+            except (json.JSONDecodeError, KeyError, TypeError, ValueError):
+                print("Skipping invalid or incomplete entry.")
+                continue
+            yield entry
+        return
+    header = logstore.read_binary_header(f)
+    if header is None:
+        return
+    columns = header[0]
+    record = logstore.binary_record(columns)
+    first = start.timestamp() if start is not None else None
+    last = end.timestamp() if end is not None else None
+    while True:
+        chunk = f.read(record.size * 4096)
+        chunk = chunk[: len(chunk) - len(chunk) % record.size]
+        if not chunk:
+            break
+        for values in record.iter_unpack(chunk):
+            if first is not None and values[0] < first:
+                continue
+            if last is not None and values[0] > last:
+                return
+            entry = {"time": datetime.datetime.fromtimestamp(values[0])}
+            entry.update(zip(columns, values[1:]))
+            yield entry
+
+
+class SegmentedLog:
+    """A log that rotates into segments according to a RotationPolicy.
+
+    It has the same interface as the logstore logs it wraps.
+
+    Attributes:
+        log (logstore.JsonLog or logstore.BinaryLog): Active segment.
+        filename (str): Path of the active segment.
+        log_format (str): Format of every segment.
+        policy (RotationPolicy): Rotation, compression and retention settings.
+    """
+
+    def __init__(self, log, policy):
+        """Initialize the SegmentedLog.
+
+        Args:
+            log (logstore.JsonLog or logstore.BinaryLog): Log to rotate.
+            policy (RotationPolicy): Rotation, compression and retention settings.
+        """
+        self.log = log
+        self.filename = log.filename
+        self.log_format = log.log_format
+        self.policy = policy
+        base, extension = os.path.splitext(self.filename)
+        self._base = base
+        self._extension = extension
+        self._pattern = re.compile(
+            re.escape(os.path.basename(base))
+            + r"\.(\d{8}-\d{6})"
+            + re.escape(extension)
+            + r"(\.gz|\.zst)?$"
+        )
+        self._active_start = None
+        self._retention_checked = False
+
+    def segments(self):
+        """List the closed segments, oldest first.
+
+        A segment that was just compressed and whose plain file is not
+        deleted yet is listed once, as the compressed file.
+
+        Returns:
+            list: (start timestamp, path) of every closed segment.
+        """
+        directory = os.path.dirname(self.filename) or "."
+        found = []
+        try:
+            names = os.listdir(directory)
+        except OSError:
+            return found
+        by_start = {}
+        for name in names:
+            match = self._pattern.match(name)
+            if match and (match.group(1) not in by_start or match.group(2)):
+                by_start[match.group(1)] = name
+        for stamp, name in by_start.items():
+            start = datetime.datetime.strptime(stamp, _STAMP_FORMAT)
+            found.append((start.timestamp(), os.path.join(directory, name)))
+        found.sort()
+        return found
+
+    def _first_time(self):
+        """Return the timestamp of the first sample in the active segment, or None."""
+        if self._active_start is None:
+            self._active_start = self._read_first_time()
+        return self._active_start
+
+    def _read_first_time(self):
+        """Read the timestamp of the first sample in the active segment on disk, or None.
+
+        Unlike _first_time() this is not cached, so it also holds when
+        another process rotated the log.
+        """
+        if os.path.exists(self.filename):
+            for record in self.log.iter_records():
+                return record["time"].timestamp()
+        return None
+
+    def _should_rotate(self):
+        """Check the active segment against the size and age limits."""
+        first = self._first_time()
+        if first is None:
+            return False
+        if self.policy.max_age and time.time() - first >= self.policy.max_age:
+            return True
+        if self.policy.max_bytes:
+            try:
+                return os.path.getsize(self.filename) >= self.policy.max_bytes
+            except OSError:
+                return False
+        return False
+
+    def rotate(self):
+        """Close the active segment, file it under its start time, and start a new one."""
+        first = self._first_time()
+        self.log.close()
+        if first is None:
+            return
+        stamp = datetime.datetime.fromtimestamp(first)
+        while True:
+            path = f"{self._base}.{stamp.strftime(_STAMP_FORMAT)}{self._extension}"
+            if not any(os.path.exists(path + suffix) for suffix in ("", ".gz", ".zst")):
+                break
+            stamp += datetime.timedelta(seconds=1)
+        os.replace(self.filename, path)
+        index = logstore.index_filename(self.filename)
+        logstore.forget_index(self.filename)
+        if self.policy.compression != "none":
+            _compress(path, self.policy.compression)
+            if os.path.exists(index):
+                os.remove(index)
+        elif os.path.exists(index):
+            os.replace(index, logstore.index_filename(path))
+        self.log = logstore.open_log(self.filename, self.log_format)
+        self._active_start = None
+        self._apply_retention()
+
+    def _apply_retention(self):
+        """Delete closed segments whose newest sample is past the retention period."""
+        if not self.policy.retention:
+            return
+        cutoff = time.time() - self.policy.retention
+        segments = self.segments()
+        for (start, path), (next_start, next_path) in zip(segments, segments[1:] + [(None, None)]):
+            end = next_start if next_start is not None else self._first_time()
+            if end is None or end >= cutoff:
+                break
+            try:
+                os.remove(path)
+                index = logstore.index_filename(path)
+                if os.path.exists(index):
+                    os.remove(index)
+            except OSError:
+                print("Could not delete old log segment:", path)
+
+    def write(self, records):
+        """Write samples to the active segment, rotating it first when due.
+
+        Args:
+            records (list): Sample dicts, with "time" as a datetime.
+        """
+        if not records:
+            return
+        if not self._retention_checked:
+            self._retention_checked = True
+            self._apply_retention()
+        if self._should_rotate():
+            self.rotate()
+        if self._active_start is None:
+            self._first_time()
+            if self._active_start is None:
+                self._active_start = records[0]["time"].timestamp()
+        self.log.write(records)
+
+    def flush(self, fsync=False):
+        """Flush the active segment."""
+        self.log.flush(fsync)
+
+    def close(self):
+        """Close the active segment."""
+        self.log.close()
+
+    def append(self, record):
+        """Append one sample and flush it.
+
+        Args:
+            record (dict): Sample values, with "time" as a datetime.
+        """
+        self.write([record])
+        self.flush()
+
+    def _overlapping(self, start, end=None):
+        """Return the paths of the closed segments with samples from start up to end.
+
+        Args:
+            start (float): Oldest timestamp wanted.
+            end (float, optional): Newest timestamp wanted. Defaults to all.
+        """
+        segments = self.segments()
+        paths = []
+        for (segment_start, path), (next_start, next_path) in zip(
+            segments, segments[1:] + [(None, None)]
+        ):
+            if end is not None and segment_start > end:
+                break
+            # the newest closed segment ends where the active one starts
+            segment_end = next_start if next_start is not None else self._read_first_time()
+            if segment_end is None or segment_end > start:
+                paths.append(path)
+        return paths
+
+    def iter_range(self, start, y_data, end=None):
+        """Stream the given keys of every sample from start up to end, segment by segment.
+
+        Compressed segments are decompressed as a stream; the others are
+        read like the active segment, seeking to start.
+
+        Args:
+           start (datetime): Oldest entry time to return.
+           y_data (list): Data keys to retrieve.
+           end (datetime, optional): Newest entry time to return. Defaults to all.
+
+        Yields:
+           tuple: (datetime, list of values for the keys in y_data).
+        """
+        last = end.timestamp() if end is not None else None
+        for path in self._overlapping(start.timestamp(), last):
+            if not path.endswith((".gz", ".zst")):
+                yield from logstore.open_log(path, self.log_format).iter_range(start, y_data, end)
+                continue
+            try:
+                with _open_compressed(path) as f:
+                    for entry in _iter_stream(f, self.log_format, start, end):
+                        try:
+                            values = [entry[key] for key in y_data]
+                        except KeyError:
+                            continue
+                        yield entry["time"], values
+            except _READ_ERRORS as error:
+                print("Could not read log segment:", error)
+        if last is not None:
+            active_start = self._read_first_time()
+            if active_start is None or active_start > last:
+                return
+        if os.path.exists(self.filename):
+            yield from self.log.iter_range(start, y_data, end)
+
+    def read(self, start, y_data, end=None):
+        """Read the given keys of every sample from start up to end from every overlapping segment.
+
+        Args:
+           start (datetime): Oldest entry time to return.
+           y_data (list): Data keys to retrieve.
+           end (datetime, optional): Newest entry time to return. Defaults to all.
+
+        Returns:
+           dict: Lists of values for every key in y_data plus "time".
+        """
+        return logstore.collect_data(self.iter_range(start, y_data, end), y_data)
+
+    def iter_records(self):
+        """Yield every sample of every segment, oldest first."""
+        for segment_start, path in self.segments():
+            try:
+                with _open_compressed(path) as f:
+                    yield from _iter_stream(f, self.log_format)
+            except _READ_ERRORS as error:
+                print("Could not read log segment:", error)
+        yield from self.log.iter_records()
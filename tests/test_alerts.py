@@ -0,0 +1,30 @@
+import datetime
+
+import alerts
+
+
+def make_rule(window):
+    return alerts.Rule({"name": "busy", "metric": "cpu_usage", "window": window, "above": 50})
+
+
+def test_rule_fires_when_interval_is_large_fraction_of_window():
+    # 60 s window sampled every 5 s, and a 3 s window sampled every second
+    for window, interval in ((60, 5), (3, 1)):
+        rule = make_rule(window)
+        states = [rule.update(tick * interval, 90.0) for tick in range(int(window / interval) + 2)]
+        assert "firing" in states
+
+
+def test_rule_waits_for_a_full_window():
+    rule = make_rule(60)
+    states = [rule.update(tick * 5, 90.0) for tick in range(12)]
+    assert states == [None] * 12
+    assert rule.update(60, 90.0) == "firing"
+
+
+def test_engine_skips_non_numeric_series():
+    engine = alerts.AlertEngine(
+        [alerts.Rule({"name": "procs", "metric": "top_processes", "window": 1, "above": 1})]
+    )
+    engine.evaluate({"time": datetime.datetime.now(), "top_processes": [("python", 12.0)]})
+    assert engine.rules[0].first_seen is None
@@ -0,0 +1,49 @@
+import datetime
+
+import logstore
+import rollup
+
+
+def test_long_read_of_log_without_tiers_falls_back_to_raw(tmp_path):
+    # written without RollupLog, like logs from before rollup tiers existed
+    filename = str(tmp_path / "log.bin")
+    raw = logstore.open_log(filename, "binary")
+    start = datetime.datetime(2024, 5, 1)
+    raw.write(
+        [
+            {"time": start + datetime.timedelta(seconds=second), "cpu_usage": float(second // 3600)}
+            for second in range(0, 48 * 3600, 10)
+        ]
+    )
+    raw.close()
+
+    log = rollup.RollupLog(logstore.open_log(filename))
+    end = start + datetime.timedelta(hours=48)
+    data = log.read(start, ["cpu_usage"], width=40, end=end)
+    assert len(data["time"]) == 48
+    assert data["time"][0] == start
+    assert data["cpu_usage"][:3] == [0.0, 1.0, 2.0]
+    assert data["cpu_usage_max"][-1] == 47.0
+
+
+def test_tier_gap_before_first_bucket_is_filled(tmp_path):
+    # three days written without tiers, more than a restart folds back in
+    filename = str(tmp_path / "log.bin")
+    start = datetime.datetime(2024, 5, 1)
+    raw = logstore.open_log(filename, "binary")
+    raw.write(
+        [{"time": start + datetime.timedelta(seconds=second), "cpu_usage": 1.0} for second in range(0, 72 * 3600, 10)]
+    )
+    raw.close()
+    log = rollup.RollupLog(logstore.open_log(filename))
+    log.write(
+        [
+            {"time": start + datetime.timedelta(seconds=second), "cpu_usage": 2.0}
+            for second in range(72 * 3600, 96 * 3600, 10)
+        ]
+    )
+    log.close()
+    data = log.read(start, ["cpu_usage"], width=1000, end=start + datetime.timedelta(hours=96))
+    assert len(data["time"]) == 96 * 60
+    assert data["time"] == sorted(data["time"])
+    assert data["cpu_usage"][0] == 1.0 and data["cpu_usage"][-1] == 2.0
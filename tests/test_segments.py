@@ -0,0 +1,38 @@
+import datetime
+import time
+
+import pytest
+
+import logstore
+import segments
+
+
+@pytest.mark.parametrize("log_format, compression", [("json", "gzip"), ("binary", "none")])
+def test_read_after_active_start_opens_no_closed_segment(tmp_path, monkeypatch, log_format, compression):
+    policy = segments.RotationPolicy(0, 0, compression, 0)
+    log = segments.SegmentedLog(logstore.open_log(str(tmp_path / "log"), log_format), policy)
+    start = int(time.time()) - 2 * 3600
+    for hour in range(2):
+        if hour:
+            log.rotate()
+        log.write(
+            [
+                {"time": datetime.datetime.fromtimestamp(start + hour * 3600 + second), "cpu_usage": 1.0}
+                for second in range(0, 3600, 10)
+            ]
+        )
+        log.flush()
+    log.close()
+    assert len(log.segments()) == 1
+    active_start = datetime.datetime.fromtimestamp(start + 3600)
+
+    opened = []
+    monkeypatch.setattr(segments, "_open_compressed", opened.append)
+    monkeypatch.setattr(logstore, "open_log", lambda path, *args: opened.append(path))
+    data = log.read(active_start + datetime.timedelta(minutes=30), ["cpu_usage"])
+    monkeypatch.undo()
+    assert opened == []
+    assert len(data["time"]) == 180
+
+    data = log.read(active_start - datetime.timedelta(minutes=30), ["cpu_usage"])
+    assert len(data["time"]) == 540